@@ -9,34 +9,51 @@ import uuid
 import cv2
 import numpy as np
 import pymysql
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, date, timedelta
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 
+try:
+    from flask_sock import Sock
+except ImportError:  # /api/recognize/stream is disabled; kiosks fall back to /api/recognize
+    Sock = None
+
 from config import (
     DATASET_DIR,
     MODELS_DIR,
-    MODEL_PATH,
-    LABELS_PATH,
     EXPORTS_DIR,
     UPLOADS_DIR,
     ALLOWED_EXTENSIONS,
     CONFIDENCE_THRESHOLD,
     LOCATION_ACCURACY_THRESHOLD,
     FRONTEND_BUILD_DIR,
+    BATCH_MAX_FRAMES,
+    BATCH_DECODE_WORKERS,
+    CLASSROOM_MIN_FACE_SIZE,
+    FACE_IMAGE_SIZE,
+    SAMPLE_STORE_ENABLED,
+    ATTENDANCE_BULK_MAX,
 )
-from db import get_connection
+from db import get_connection, get_pool_stats
+import attendance
+import attendance_summary
+from kiosk_stream import KioskSession
+from location_cache import get_registered_locations, save_locations, get_campus as get_cached_campus, \
+    invalidate_campus, get_cache_stats
+from face_detect import face_detector, detect_faces, get_detector_stats, warm_up as warm_up_detector
+from face_recognize import recognize_faces_sharded, build_roster, crop_faces, match_crops, recognition_results
+from model_registry import get_active_model, reload_async, get_model_stats
+from sample_store import get_sample_store
+from train_jobs import submit_training, get_job, get_training_stats
 from utils.location_utils import is_near_registered_location, is_within_campus
-from export_utils import export_to_excel, get_students_attendance_for_export, get_staff_attendance_for_export
+from export_cache import cached_export, get_export_cache_stats
+from export_utils import EXPORT_FORMATS
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB for ID card
 
-_recognizer = None
-_id_to_name = None
-
-
 @app.route("/", methods=["GET"])
 def index():
     """Serve built React frontend index if available, else show backend message."""
@@ -63,26 +80,21 @@ def frontend_assets(filename):
     return send_from_directory(assets_dir, filename)
 
 
-def get_recognizer():
-    global _recognizer, _id_to_name
-    if _recognizer is None and os.path.isfile(MODEL_PATH) and os.path.isfile(LABELS_PATH):
-        _recognizer = cv2.face.LBPHFaceRecognizer_create()
-        _recognizer.read(MODEL_PATH)
-        with open(LABELS_PATH, "r") as f:
-            meta = json.load(f)
-            _id_to_name = {int(k): v for k, v in meta.get("id_to_name", {}).items()}
-    return _recognizer, _id_to_name
+def get_model():
+    """Active model snapshot (version, recognizer, id_to_name), or None if not trained yet."""
+    return get_active_model()
 
 
-def invalidate_recognizer():
-    global _recognizer, _id_to_name
-    _recognizer = None
-    _id_to_name = None
+def get_recognizer():
+    model = get_active_model()
+    if model is None:
+        return None, None
+    return model.recognizer, model.id_to_name
 
 
-def get_face_detector():
-    path = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
-    return cv2.CascadeClassifier(path)
+def invalidate_recognizer():
+    """Load the newly published model in the background and swap it in; the old one keeps serving."""
+    reload_async()
 
 
 def get_display_name(conn, user_id):
@@ -99,6 +111,35 @@ def get_display_name(conn, user_id):
     return str(user_id)
 
 
+def decode_image_bytes(img_data):
+    """Decode raw image bytes to a grayscale array (None if not an image)."""
+    return cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def decode_image(image_b64):
+    """Decode a base64 image (optionally a data URL) to a grayscale array."""
+    return decode_image_bytes(base64.b64decode(image_b64.split(",")[-1] if "," in image_b64 else image_b64))
+
+
+def check_locations(user_ids, lat, lon):
+    """
+    Resolve registered locations and the campus boundary once for a set of users (cached, see location_cache).
+    Users without a registered location get the current one saved. Returns {user_id: location_ok}.
+    """
+    location_ok = {uid: True for uid in user_ids}
+    if not user_ids or lat is None or lon is None:
+        return location_ok
+    locations = get_registered_locations(user_ids)
+    save_locations({uid: (lat, lon) for uid in user_ids if uid not in locations})
+    campus = get_cached_campus()
+    in_campus = True
+    if campus:
+        in_campus = is_within_campus(lat, lon, *campus)
+    for uid, (reg_lat, reg_lon) in locations.items():
+        location_ok[uid] = is_near_registered_location(lat, lon, reg_lat, reg_lon, LOCATION_ACCURACY_THRESHOLD)
+    return {uid: ok and in_campus for uid, ok in location_ok.items()}
+
+
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -374,12 +415,18 @@ def update_student(user_id):
     if not updates:
         return jsonify({"error": "No fields to update"}), 400
     params.append(user_id)
+    # Daily summary counts follow the student to their new class teacher / department
+    regroup = "class_teacher_id" in data or "department_id" in data
     with get_connection() as conn:
         with conn.cursor() as cur:
+            if regroup:
+                attendance_summary.detach_users(cur, [user_id])
             cur.execute(
                 f"UPDATE students SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s",
                 params,
             )
+            if regroup:
+                attendance_summary.attach_users(cur, [user_id])
     return jsonify({"ok": True})
 
 
@@ -399,12 +446,17 @@ def update_staff(user_id):
     if not updates:
         return jsonify({"error": "No fields to update"}), 400
     params.append(user_id)
+    regroup = "department_id" in data
     with get_connection() as conn:
         with conn.cursor() as cur:
+            if regroup:
+                attendance_summary.detach_users(cur, [user_id])
             cur.execute(
                 f"UPDATE staff SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s",
                 params,
             )
+            if regroup:
+                attendance_summary.attach_users(cur, [user_id])
     return jsonify({"ok": True})
 
 
@@ -422,7 +474,9 @@ def set_student_class_teacher(user_id):
             return jsonify({"error": "Invalid class_teacher_id"}), 400
     with get_connection() as conn:
         with conn.cursor() as cur:
+            attendance_summary.detach_users(cur, [user_id])
             cur.execute("UPDATE students SET class_teacher_id = %s, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s", (class_teacher_id, user_id))
+            attendance_summary.attach_users(cur, [user_id])
     return jsonify({"ok": True})
 
 
@@ -434,14 +488,13 @@ def register_face():
     image_b64 = data.get("image")
     lat = data.get("latitude")
     lon = data.get("longitude")
+    reset = bool(data.get("reset"))  # First sample of a (semester) re-registration: drop the old samples
     if not user_id or not image_b64:
         return jsonify({"error": "user_id and image required"}), 400
     with get_connection() as conn:
         display_name = get_display_name(conn, user_id)
         if not display_name:
             return jsonify({"error": "User not found"}), 404
-    user_dir = os.path.join(DATASET_DIR, str(user_id))
-    os.makedirs(user_dir, exist_ok=True)
     try:
         img_data = base64.b64decode(image_b64.split(",")[-1] if "," in image_b64 else image_b64)
         img = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_GRAYSCALE)
@@ -449,22 +502,30 @@ def register_face():
         return jsonify({"error": str(e)}), 400
     if img is None:
         return jsonify({"error": "Invalid image"}), 400
-    cascade = get_face_detector()
-    faces = cascade.detectMultiScale(img, scaleFactor=1.2, minNeighbors=5, minSize=(80, 80))
+    with face_detector() as cascade:
+        faces = detect_faces(cascade, img)
     if len(faces) == 0:
         return jsonify({"error": "No face detected", "captured": False}), 400
     x, y, w, h = faces[0]
-    face_roi = cv2.resize(img[y:y+h, x:x+w], (200, 200))
-    count = len([f for f in os.listdir(user_dir) if f.lower().endswith((".jpg", ".png", ".jpeg"))])
-    path = os.path.join(user_dir, f"{display_name.replace(' ', '_')}_{count+1:03d}.jpg")
-    cv2.imwrite(path, face_roi)
+    face_roi = cv2.resize(img[y:y+h, x:x+w], FACE_IMAGE_SIZE)
+    if SAMPLE_STORE_ENABLED:
+        os.makedirs(DATASET_DIR, exist_ok=True)
+        store = get_sample_store()
+        if reset:
+            store.remove_user(int(user_id))
+        count = store.append(int(user_id), face_roi) - 1
+    else:
+        user_dir = os.path.join(DATASET_DIR, str(user_id))
+        os.makedirs(user_dir, exist_ok=True)
+        if reset:
+            for f in os.listdir(user_dir):
+                if f.lower().endswith((".jpg", ".png", ".jpeg")):
+                    os.remove(os.path.join(user_dir, f))
+        count = len([f for f in os.listdir(user_dir) if f.lower().endswith((".jpg", ".png", ".jpeg"))])
+        path = os.path.join(user_dir, f"{display_name.replace(' ', '_')}_{count+1:03d}.jpg")
+        cv2.imwrite(path, face_roi)
     if count == 0 and lat is not None and lon is not None:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "INSERT INTO user_locations (user_id, latitude, longitude, registered_at) VALUES (%s, %s, %s, %s)",
-                    (user_id, lat, lon, datetime.utcnow().isoformat()),
-                )
+        save_locations({int(user_id): (lat, lon)})
     with get_connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
@@ -483,13 +544,18 @@ def register_face():
 # ---------- Train model ----------
 @app.route("/api/train", methods=["POST"])
 def train_model():
-    try:
-        from model_train import train_and_save_model
-        train_and_save_model()
-        invalidate_recognizer()
-        return jsonify({"ok": True, "message": "Model trained successfully"})
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    """Queue a background training job; poll /api/train/<job_id> for progress."""
+    data = request.get_json(silent=True) or {}
+    job, coalesced = submit_training(full=bool(data.get("full")), on_complete=invalidate_recognizer)
+    return jsonify({"ok": True, "job_id": job["id"], "status": job["status"], "coalesced": coalesced, "job": job}), 202
+
+
+@app.route("/api/train/<job_id>", methods=["GET"])
+def train_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"job": job})
 
 
 # ---------- Recognize ----------
@@ -499,58 +565,172 @@ def recognize_face():
     image_b64 = data.get("image")
     lat = data.get("latitude")
     lon = data.get("longitude")
+    shard = data.get("shard")  # Optional "department:<id>", "class_teacher:<id>" or "group:<name>"
     if not image_b64:
         return jsonify({"error": "image required"}), 400
-    recognizer, id_to_name = get_recognizer()
-    if recognizer is None:
+    model = get_model()
+    if model is None:
         return jsonify({"error": "Model not trained yet"}), 503
     try:
-        img = cv2.imdecode(
-            np.frombuffer(base64.b64decode(image_b64.split(",")[-1] if "," in image_b64 else image_b64), np.uint8),
-            cv2.IMREAD_GRAYSCALE,
-        )
+        img = decode_image(image_b64)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
     if img is None:
         return jsonify({"error": "Invalid image"}), 400
-    cascade = get_face_detector()
-    faces = cascade.detectMultiScale(img, scaleFactor=1.2, minNeighbors=5, minSize=(80, 80))
+    with face_detector() as cascade:
+        faces = detect_faces(cascade, img)
     if len(faces) == 0:
-        return jsonify({"recognized": False, "message": "No face detected"})
-    x, y, w, h = faces[0]
-    face_roi = cv2.resize(img[y:y+h, x:x+w], (200, 200))
-    label_id, conf = recognizer.predict(face_roi)
-    acc_pct = max(0, 100 - conf)
-    if label_id not in id_to_name or conf > CONFIDENCE_THRESHOLD:
-        return jsonify({"recognized": False, "confidence": acc_pct})
-    user_name = id_to_name[label_id]
-    location_ok = True
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT latitude, longitude FROM user_locations WHERE user_id = %s ORDER BY registered_at DESC LIMIT 1",
-                (label_id,),
-            )
-            loc = cur.fetchone()
-            if loc and lat is not None and lon is not None:
-                location_ok = is_near_registered_location(lat, lon, loc["latitude"], loc["longitude"], LOCATION_ACCURACY_THRESHOLD)
-            elif not loc and lat is not None and lon is not None:
-                cur.execute(
-                    "INSERT INTO user_locations (user_id, latitude, longitude, registered_at) VALUES (%s, %s, %s, %s)",
-                    (label_id, lat, lon, datetime.utcnow().isoformat()),
-                )
-            cur.execute(
-                "SELECT center_lat, center_lon, radius_meters FROM campus_boundaries WHERE is_active = 1 LIMIT 1"
-            )
-            campus = cur.fetchone()
-    if campus and lat is not None and lon is not None:
-        location_ok = location_ok and is_within_campus(lat, lon, campus["center_lat"], campus["center_lon"], campus["radius_meters"])
+        return jsonify({"recognized": False, "message": "No face detected", "model_version": model.version})
+    results, shard_used = recognize_faces_sharded(img, faces[:1], model, shard, CONFIDENCE_THRESHOLD)
+    result = results[0]
+    if not result["recognized"]:
+        return jsonify({"recognized": False, "confidence": result["confidence"], "shard": shard_used,
+                        "model_version": model.version})
+    label_id = result["user_id"]
+    location_ok = check_locations({label_id}, lat, lon)[label_id]
     return jsonify({
         "recognized": True,
         "user_id": label_id,
-        "name": user_name,
-        "confidence": acc_pct,
+        "name": result["name"],
+        "confidence": result["confidence"],
         "location_ok": location_ok,
+        "shard": shard_used,
+        "matched_in": result.get("matched_in", "global"),
+        "model_version": model.version,
+    })
+
+
+def _detect_frame(payload, decode):
+    """Decode a batch frame, detect faces and crop them (runs in a worker thread)."""
+    try:
+        img = decode(payload)
+    except Exception as e:
+        return {"error": str(e)}
+    if img is None:
+        return {"error": "Invalid image"}
+    with face_detector() as cascade:
+        faces = detect_faces(cascade, img)
+    return {"boxes": faces, "crops": crop_faces(img, faces)}
+
+
+@app.route("/api/recognize/batch", methods=["POST"])
+def recognize_batch():
+    """
+    Recognize every face in many frames in one request.
+    JSON: {"images": [base64, ...], "latitude", "longitude"} or multipart "frames" JPEG files.
+    """
+    if request.files:
+        payloads = [f.read() for f in request.files.getlist("frames")]
+        lat = request.form.get("latitude", type=float)
+        lon = request.form.get("longitude", type=float)
+        decode = decode_image_bytes
+    else:
+        data = request.json or {}
+        payloads = data.get("images") or []
+        lat = data.get("latitude")
+        lon = data.get("longitude")
+        decode = decode_image
+    if not payloads:
+        return jsonify({"error": "images required"}), 400
+    if len(payloads) > BATCH_MAX_FRAMES:
+        return jsonify({"error": f"At most {BATCH_MAX_FRAMES} frames per batch"}), 400
+    model = get_model()
+    if model is None:
+        return jsonify({"error": "Model not trained yet"}), 503
+    with ThreadPoolExecutor(max_workers=min(BATCH_DECODE_WORKERS, len(payloads))) as pool:
+        detected = list(pool.map(lambda p: _detect_frame(p, decode), payloads))
+    # Every face of every frame is matched against the gallery in one vectorised call
+    crops = [d["crops"] for d in detected if "crops" in d]
+    labels, dists = match_crops(np.concatenate(crops) if crops else np.empty((0,) + FACE_IMAGE_SIZE[::-1], np.uint8),
+                                model.recognizer)
+    frames, offset = [], 0
+    for d in detected:
+        if "error" in d:
+            frames.append({"error": d["error"]})
+            continue
+        n = len(d["crops"])
+        frames.append({"faces": recognition_results(labels[offset:offset + n], dists[offset:offset + n],
+                                                    d["boxes"], model.id_to_name, CONFIDENCE_THRESHOLD)})
+        offset += n
+    user_ids = {f["user_id"] for fr in frames for f in fr.get("faces", []) if f["recognized"]}
+    location_ok = check_locations(user_ids, lat, lon)
+    for i, fr in enumerate(frames):
+        fr["index"] = i
+        for f in fr.get("faces", []):
+            if f["recognized"]:
+                f["location_ok"] = location_ok[f["user_id"]]
+    return jsonify({
+        "frames": frames,
+        "faces_detected": sum(len(fr.get("faces", [])) for fr in frames),
+        "model_version": model.version,
+    })
+
+
+# ---------- Kiosk stream ----------
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route("/api/recognize/stream")
+    def recognize_stream(ws):
+        """
+        Binary JPEG frames in, JSON events out. Text messages configure the session:
+        {"type": "config", "latitude", "longitude", "shard"}. Every frame is acked with
+        {"type": "frame"}; "recognized" / "cleared" are pushed when the smoothed identity changes.
+        """
+        session = KioskSession(get_model, check_locations)
+        while True:
+            message = ws.receive()
+            if message is None:
+                break
+            for event in session.handle(message):
+                ws.send(json.dumps(event))
+
+
+# ---------- Classroom snapshot ----------
+@app.route("/api/recognize/classroom", methods=["POST"])
+def recognize_classroom():
+    """
+    Recognize every face in one wide-angle frame and return a deduped roster.
+    JSON: {"image": base64, "latitude", "longitude", "shard"} or multipart "frame" JPEG file.
+    """
+    if "frame" in request.files:
+        payload = request.files["frame"].read()
+        lat = request.form.get("latitude", type=float)
+        lon = request.form.get("longitude", type=float)
+        shard = request.form.get("shard")
+        decode = decode_image_bytes
+    else:
+        data = request.json or {}
+        payload = data.get("image")
+        lat = data.get("latitude")
+        lon = data.get("longitude")
+        shard = data.get("shard")
+        decode = decode_image
+    if not payload:
+        return jsonify({"error": "image required"}), 400
+    model = get_model()
+    if model is None:
+        return jsonify({"error": "Model not trained yet"}), 503
+    try:
+        img = decode(payload)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    if img is None:
+        return jsonify({"error": "Invalid image"}), 400
+    with face_detector() as cascade:
+        faces = detect_faces(cascade, img, scale_factor=1.1, min_size=CLASSROOM_MIN_FACE_SIZE)
+    results, shard_used = recognize_faces_sharded(img, faces, model, shard, CONFIDENCE_THRESHOLD)
+    roster, duplicates = build_roster(results)
+    location_ok = check_locations({entry["user_id"] for entry in roster}, lat, lon)
+    for entry in roster:
+        entry["location_ok"] = location_ok[entry["user_id"]]
+    return jsonify({
+        "roster": roster,
+        "faces_detected": len(results),
+        "unknown_faces": sum(1 for r in results if not r["recognized"]),
+        "duplicate_faces": duplicates,
+        "shard": shard_used,
+        "model_version": model.version,
     })
 
 
@@ -566,42 +746,74 @@ def mark_attendance():
     on_campus = 1 if data.get("location_ok", True) else 0
     if not user_id or not user_name:
         return jsonify({"error": "user_id and user_name required"}), 400
+    try:
+        result = attendance.mark(user_id, attendance_type, lat, lon, on_campus)
+    except FutureTimeoutError:
+        # Still queued in the write-behind buffer; it is written once the database catches up
+        kind = "OUT" if attendance_type == "out" else "IN"
+        return jsonify({"message": f"{user_name} {kind} accepted, recording pending", "pending": True}), 202
+    if result["status"] == attendance.NOT_IN:
+        return jsonify({"error": "Must mark IN first"}), 400
+    if result["status"] == attendance.ALREADY:
+        return jsonify({"message": f"Already marked {result['type'].upper()} at {result['time']}"})
+    return jsonify({"message": attendance.describe(result, user_name)})
+
+
+
+@app.route("/api/attendance/mark/bulk", methods=["POST"])
+def mark_attendance_bulk():
+    """
+    Mark a class roster / roll call in one transaction.
+    Body: {"entries": [{"user_id", "type", "latitude", "longitude", "location_ok", "user_name"}, ...]};
+    top-level "type", "latitude", "longitude" and "location_ok" are defaults for every entry.
+    Returns one result per entry, in order, with status marked | already | not_in | unknown_user | invalid.
+    """
+    data = request.json or {}
+    entries = data.get("entries")
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"error": "entries required"}), 400
+    if len(entries) > ATTENDANCE_BULK_MAX:
+        return jsonify({"error": f"At most {ATTENDANCE_BULK_MAX} entries per request"}), 400
     now = datetime.utcnow()
-    today = now.date().isoformat()
-    ts = now.time().strftime("%H:%M:%S")
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, in_time, out_time FROM attendance WHERE user_id = %s AND date = %s",
-                (user_id, today),
-            )
-            row = cur.fetchone()
-            if row:
-                rec_id, in_time, out_time = row["id"], row["in_time"], row["out_time"]
-                if attendance_type == "in":
-                    if in_time:
-                        return jsonify({"message": f"Already marked IN at {in_time}"})
-                    cur.execute(
-                        "UPDATE attendance SET in_time = %s, status = 'partial', latitude = %s, longitude = %s, on_campus = %s WHERE id = %s",
-                        (ts, lat, lon, on_campus, rec_id),
-                    )
-                else:
-                    if out_time:
-                        return jsonify({"message": f"Already marked OUT at {out_time}"})
-                    if not in_time:
-                        return jsonify({"error": "Must mark IN first"}), 400
-                    cur.execute("UPDATE attendance SET out_time = %s, status = 'present' WHERE id = %s", (ts, rec_id))
-            else:
-                if attendance_type == "in":
-                    cur.execute(
-                        """INSERT INTO attendance (user_id, date, in_time, status, latitude, longitude, on_campus, created_at)
-                           VALUES (%s, %s, %s, 'partial', %s, %s, %s, %s)""",
-                        (user_id, today, ts, lat, lon, on_campus, now.isoformat()),
-                    )
-                else:
-                    return jsonify({"error": "Must mark IN first"}), 400
-    return jsonify({"message": f"{user_name} marked {attendance_type.upper()} at {ts}"})
-
+    results = [None] * len(entries)
+    marks = []  # (entry index, mark)
+    for i, entry in enumerate(entries):
+        entry = entry if isinstance(entry, dict) else {}
+        attendance_type = entry.get("type", data.get("type", "in"))
+        try:
+            user_id = int(entry.get("user_id"))
+        except (TypeError, ValueError):
+            results[i] = {"user_id": entry.get("user_id"), "type": attendance_type, "status": "invalid",
+                          "time": None, "message": "user_id required"}
+            continue
+        if attendance_type not in ("in", "out"):
+            results[i] = {"user_id": user_id, "type": attendance_type, "status": "invalid", "time": None,
+                          "message": "type must be 'in' or 'out'"}
+            continue
+        on_campus = 1 if entry.get("location_ok", data.get("location_ok", True)) else 0
+        marks.append((i, attendance.new_mark(user_id, attendance_type, entry.get("latitude", data.get("latitude")),
+                                             entry.get("longitude", data.get("longitude")), on_campus, now)))
+    if marks:
+        user_ids = sorted({m["user_id"] for _, m in marks})
+        placeholders = ", ".join(["%s"] * len(user_ids))
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                # Unknown users are reported per entry instead of failing the whole transaction on the FK
+                cur.execute(f"SELECT id FROM users WHERE id IN ({placeholders})", user_ids)
+                known = {int(row["id"]) for row in cur.fetchall()}
+                valid = [(i, m) for i, m in marks if m["user_id"] in known]
+                written = attendance.apply_marks(cur, [m for _, m in valid]) if valid else []
+        for i, m in marks:
+            if m["user_id"] not in known:
+                results[i] = {"user_id": m["user_id"], "type": m["type"], "status": "unknown_user", "time": None,
+                              "message": f"Unknown user {m['user_id']}"}
+        for (i, m), result in zip(valid, written):
+            name = entries[i].get("user_name") or f"User {m['user_id']}"
+            results[i] = dict(result, message=attendance.describe(result, name))
+    summary = {}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    return jsonify({"results": results, "summary": summary})
 
 # ---------- Attendance list ----------
 @app.route("/api/attendance", methods=["GET"])
@@ -640,28 +852,32 @@ def attendance_stats():
     user_id = request.args.get("user_id", type=int)
     start = request.args.get("start", date.today().isoformat())
     end = request.args.get("end", date.today().isoformat())
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            if role == "class_teacher" and user_id:
-                cur.execute("""
-                    SELECT a.date, a.status, COUNT(*) as cnt FROM attendance a
-                    JOIN students s ON s.user_id = a.user_id
-                    WHERE s.class_teacher_id = %s AND a.date BETWEEN %s AND %s
-                    GROUP BY a.date, a.status
-                """, (user_id, start, end))
-            else:
-                cur.execute("""
-                    SELECT date, status, COUNT(*) as cnt FROM attendance
-                    WHERE date BETWEEN %s AND %s
-                    GROUP BY date, status
-                """, (start, end))
-            rows = cur.fetchall()
+    try:
+        rows = attendance_summary.daily_counts(role, user_id, start, end)
+    except pymysql.err.ProgrammingError:
+        # attendance_daily_summary not created yet: aggregate the raw rows
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                if role == "class_teacher" and user_id:
+                    cur.execute("""
+                        SELECT a.date, a.status, COUNT(*) as cnt FROM attendance a
+                        JOIN students s ON s.user_id = a.user_id
+                        WHERE s.class_teacher_id = %s AND a.date BETWEEN %s AND %s
+                        GROUP BY a.date, a.status
+                    """, (user_id, start, end))
+                else:
+                    cur.execute("""
+                        SELECT date, status, COUNT(*) as cnt FROM attendance
+                        WHERE date BETWEEN %s AND %s
+                        GROUP BY date, status
+                    """, (start, end))
+                rows = cur.fetchall()
     by_date = {}
     for r in rows:
-        d, status, cnt = r
+        d = r["date"].isoformat()
         if d not in by_date:
             by_date[d] = {"present": 0, "partial": 0, "absent": 0}
-        by_date[d][status] = cnt
+        by_date[d][r["status"]] = int(r["cnt"])
     return jsonify({"stats": by_date, "start": start, "end": end})
 
 
@@ -673,11 +889,14 @@ def export_attendance():
     start = request.args.get("start", date.today().isoformat())
     end = request.args.get("end", date.today().isoformat())
     export_type = request.args.get("export_type", "students")  # students | staff
+    fmt = request.args.get("format", "xlsx")  # xlsx | csv | ndjson
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
     try:
-        path = export_to_excel(role, user_id, start, end, export_type)
-        return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+        chunks, mimetype, filename = cached_export(role, user_id, start, end, export_type, fmt)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    return Response(chunks, mimetype=mimetype, headers={"Content-Disposition": f"attachment; filename={filename}"})
 
 
 # ---------- Campus ----------
@@ -706,6 +925,7 @@ def set_campus():
                 "INSERT INTO campus_boundaries (name, center_lat, center_lon, radius_meters) VALUES (%s, %s, %s, %s)",
                 (name, lat, lon, radius),
             )
+    invalidate_campus()
     return jsonify({"ok": True})
 
 
@@ -798,6 +1018,14 @@ def get_staff_record(user_id):
     return jsonify(rec)
 
 
+# ---------- Metrics ----------
+@app.route("/api/metrics", methods=["GET"])
+def metrics():
+    return jsonify({"detector": get_detector_stats(), "db_pool": get_pool_stats(), "training": get_training_stats(),
+                    "model": get_model_stats(), "location_cache": get_cache_stats(),
+                    "attendance_writer": attendance.get_writer_stats(), "export_cache": get_export_cache_stats()})
+
+
 @app.route("/uploads/<path:filename>")
 def serve_upload(filename):
     return send_from_directory(UPLOADS_DIR, filename)
@@ -819,4 +1047,6 @@ if __name__ == "__main__":
                 cur.execute("SELECT 1 FROM users LIMIT 1")
     except Exception:
         ensure_db()
+    warm_up_detector()
+    get_active_model()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,296 @@
+"""
+FaceSense - Attendance marking.
+Single implementation behind /api/attendance/mark, face_recognize.log_attendance and the daemon.
+IN is one INSERT ... ON DUPLICATE KEY UPDATE that only fills in_time when it is still empty, and
+OUT is one conditional UPDATE, so concurrent kiosks cannot race between a read and a write.
+With ATTENDANCE_WRITE_BEHIND, marks submitted while a write is in flight are grouped into the next
+multi-row statement (one write for the whole group during the morning rush).
+"""
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pymysql
+
+from config import ATTENDANCE_WRITE_BEHIND, ATTENDANCE_BATCH_SIZE, ATTENDANCE_WRITE_TIMEOUT
+from db import get_connection
+import attendance_summary
+
+# Result "status" values
+MARKED = "marked"
+ALREADY = "already"  # IN / OUT was already recorded today; "time" is the recorded one
+NOT_IN = "not_in"  # OUT without an IN for the day
+
+_SAVEPOINT = "facesense_marks"
+
+_cond = threading.Condition()
+_pending = []  # (mark, future), oldest first
+_worker = None
+_stats = {"marks": 0, "flushes": 0, "rows_per_flush_max": 0, "retried_singly": 0, "failures": 0}
+
+
+def new_mark(user_id: int, attendance_type: str, lat: Optional[float] = None, lon: Optional[float] = None,
+             on_campus: int = 1, now: Optional[datetime] = None) -> Dict:
+    """An attendance mark stamped with the current UTC date and time."""
+    now = now or datetime.utcnow()
+    return {
+        "user_id": int(user_id),
+        "type": "out" if attendance_type == "out" else "in",
+        "date": now.date().isoformat(),
+        "time": now.time().strftime("%H:%M:%S"),
+        "latitude": lat,
+        "longitude": lon,
+        "on_campus": on_campus,
+        "created_at": now.isoformat(),
+    }
+
+
+def _fmt_time(value) -> Optional[str]:
+    """TIME column (timedelta in PyMySQL) -> "HH:MM:SS"."""
+    if value is None:
+        return None
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return str(value)
+
+
+def _result(mark: Dict, status: str, time: Optional[str]) -> Dict:
+    return {"user_id": mark["user_id"], "type": mark["type"], "status": status, "time": time}
+
+
+# ---------- Statements ----------
+
+def _upsert_in(cur, marks: List[Dict]) -> int:
+    """Multi-row IN. An existing row only takes the new time/location if in_time is still empty."""
+    rows = ", ".join(["(%s, %s, %s, 'partial', %s, %s, %s, %s)"] * len(marks))
+    params = []
+    for m in marks:
+        params += [m["user_id"], m["date"], m["time"], m["latitude"], m["longitude"], m["on_campus"], m["created_at"]]
+    # Assignments run left to right, so in_time must be updated last
+    cur.execute(
+        f"""INSERT INTO attendance (user_id, date, in_time, status, latitude, longitude, on_campus, created_at)
+            VALUES {rows}
+            ON DUPLICATE KEY UPDATE
+                latitude = IF(in_time IS NULL, VALUES(latitude), latitude),
+                longitude = IF(in_time IS NULL, VALUES(longitude), longitude),
+                on_campus = IF(in_time IS NULL, VALUES(on_campus), on_campus),
+                status = IF(in_time IS NULL, VALUES(status), status),
+                in_time = IF(in_time IS NULL, VALUES(in_time), in_time)""",
+        params,
+    )
+    return cur.rowcount
+
+
+def _update_out(cur, date: str, marks: List[Dict]) -> int:
+    """Multi-row OUT for one date: only rows with an IN and no OUT yet are touched."""
+    cases = " ".join(["WHEN %s THEN %s"] * len(marks))
+    placeholders = ", ".join(["%s"] * len(marks))
+    params = []
+    for m in marks:
+        params += [m["user_id"], m["time"]]
+    cur.execute(
+        f"""UPDATE attendance SET out_time = CASE user_id {cases} END, status = 'present'
+            WHERE date = %s AND user_id IN ({placeholders}) AND in_time IS NOT NULL AND out_time IS NULL""",
+        params + [date] + [m["user_id"] for m in marks],
+    )
+    return cur.rowcount
+
+
+def _bump_versions(cur, dates):
+    """Bump attendance_versions for dates whose rows changed, so cached exports of them are rebuilt."""
+    rows = ", ".join(["(%s, 1)"] * len(dates))
+    try:
+        cur.execute(
+            f"INSERT INTO attendance_versions (date, version) VALUES {rows} ON DUPLICATE KEY UPDATE version = version + 1",
+            sorted(dates),
+        )
+    except pymysql.err.ProgrammingError:
+        pass  # Table not created yet (run database/init_db.py); export caching stays off until then
+
+
+def _read_rows(cur, date: str, user_ids: List[int], lock: bool = False) -> Dict[int, Dict]:
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    cur.execute(
+        f"""SELECT user_id, in_time, out_time FROM attendance WHERE date = %s AND user_id IN ({placeholders})
+            {"FOR UPDATE" if lock else ""}""",
+        [date] + list(user_ids),
+    )
+    return {int(row["user_id"]): row for row in cur.fetchall()}
+
+
+def _write(cur, kind: str, date: str, marks: List[Dict]) -> int:
+    return _upsert_in(cur, marks) if kind == "in" else _update_out(cur, date, marks)
+
+
+def _outcome(mark: Dict, row: Optional[Dict]) -> Dict:
+    """Result the write has for mark given its row as it was just before the write."""
+    if mark["type"] == "in":
+        if row and row["in_time"] is not None:
+            return _result(mark, ALREADY, _fmt_time(row["in_time"]))
+        return _result(mark, MARKED, mark["time"])
+    if not (row and row["in_time"] is not None):
+        return _result(mark, NOT_IN, None)
+    if row["out_time"] is not None:
+        return _result(mark, ALREADY, _fmt_time(row["out_time"]))
+    return _result(mark, MARKED, mark["time"])
+
+
+def _expected_rows(mark: Dict, row: Optional[Dict]) -> int:
+    """Affected-row count of mark's row if it is unchanged at write time (ODKU: 1 insert, 2 update)."""
+    if _outcome(mark, row)["status"] != MARKED:
+        return 0
+    return 1 if mark["type"] == "out" or row is None else 2
+
+
+def _apply_one(cur, kind: str, date: str, mark: Dict) -> Tuple[Dict, int]:
+    """Single-row statement: its affected-row count alone says whether this mark was recorded."""
+    affected = _write(cur, kind, date, [mark])
+    if affected:
+        return _result(mark, MARKED, mark["time"]), affected
+    # Nothing written: the row only supplies the time already recorded (or shows there was no IN)
+    return _outcome(mark, _read_rows(cur, date, [mark["user_id"]]).get(mark["user_id"])), 0
+
+
+def _apply_chunk(cur, kind: str, date: str, marks: List[Dict]) -> Tuple[List[Dict], int]:
+    """
+    One multi-row statement for marks of one type and date -> (results, rows affected).
+    The rows are read and locked first; the statement's affected-row count must equal what those rows
+    predict, otherwise (a row appeared meanwhile) it is undone and every mark is written on its own.
+    """
+    if len(marks) == 1:
+        result, affected = _apply_one(cur, kind, date, marks[0])
+        return [result], affected
+    before = _read_rows(cur, date, [m["user_id"] for m in marks], lock=True)
+    cur.execute(f"SAVEPOINT {_SAVEPOINT}")
+    affected = _write(cur, kind, date, marks)
+    if affected == sum(_expected_rows(m, before.get(m["user_id"])) for m in marks):
+        return [_outcome(m, before.get(m["user_id"])) for m in marks], affected
+    cur.execute(f"ROLLBACK TO SAVEPOINT {_SAVEPOINT}")
+    singles = [_apply_one(cur, kind, date, m) for m in marks]
+    return [r for r, _ in singles], sum(n for _, n in singles)
+
+
+def apply_marks(cur, marks: List[Dict]) -> List[Dict]:
+    """
+    Write marks on an open cursor (caller owns the transaction) and return one result per mark:
+    {"user_id", "type", "status": marked | already | not_in, "time"}. INs are written before OUTs,
+    so an IN and OUT for the same user in one call both apply. Outcomes come from affected-row
+    counts (see _apply_chunk), never from comparing recorded times.
+    attendance_versions and attendance_daily_summary are updated in the same transaction.
+    """
+    results = [None] * len(marks)
+    first = {}  # (user_id, date, type) -> index of the first mark; repeats resolve to "already"
+    groups = {}  # (type, date) -> [index]
+    for i, m in enumerate(marks):
+        key = (m["user_id"], m["date"], m["type"])
+        if key in first:
+            continue
+        first[key] = i
+        groups.setdefault((m["type"], m["date"]), []).append(i)
+
+    changed = set()  # dates with at least one written row
+    for (kind, day), idx in sorted(groups.items(), key=lambda g: g[0][0] != "in"):
+        for start in range(0, len(idx), ATTENDANCE_BATCH_SIZE):
+            chunk = idx[start:start + ATTENDANCE_BATCH_SIZE]
+            chunk_results, affected = _apply_chunk(cur, kind, day, [marks[i] for i in chunk])
+            if affected:
+                changed.add(day)
+            for i, result in zip(chunk, chunk_results):
+                results[i] = result
+    if changed:
+        _bump_versions(cur, changed)
+
+    for i, m in enumerate(marks):
+        if results[i] is None:
+            done = results[first[(m["user_id"], m["date"], m["type"])]]
+            results[i] = _result(m, ALREADY if done["status"] == MARKED else done["status"], done["time"])
+    attendance_summary.record_marks(cur, marks, results)
+    return results
+
+
+def write_marks(marks: List[Dict]) -> List[Dict]:
+    """apply_marks() in its own transaction."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            return apply_marks(cur, marks)
+
+
+# ---------- Write-behind buffer ----------
+
+def _flush(batch):
+    marks = [m for m, _ in batch]
+    try:
+        results = write_marks(marks)
+    except Exception as e:
+        if len(batch) == 1:
+            with _cond:
+                _stats["failures"] += 1
+            batch[0][1].set_exception(e)
+            return
+        # One bad row (e.g. unknown user) must not fail everyone else's mark
+        with _cond:
+            _stats["retried_singly"] += len(batch)
+        for item in batch:
+            _flush([item])
+        return
+    for (_, future), result in zip(batch, results):
+        future.set_result(result)
+
+
+def _worker_loop():
+    while True:
+        with _cond:
+            while not _pending:
+                _cond.wait()
+            batch = _pending[:ATTENDANCE_BATCH_SIZE]
+            del _pending[:ATTENDANCE_BATCH_SIZE]
+            _stats["flushes"] += 1
+            _stats["rows_per_flush_max"] = max(_stats["rows_per_flush_max"], len(batch))
+        # Marks arriving while this write runs are grouped into the next one
+        _flush(batch)
+
+
+def submit(mark: Dict) -> Future:
+    """Queue a mark for the write-behind buffer. The future resolves to its apply_marks() result."""
+    global _worker
+    future = Future()
+    with _cond:
+        if _worker is None:
+            _worker = threading.Thread(target=_worker_loop, name="facesense-attendance", daemon=True)
+            _worker.start()
+        _pending.append((mark, future))
+        _stats["marks"] += 1
+        _cond.notify()
+    return future
+
+
+def mark(user_id: int, attendance_type: str, lat: Optional[float] = None, lon: Optional[float] = None,
+         on_campus: int = 1) -> Dict:
+    """
+    Mark one user IN/OUT now and wait for the outcome (through the buffer when ATTENDANCE_WRITE_BEHIND).
+    Raises concurrent.futures.TimeoutError after ATTENDANCE_WRITE_TIMEOUT; the mark stays queued and is still written.
+    """
+    m = new_mark(user_id, attendance_type, lat, lon, on_campus)
+    if not ATTENDANCE_WRITE_BEHIND:
+        return write_marks([m])[0]
+    return submit(m).result(timeout=ATTENDANCE_WRITE_TIMEOUT)
+
+
+def describe(result: Dict, user_name: str) -> str:
+    """Human-readable outcome, e.g. "Jane Doe marked IN at 09:02:11"."""
+    kind = result["type"].upper()
+    if result["status"] == MARKED:
+        return f"{user_name} marked {kind} at {result['time']}"
+    if result["status"] == ALREADY:
+        return f"{user_name} already marked {kind} at {result['time']}"
+    return f"{user_name} must mark IN first"
+
+
+def get_writer_stats() -> dict:
+    with _cond:
+        stats = dict(_stats)
+        stats["pending"] = len(_pending)
+    stats["write_behind"] = ATTENDANCE_WRITE_BEHIND
+    return stats
@@ -0,0 +1,444 @@
+"""
+FaceSense - Headless multi-camera attendance daemon.
+Runs N camera or video-file sources through a pipeline of stages connected by bounded queues:
+
+    capture (1 thread / source) -> detect (worker pool) -> recognize (batched) -> attendance writer
+
+Live cameras drop frames under backpressure (DAEMON_DROP_POLICY) so latency stays bounded;
+video files block instead, so a recorded run is reproducible. Per-stage throughput is printed
+every DAEMON_METRICS_INTERVAL seconds.
+
+    python attendance_daemon.py 0=in 1=out
+    python attendance_daemon.py recordings/gate.mp4=in --dry-run
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Ensure project root (where config.py lives) is on sys.path when run as a script
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from config import (
+    CONFIDENCE_THRESHOLD, DAEMON_QUEUE_SIZE, DAEMON_DETECT_WORKERS, DAEMON_RECOGNIZE_BATCH,
+    DAEMON_DROP_POLICY, DAEMON_FRAME_STRIDE, DAEMON_MIN_HITS, DAEMON_MARK_COOLDOWN_SECONDS,
+    DAEMON_METRICS_INTERVAL, ATTENDANCE_WRITE_BEHIND, ATTENDANCE_WRITE_TIMEOUT,
+)
+import attendance
+from face_detect import face_detector, detect_faces
+from face_recognize import crop_faces, match_crops, recognition_results
+from location_cache import get_campus
+from model_registry import get_active_model
+from utils.location_utils import is_within_campus
+
+_STOP = object()  # End-of-stream sentinel passed down the pipeline
+_POLL_SECONDS = 0.2  # Blocked queue operations re-check for a failed stage this often
+
+
+class Source:
+    """A camera index or video file, with the attendance type it marks: "0=in", "gate.mp4=out"."""
+
+    def __init__(self, index: int, spec: str):
+        self.index = index
+        target, _, att_type = spec.partition("=")
+        self.attendance_type = att_type or "in"
+        if self.attendance_type not in ("in", "out"):
+            raise RuntimeError(f"Source {spec!r}: attendance type must be 'in' or 'out'")
+        if target.startswith("camera:"):
+            target = target[len("camera:"):]
+        self.is_camera = target.isdigit()
+        self.target = int(target) if self.is_camera else target
+        self.name = f"camera:{target}" if self.is_camera else os.path.basename(target)
+        if not self.is_camera and not os.path.isfile(target):
+            raise RuntimeError(f"Video file not found: {target}")
+
+
+class StageMetrics:
+    """Counters for one stage; snapshot() turns them into rates."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.dropped = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items_in=0, items_out=0, dropped=0, busy=0.0):
+        with self._lock:
+            self.items_in += items_in
+            self.items_out += items_out
+            self.dropped += dropped
+            self.busy_seconds += busy
+
+    def snapshot(self, elapsed: float) -> Dict:
+        with self._lock:
+            return {
+                "in": self.items_in,
+                "out": self.items_out,
+                "dropped": self.dropped,
+                "per_sec": round(self.items_in / elapsed, 1) if elapsed > 0 else 0.0,
+                "busy_seconds": round(self.busy_seconds, 2),
+            }
+
+
+def put_with_policy(q: queue.Queue, item, policy: str, metrics: StageMetrics,
+                    abort: Optional[threading.Event] = None) -> bool:
+    """
+    Enqueue under backpressure: "block" waits (giving up once abort is set), "newest" drops the
+    incoming item, "oldest" evicts the head of the queue so the freshest frame wins.
+    Returns False if the item was dropped.
+    """
+    if policy == "block":
+        while not (abort and abort.is_set()):
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        metrics.add(dropped=1)
+        return False
+    while True:
+        try:
+            q.put_nowait(item)
+            return True
+        except queue.Full:
+            if policy == "newest":
+                metrics.add(dropped=1)
+                return False
+            try:
+                q.get_nowait()
+                metrics.add(dropped=1)
+            except queue.Empty:
+                pass
+
+
+class AttendanceDaemon:
+    """Owns the queues, stage threads and metrics for one run."""
+
+    def __init__(self, sources: List[Source], detect_workers: int = DAEMON_DETECT_WORKERS,
+                 batch_size: int = DAEMON_RECOGNIZE_BATCH, dry_run: bool = False,
+                 lat: Optional[float] = None, lon: Optional[float] = None):
+        self.sources = sources
+        self.detect_workers = max(1, detect_workers)
+        self.batch_size = max(1, batch_size)
+        self.dry_run = dry_run
+        self.lat = lat
+        self.lon = lon
+        self.frames = queue.Queue(maxsize=DAEMON_QUEUE_SIZE)
+        self.detections = queue.Queue(maxsize=DAEMON_QUEUE_SIZE)
+        self.marks = queue.Queue()  # Small events; never dropped
+        self.stop_event = threading.Event()  # Stop capturing; queued work is still drained
+        self.failed = threading.Event()  # A stage hit a fatal error: queued work is abandoned too
+        self.error = None
+        self.metrics = {name: StageMetrics(name) for name in ("capture", "detect", "recognize", "write")}
+        self.marked = []  # (source, user_id, name, type, message)
+        self._hits = {}  # (source index, user_id) -> (hits, first_seen)
+        self._last_mark = {}  # (user_id, type) -> monotonic time
+        self._started = None
+
+    # ---------- stages ----------
+    def _fail(self, stage: str, error: Exception):
+        """Fatal stage error: stop every source and let each stage exit instead of waiting on a dead one."""
+        print(f"[ERROR] {stage} stage failed: {error}")
+        if self.error is None:
+            self.error = f"{stage}: {error}"
+        self.failed.set()
+        self.stop_event.set()
+
+    def _get(self, q: queue.Queue):
+        """Next item from q, or _STOP once a stage has failed."""
+        while not self.failed.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return _STOP
+
+    def _capture(self, source: Source):
+        cap = cv2.VideoCapture(source.target)
+        if not cap.isOpened():
+            print(f"[ERROR] Cannot open source {source.name}")
+            return
+        policy = DAEMON_DROP_POLICY if source.is_camera else "block"
+        frame_index = 0
+        try:
+            while not self.stop_event.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    if source.is_camera:
+                        time.sleep(0.05)
+                        continue
+                    break
+                frame_index += 1
+                if frame_index % DAEMON_FRAME_STRIDE:
+                    continue
+                t0 = time.perf_counter()
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                self.metrics["capture"].add(items_in=1, items_out=1, busy=time.perf_counter() - t0)
+                put_with_policy(self.frames, (source, frame_index, gray), policy, self.metrics["capture"], self.failed)
+        except Exception as e:
+            print(f"[ERROR] Source {source.name} stopped: {e}")
+        finally:
+            cap.release()
+
+    def _detect(self):
+        try:
+            with face_detector() as cascade:  # One detector per worker for the whole run
+                while True:
+                    item = self._get(self.frames)
+                    if item is _STOP:
+                        return
+                    self._detect_frame(cascade, *item)
+        except Exception as e:
+            self._fail("detect", e)  # e.g. the detector backend failed to load
+
+    def _detect_frame(self, cascade, source: Source, frame_index: int, gray):
+        t0 = time.perf_counter()
+        try:
+            boxes = detect_faces(cascade, gray)
+            crops = crop_faces(gray, boxes) if len(boxes) else None
+        except Exception as e:
+            print(f"[WARN] [{source.name}] Frame {frame_index} skipped: {e}")
+            self.metrics["detect"].add(items_in=1, dropped=1)
+            return
+        self.metrics["detect"].add(items_in=1, items_out=int(crops is not None), busy=time.perf_counter() - t0)
+        if crops is not None:
+            policy = DAEMON_DROP_POLICY if source.is_camera else "block"
+            put_with_policy(self.detections, (source, frame_index, boxes, crops), policy, self.metrics["detect"],
+                            self.failed)
+
+    def _next_batch(self) -> Tuple[list, bool]:
+        """Block for one detection, then take whatever else is queued up to the batch size."""
+        batch = []
+        item = self._get(self.detections)
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+        while len(batch) < self.batch_size:
+            try:
+                item = self.detections.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _recognize(self):
+        done = False
+        try:
+            while not done:
+                batch, done = self._next_batch()
+                if batch:
+                    self._recognize_batch(batch)
+        finally:
+            self.marks.put(_STOP)
+
+    def _recognize_batch(self, batch: list):
+        try:
+            model = get_active_model()
+        except Exception as e:
+            print(f"[WARN] Model unavailable, {len(batch)} frames skipped: {e}")
+            model = None
+        if model is None:
+            self.metrics["recognize"].add(items_in=len(batch), dropped=len(batch))
+            return
+        t0 = time.perf_counter()
+        events = 0
+        try:
+            # Every face of every frame in the batch is matched in one call
+            all_crops = np.concatenate([crops for _, _, _, crops in batch])
+            labels, dists = match_crops(all_crops, model.recognizer)
+            offset = 0
+            for source, frame_index, boxes, crops in batch:
+                n = len(crops)
+                results = recognition_results(labels[offset:offset + n], dists[offset:offset + n], boxes,
+                                              model.id_to_name, CONFIDENCE_THRESHOLD)
+                offset += n
+                for r in results:
+                    if r["recognized"] and self._confirm(source, r["user_id"]):
+                        self.marks.put((source, r["user_id"], r["name"], r["confidence"]))
+                        events += 1
+        except Exception as e:
+            print(f"[WARN] Recognition failed, {len(batch)} frames skipped: {e}")
+            self.metrics["recognize"].add(items_in=len(batch), items_out=events, dropped=len(batch))
+            return
+        self.metrics["recognize"].add(items_in=len(batch), items_out=events, busy=time.perf_counter() - t0)
+
+    def _confirm(self, source: Source, user_id: int) -> bool:
+        """Mark only after DAEMON_MIN_HITS sightings on one source, once per cooldown per (user, type)."""
+        now = time.monotonic()
+        key = (source.index, user_id)
+        hits, first_seen = self._hits.get(key, (0, now))
+        if now - first_seen > DAEMON_MARK_COOLDOWN_SECONDS:
+            hits, first_seen = 0, now
+        hits += 1
+        self._hits[key] = (hits, first_seen)
+        if hits < DAEMON_MIN_HITS:
+            return False
+        mark_key = (user_id, source.attendance_type)
+        last = self._last_mark.get(mark_key)
+        if last is not None and now - last < DAEMON_MARK_COOLDOWN_SECONDS:
+            return False
+        self._last_mark[mark_key] = now
+        self._hits.pop(key, None)
+        return True
+
+    def _write(self):
+        stopping = False
+        while not stopping:
+            items = [self._get(self.marks)]
+            # Marks queued meanwhile (several cameras at the morning rush) are written as one group
+            while True:
+                try:
+                    items.append(self.marks.get_nowait())
+                except queue.Empty:
+                    break
+            if any(item is _STOP for item in items):
+                stopping = True
+                items = [item for item in items if item is not _STOP]
+            if not items:
+                continue
+            t0 = time.perf_counter()
+            try:
+                msgs = self._write_marks(items)
+            except Exception as e:
+                msgs = [f"{name}: attendance write failed: {e}" for _, _, name, _ in items]
+            self.metrics["write"].add(items_in=len(items), items_out=len(items), busy=time.perf_counter() - t0)
+            for (source, user_id, name, confidence), msg in zip(items, msgs):
+                self.marked.append((source.name, user_id, name, source.attendance_type, msg))
+                print(f"[INFO] [{source.name}] {msg}")
+
+    def _write_marks(self, items: list) -> List[str]:
+        """One message per (source, user_id, name, confidence) item."""
+        if self.dry_run:
+            return [f"{name} would be marked {source.attendance_type.upper()} ({confidence:.0f}%)"
+                    for source, user_id, name, confidence in items]
+        on_campus = self._on_campus()
+        marks = [attendance.new_mark(user_id, source.attendance_type, self.lat, self.lon, on_campus)
+                 for source, user_id, name, confidence in items]
+        if not ATTENDANCE_WRITE_BEHIND:
+            # Already a batch: one transaction, same statements as the buffer would issue
+            return [attendance.describe(result, name)
+                    for (_, _, name, _), result in zip(items, attendance.write_marks(marks))]
+        futures = [attendance.submit(m) for m in marks]
+        msgs = []
+        for (source, user_id, name, confidence), future in zip(items, futures):
+            try:
+                msgs.append(attendance.describe(future.result(timeout=ATTENDANCE_WRITE_TIMEOUT), name))
+            except Exception as e:
+                msgs.append(f"{name}: attendance write failed: {e}")
+        return msgs
+
+    def _put_stop(self, q: queue.Queue):
+        """End-of-stream marker for a stage that is still running (skipped once a stage has failed)."""
+        while not self.failed.is_set():
+            try:
+                q.put(_STOP, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def _on_campus(self) -> int:
+        """
+        on_campus for marks from the fixed --latitude/--longitude: checked against the active campus
+        boundary (cached). Without coordinates there is nothing to check and marks count as on campus.
+        """
+        if self.lat is None or self.lon is None:
+            return 1
+        try:
+            campus = get_campus()
+        except Exception as e:
+            print(f"[WARN] Campus boundary unavailable, marks not checked: {e}")
+            return 1
+        return 1 if not campus or is_within_campus(self.lat, self.lon, *campus) else 0
+
+    # ---------- control ----------
+    def stats(self) -> Dict:
+        elapsed = time.monotonic() - self._started if self._started else 0.0
+        stats = {name: m.snapshot(elapsed) for name, m in self.metrics.items()}
+        stats["queues"] = {"frames": self.frames.qsize(), "detections": self.detections.qsize(), "marks": self.marks.qsize()}
+        stats["elapsed_seconds"] = round(elapsed, 1)
+        stats["error"] = self.error
+        return stats
+
+    def print_stats(self):
+        s = self.stats()
+        stages = " | ".join(
+            f"{name} {s[name]['per_sec']}/s (drop {s[name]['dropped']})" for name in ("capture", "detect", "recognize", "write")
+        )
+        print(f"[INFO] {stages} | queues {s['queues']}")
+
+    def run(self, metrics_interval: float = DAEMON_METRICS_INTERVAL) -> Dict:
+        """
+        Run until every file source ends (cameras run until Ctrl+C) or a stage fails.
+        Returns the final stats; "error" is set if a stage failed.
+        """
+        get_active_model()  # Load the model before frames arrive
+        self._started = time.monotonic()
+        captures = [threading.Thread(target=self._capture, args=(s,), name=f"capture-{s.name}", daemon=True)
+                    for s in self.sources]
+        detectors = [threading.Thread(target=self._detect, name=f"detect-{i}", daemon=True)
+                     for i in range(self.detect_workers)]
+        recognizer = threading.Thread(target=self._recognize, name="recognize", daemon=True)
+        writer = threading.Thread(target=self._write, name="attendance-writer", daemon=True)
+        for t in captures + detectors + [recognizer, writer]:
+            t.start()
+        next_report = time.monotonic() + metrics_interval
+        try:
+            while any(t.is_alive() for t in captures) and not self.failed.is_set():
+                for t in captures:
+                    t.join(timeout=0.2)
+                if metrics_interval and time.monotonic() >= next_report:
+                    self.print_stats()
+                    next_report = time.monotonic() + metrics_interval
+        except KeyboardInterrupt:
+            print("[INFO] Stopping...")
+            self.stop_event.set()
+        for t in captures:
+            t.join()  # Returns promptly once stop_event is set
+        # Drain: each stage forwards the end-of-stream marker once its inputs are exhausted
+        for _ in detectors:
+            self._put_stop(self.frames)
+        for t in detectors:
+            t.join()
+        self._put_stop(self.detections)
+        recognizer.join()
+        writer.join()
+        self.print_stats()
+        if self.error:
+            print(f"[ERROR] Stopped early: {self.error}")
+        return self.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FaceSense headless attendance daemon")
+    parser.add_argument("sources", nargs="+", help="Camera index or video file, optionally =in / =out (default in)")
+    parser.add_argument("--detect-workers", type=int, default=DAEMON_DETECT_WORKERS)
+    parser.add_argument("--batch", type=int, default=DAEMON_RECOGNIZE_BATCH, help="Frames per recognition batch")
+    parser.add_argument("--dry-run", action="store_true", help="Print marks instead of writing attendance")
+    parser.add_argument("--latitude", type=float, help="Fixed camera location stored with marks and checked against the campus boundary")
+    parser.add_argument("--longitude", type=float)
+    parser.add_argument("--metrics-interval", type=float, default=DAEMON_METRICS_INTERVAL)
+    args = parser.parse_args()
+
+    sources = [Source(i, spec) for i, spec in enumerate(args.sources)]
+    if get_active_model() is None:
+        print("[ERROR] Model not found. Train first by running model_train.py")
+        sys.exit(1)
+    daemon = AttendanceDaemon(sources, args.detect_workers, args.batch, args.dry_run, args.latitude, args.longitude)
+    if daemon.run(args.metrics_interval)["error"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
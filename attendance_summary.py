@@ -0,0 +1,172 @@
+"""
+FaceSense - Pre-aggregated daily attendance counts.
+attendance_daily_summary holds COUNT(*) per (date, role, class_teacher_id, department_id, status), so
+/api/attendance/stats reads a few rows per day instead of scanning attendance.
+attendance.apply_marks updates it in the same transaction as every mark; moving a student to another
+class teacher / department moves their counts with them. database/init_db.py fills it from existing
+attendance when it creates the table; rebuild it by hand with:
+
+    python attendance_summary.py backfill [start end]
+"""
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import pymysql
+
+from db import get_connection
+
+# Who a row counts for; 0 stands for "none" (the columns are part of the primary key).
+# Queries group by position: the aliases clash with the students / staff column names.
+_DIMENSIONS = """
+    u.role AS role,
+    COALESCE(s.class_teacher_id, 0) AS class_teacher_id,
+    COALESCE(s.department_id, st.department_id, 0) AS department_id
+"""
+_DIMENSION_JOINS = """
+    JOIN users u ON u.id = a.user_id
+    LEFT JOIN students s ON s.user_id = a.user_id
+    LEFT JOIN staff st ON st.user_id = a.user_id
+"""
+
+
+def _apply_deltas(cur, deltas: Dict[tuple, int]):
+    """deltas: {(date, role, class_teacher_id, department_id, status): +/-n}."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    rows = ", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(deltas))
+    params = []
+    for key, delta in sorted(deltas.items(), key=lambda kv: tuple(str(v) for v in kv[0])):
+        params += list(key) + [delta]
+    try:
+        cur.execute(
+            f"""INSERT INTO attendance_daily_summary (date, role, class_teacher_id, department_id, status, cnt)
+                VALUES {rows}
+                ON DUPLICATE KEY UPDATE cnt = cnt + VALUES(cnt)""",
+            params,
+        )
+    except pymysql.err.ProgrammingError:
+        pass  # Table not created yet (run database/init_db.py, then backfill)
+
+
+def _user_dimensions(cur, user_ids: Iterable[int]) -> Dict[int, tuple]:
+    user_ids = sorted(set(user_ids))
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    cur.execute(
+        f"""SELECT u.id AS user_id, {_DIMENSIONS} FROM users u
+            LEFT JOIN students s ON s.user_id = u.id
+            LEFT JOIN staff st ON st.user_id = u.id
+            WHERE u.id IN ({placeholders})""",
+        user_ids,
+    )
+    return {int(r["user_id"]): (r["role"], r["class_teacher_id"], r["department_id"]) for r in cur.fetchall()}
+
+
+def record_marks(cur, marks: List[Dict], results: List[Dict]):
+    """
+    Count marks that changed a row: IN starts a row as 'partial', OUT moves it from 'partial' to 'present'.
+    (An IN that fills a row created by hand with another status is only corrected by a backfill.)
+    """
+    written = [(m, r) for m, r in zip(marks, results) if r["status"] == "marked"]
+    if not written:
+        return
+    dims = _user_dimensions(cur, (m["user_id"] for m, _ in written))
+    deltas = defaultdict(int)
+    for m, r in written:
+        if m["user_id"] not in dims:
+            continue
+        key = (m["date"],) + dims[m["user_id"]]
+        if r["type"] == "in":
+            deltas[key + ("partial",)] += 1
+        else:
+            deltas[key + ("partial",)] -= 1
+            deltas[key + ("present",)] += 1
+    _apply_deltas(cur, deltas)
+
+
+def _user_counts(cur, user_ids: List[int], sign: int) -> Dict[tuple, int]:
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    cur.execute(
+        f"""SELECT a.date, {_DIMENSIONS}, a.status, COUNT(*) AS cnt FROM attendance a
+            {_DIMENSION_JOINS}
+            WHERE a.user_id IN ({placeholders})
+            GROUP BY 1, 2, 3, 4, 5""",
+        list(user_ids),
+    )
+    return {(r["date"], r["role"], r["class_teacher_id"], r["department_id"], r["status"]): sign * int(r["cnt"])
+            for r in cur.fetchall()}
+
+
+def detach_users(cur, user_ids: List[int]):
+    """Remove these users' counts (call before changing their class teacher / department)."""
+    if user_ids:
+        _apply_deltas(cur, _user_counts(cur, user_ids, -1))
+
+
+def attach_users(cur, user_ids: List[int]):
+    """Add these users' counts back under their current class teacher / department."""
+    if user_ids:
+        _apply_deltas(cur, _user_counts(cur, user_ids, 1))
+
+
+def rebuild(cur, start_date: Optional[str] = None, end_date: Optional[str] = None) -> int:
+    """backfill() on an open cursor (caller owns the transaction)."""
+    where, params = "", []
+    if start_date:
+        where, params = "WHERE a.date BETWEEN %s AND %s", [start_date, end_date or start_date]
+        cur.execute("DELETE FROM attendance_daily_summary WHERE date BETWEEN %s AND %s", params)
+    else:
+        cur.execute("DELETE FROM attendance_daily_summary")
+    cur.execute(
+        f"""INSERT INTO attendance_daily_summary (date, role, class_teacher_id, department_id, status, cnt)
+            SELECT a.date, {_DIMENSIONS}, a.status, COUNT(*) FROM attendance a
+            {_DIMENSION_JOINS}
+            {where}
+            GROUP BY 1, 2, 3, 4, 5""",
+        params,
+    )
+    return cur.rowcount
+
+
+def backfill(start_date: Optional[str] = None, end_date: Optional[str] = None) -> int:
+    """Rebuild the summary from attendance (whole table, or one date range). Returns summary rows written."""
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            return rebuild(cur, start_date, end_date)
+
+
+def _scope(role: Optional[str], user_id: Optional[int], export_type: Optional[str] = None):
+    """WHERE clause for a dashboard / export scope (matches the raw attendance queries)."""
+    if role == "class_teacher" and user_id:
+        return "role = 'student' AND class_teacher_id = %s", [user_id]
+    if export_type == "staff":
+        return "role = 'staff'", []
+    if export_type == "students":
+        return "role = 'student'", []
+    return "1 = 1", []
+
+
+def daily_counts(role: Optional[str], user_id: Optional[int], start_date: str, end_date: str,
+                 export_type: Optional[str] = None) -> List[Dict]:
+    """[{"date", "status", "cnt"}] for the scope; raises pymysql ProgrammingError if the table is missing."""
+    clause, params = _scope(role, user_id, export_type)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""SELECT date, status, SUM(cnt) AS cnt FROM attendance_daily_summary
+                    WHERE {clause} AND date BETWEEN %s AND %s
+                    GROUP BY date, status HAVING SUM(cnt) > 0""",
+                params + [start_date, end_date],
+            )
+            return [{"date": r["date"], "status": r["status"], "cnt": int(r["cnt"])} for r in cur.fetchall()]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        print("Usage: python attendance_summary.py backfill [start end]")
+        sys.exit(1)
+    start = sys.argv[2] if len(sys.argv) > 2 else None
+    end = sys.argv[3] if len(sys.argv) > 3 else start
+    rows = backfill(start, end)
+    print(f"[INFO] attendance_daily_summary rebuilt{f' for {start} to {end}' if start else ''}: {rows} rows")
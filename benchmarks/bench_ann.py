@@ -0,0 +1,75 @@
+"""
+FaceSense - IVF index recall@1 vs. latency benchmark.
+Holds out every Nth sample of each user in the sample store as a query, builds the gallery from the
+rest, and compares the IVF index at several nprobe values with the exact (flat) scan.
+recall@1 is the share of queries whose best user matches the flat scan's best user.
+
+    python benchmarks/bench_ann.py [--holdout 5] [--nlist 0] [--nprobe 1,2,4,8,16] [--batch 16]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Ensure project root (where config.py lives) is on sys.path
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from ivf_index import IVFLBPHRecognizer, build_index
+from lbph import NumpyLBPHRecognizer, spatial_histograms
+from model_train import LBPH_PARAMS
+from sample_store import get_sample_store
+
+
+def top1(recognizer, query_faces, batch):
+    """Best user per query and ms/face."""
+    t0 = time.perf_counter()
+    labels = np.concatenate([recognizer.match(query_faces[i:i + batch])[0][:, 0] for i in range(0, len(query_faces), batch)])
+    return labels, (time.perf_counter() - t0) * 1000 / len(query_faces)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--holdout", type=int, default=5, help="Every Nth sample per user becomes a query")
+    parser.add_argument("--nlist", type=int, default=0, help="IVF cells (0 = about 4 * sqrt(gallery size))")
+    parser.add_argument("--nprobe", default="1,2,4,8,16", help="Comma-separated cells searched per face")
+    parser.add_argument("--batch", type=int, default=16, help="Faces matched per call")
+    args = parser.parse_args()
+
+    images, labels = get_sample_store().load()
+    if not len(images):
+        print("[ERROR] Sample store is empty. Capture faces or run `python sample_store.py migrate` first.")
+        sys.exit(1)
+    rank = np.zeros(len(labels), dtype=np.int64)
+    for user in np.unique(labels):
+        idx = np.flatnonzero(labels == user)
+        rank[idx] = np.arange(len(idx))
+    is_query = rank % args.holdout == args.holdout - 1
+    gallery_idx, query_idx = np.flatnonzero(~is_query), np.flatnonzero(is_query)
+    print(f"[INFO] {len(np.unique(labels))} users, {len(gallery_idx)} gallery samples, {len(query_idx)} queries")
+
+    gallery = np.concatenate([spatial_histograms(images[gallery_idx[i:i + 256]], LBPH_PARAMS)
+                              for i in range(0, len(gallery_idx), 256)])
+    gallery_labels = np.asarray(labels[gallery_idx], dtype=np.int32)
+    query_faces = np.asarray(images[query_idx])
+    query_labels = np.asarray(labels[query_idx])
+
+    t0 = time.perf_counter()
+    centroids, lists = build_index(gallery, args.nlist)
+    print(f"[INFO] IVF index: {len(centroids)} cells built in {time.perf_counter() - t0:.1f}s")
+
+    exact, flat_ms = top1(NumpyLBPHRecognizer(gallery, gallery_labels, LBPH_PARAMS), query_faces, args.batch)
+    print(f"{'index':<12} {'recall@1':>9} {'top-1 acc':>10} {'ms/face':>9}")
+    print(f"{'flat':<12} {100.0:>8.1f}% {(exact == query_labels).mean() * 100:>9.1f}% {flat_ms:>9.2f}")
+    for nprobe in (int(v) for v in args.nprobe.split(",") if v.strip()):
+        recognizer = IVFLBPHRecognizer(gallery, gallery_labels, LBPH_PARAMS, centroids, lists, nprobe)
+        found, ms = top1(recognizer, query_faces, args.batch)
+        print(f"{'ivf/' + str(recognizer.nprobe):<12} {(found == exact).mean() * 100:>8.1f}% "
+              f"{(found == query_labels).mean() * 100:>9.1f}% {ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
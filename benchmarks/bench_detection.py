@@ -0,0 +1,100 @@
+"""
+FaceSense - Downscaled / ROI face detection benchmark.
+Runs the Haar cascade over a folder of frames (or a video) at full resolution as the baseline, then
+at several DETECT_MAX_WIDTH values and with ROI search around the previous frame's faces.
+recall is the share of baseline faces matched by a detection with IoU >= --iou.
+
+    python benchmarks/bench_detection.py --images DIR [--widths 640,480,320] [--iou 0.5]
+    python benchmarks/bench_detection.py --video clip.mp4 [--frames 300]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+
+# Ensure project root (where config.py lives) is on sys.path
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from config import DETECT_FULL_SCAN_INTERVAL
+from face_detect import face_detector, detect_faces, bounding_box
+from face_tracker import iou_matrix
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+
+
+def load_frames(args):
+    """Grayscale frames from --images (sorted by name) or the first --frames of --video."""
+    frames = []
+    if args.images:
+        for path in sorted(Path(args.images).iterdir()):
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                img = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+                if img is not None:
+                    frames.append(img)
+    else:
+        cap = cv2.VideoCapture(args.video)
+        while len(frames) < args.frames:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        cap.release()
+    return frames
+
+
+def run(detector, frames, max_width, roi_mode=False):
+    """Boxes per frame and ms/frame. roi_mode searches around the previous frame's faces between full scans."""
+    boxes, previous = [], None
+    t0 = time.perf_counter()
+    for i, gray in enumerate(frames):
+        roi = bounding_box(previous) if roi_mode and previous is not None and i % DETECT_FULL_SCAN_INTERVAL else None
+        faces = detect_faces(detector, gray, roi=roi, max_width=max_width)
+        boxes.append(faces)
+        previous = faces if len(faces) else None
+    return boxes, (time.perf_counter() - t0) * 1000 / len(frames)
+
+
+def recall(baseline, found, threshold):
+    total = sum(len(b) for b in baseline)
+    if not total:
+        return float("nan")
+    hits = sum(int((iou_matrix(b, f).max(axis=1) >= threshold).sum()) for b, f in zip(baseline, found) if len(b) and len(f))
+    return hits / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="Folder of frames")
+    source.add_argument("--video", help="Video file")
+    parser.add_argument("--frames", type=int, default=300, help="Frames read from --video")
+    parser.add_argument("--widths", default="640,480,320", help="Comma-separated detection widths")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU needed to count a baseline face as found")
+    args = parser.parse_args()
+
+    frames = load_frames(args)
+    if not frames:
+        print("[ERROR] No frames loaded.")
+        sys.exit(1)
+    height, width = frames[0].shape[:2]
+    print(f"[INFO] {len(frames)} frames, {width}x{height}")
+
+    widths = [int(v) for v in args.widths.split(",") if v.strip()]
+    with face_detector() as detector:
+        baseline, base_ms = run(detector, frames, 0)
+        print(f"{'mode':<14} {'recall':>8} {'faces':>7} {'ms/frame':>9} {'speedup':>8}")
+        print(f"{'full':<14} {100.0:>7.1f}% {sum(len(b) for b in baseline):>7} {base_ms:>9.2f} {1.0:>7.1f}x")
+        for max_width in widths:
+            for roi_mode in (False, True):
+                found, ms = run(detector, frames, max_width, roi_mode)
+                label = f"{max_width}{'+roi' if roi_mode else ''}"
+                print(f"{label:<14} {recall(baseline, found, args.iou) * 100:>7.1f}% {sum(len(f) for f in found):>7} "
+                      f"{ms:>9.2f} {base_ms / ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
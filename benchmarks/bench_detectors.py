@@ -0,0 +1,66 @@
+"""
+FaceSense - Face detector backend comparison.
+Runs every available backend (haar, lbp, yunet) over a folder of frames and reports load time,
+ms/frame, detection rate (frames with at least one face) and agreement with the first backend
+(share of its faces also found by the other one at IoU >= --iou). Backends whose cascade / model
+file is missing are skipped.
+
+    python benchmarks/bench_detectors.py --images DIR [--backends haar,lbp,yunet] [--max-width 480]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Ensure project root (where config.py lives) is on sys.path
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from config import DETECT_MAX_WIDTH
+from face_detect import BACKENDS, PooledDetector, create_backend, detect_faces
+from bench_detection import load_frames, recall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="Folder of frames")
+    source.add_argument("--video", help="Video file")
+    parser.add_argument("--frames", type=int, default=300, help="Frames read from --video")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma-separated backends to compare")
+    parser.add_argument("--max-width", type=int, default=DETECT_MAX_WIDTH, help="Detection width (0 = full size)")
+    parser.add_argument("--min-size", type=int, default=80, help="Smallest face side in pixels")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU needed to count a face as the same")
+    args = parser.parse_args()
+
+    frames = load_frames(args)
+    if not frames:
+        print("[ERROR] No frames loaded.")
+        sys.exit(1)
+    print(f"[INFO] {len(frames)} frames, {frames[0].shape[1]}x{frames[0].shape[0]}, max width {args.max_width}")
+
+    reference = None
+    print(f"{'backend':<8} {'load ms':>8} {'ms/frame':>9} {'detected':>9} {'faces':>6} {'agree':>7}")
+    for name in (v.strip() for v in args.backends.split(",") if v.strip()):
+        try:
+            t0 = time.perf_counter()
+            detector = PooledDetector(create_backend(name))
+            load_ms = (time.perf_counter() - t0) * 1000
+        except RuntimeError as e:
+            print(f"[WARN] Skipping {name}: {e}")
+            continue
+        min_size = (args.min_size, args.min_size)
+        t0 = time.perf_counter()
+        boxes = [detect_faces(detector, gray, min_size=min_size, max_width=args.max_width) for gray in frames]
+        ms = (time.perf_counter() - t0) * 1000 / len(frames)
+        detected = sum(1 for b in boxes if len(b)) / len(frames)
+        if reference is None:
+            reference, agree = boxes, "ref"
+        else:
+            agree = f"{recall(reference, boxes, args.iou) * 100:.1f}%"
+        print(f"{name:<8} {load_ms:>8.1f} {ms:>9.2f} {detected * 100:>8.1f}% {sum(len(b) for b in boxes):>6} {agree:>7}")
+
+
+if __name__ == "__main__":
+    main()
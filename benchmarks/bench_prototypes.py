@@ -0,0 +1,80 @@
+"""
+FaceSense - Full gallery vs. per-user prototype gallery benchmark.
+Holds out every Nth sample of each user in the sample store as a query, builds the gallery from the
+rest, and reports top-1 accuracy and matching latency for the full gallery and k-medoid prototypes.
+
+    python benchmarks/bench_prototypes.py [--holdout 5] [--prototypes 1,3,5,10] [--batch 16]
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Ensure project root (where config.py lives) is on sys.path
+BASE_DIR = Path(__file__).resolve().parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from config import CONFIDENCE_THRESHOLD
+from lbph import NumpyLBPHRecognizer, spatial_histograms, prototype_gallery
+from model_train import LBPH_PARAMS
+from sample_store import get_sample_store
+
+
+def histograms_in_chunks(images, chunk=256):
+    return np.concatenate([spatial_histograms(images[i:i + chunk], LBPH_PARAMS) for i in range(0, len(images), chunk)])
+
+
+def evaluate(name, recognizer, query_faces, query_labels, batch):
+    """Top-1 accuracy, accepted-and-correct rate and ms/face for one gallery."""
+    t0 = time.perf_counter()
+    matches = [recognizer.match(query_faces[i:i + batch]) for i in range(0, len(query_faces), batch)]
+    elapsed = time.perf_counter() - t0
+    labels = np.concatenate([m[0][:, 0] for m in matches])
+    dists = np.concatenate([m[1][:, 0] for m in matches])
+    correct = labels == query_labels
+    accepted = correct & (dists <= CONFIDENCE_THRESHOLD)
+    print(f"{name:<14} {len(recognizer):>9} {correct.mean() * 100:>9.1f}% {accepted.mean() * 100:>11.1f}% "
+          f"{elapsed * 1000 / len(query_faces):>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--holdout", type=int, default=5, help="Every Nth sample per user becomes a query")
+    parser.add_argument("--prototypes", default="1,3,5,10", help="Comma-separated prototypes per user")
+    parser.add_argument("--batch", type=int, default=16, help="Faces matched per call")
+    args = parser.parse_args()
+
+    images, labels = get_sample_store().load()
+    if not len(images):
+        print("[ERROR] Sample store is empty. Capture faces or run `python sample_store.py migrate` first.")
+        sys.exit(1)
+    rank = np.zeros(len(labels), dtype=np.int64)
+    for user in np.unique(labels):
+        idx = np.flatnonzero(labels == user)
+        rank[idx] = np.arange(len(idx))
+    is_query = rank % args.holdout == args.holdout - 1
+    gallery_idx, query_idx = np.flatnonzero(~is_query), np.flatnonzero(is_query)
+    print(f"[INFO] {len(np.unique(labels))} users, {len(gallery_idx)} gallery samples, {len(query_idx)} queries")
+
+    t0 = time.perf_counter()
+    gallery = histograms_in_chunks(images[gallery_idx])
+    gallery_labels = np.asarray(labels[gallery_idx], dtype=np.int32)
+    print(f"[INFO] Gallery histograms in {time.perf_counter() - t0:.1f}s")
+    query_faces = np.asarray(images[query_idx])
+    query_labels = np.asarray(labels[query_idx])
+
+    print(f"{'gallery':<14} {'vectors':>9} {'top-1':>10} {'accepted':>12} {'ms/face':>10}")
+    evaluate("full", NumpyLBPHRecognizer(gallery, gallery_labels, LBPH_PARAMS), query_faces, query_labels, args.batch)
+    for k in (int(v) for v in args.prototypes.split(",") if v.strip()):
+        t0 = time.perf_counter()
+        hists, labs = prototype_gallery(gallery, gallery_labels, k)
+        build_s = time.perf_counter() - t0
+        evaluate(f"prototypes={k}", NumpyLBPHRecognizer(hists, labs, LBPH_PARAMS), query_faces, query_labels, args.batch)
+        print(f"{'':<14} (clustered in {build_s:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,8 +11,32 @@ UPLOADS_DIR = os.path.join(BASE_DIR, "uploads")
 FRONTEND_BUILD_DIR = os.path.join(BASE_DIR, "frontend", "dist")
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "pdf"}
 
-MODEL_PATH = os.path.join(MODELS_DIR, "face_lbph.xml")
+# Packed face-sample store (sample_store.py): one memory-mappable file instead of per-image JPEGs
+SAMPLE_STORE_ENABLED = os.environ.get("SAMPLE_STORE_ENABLED", "1") == "1"
+SAMPLE_STORE_PATH = os.path.join(DATASET_DIR, "faces.u8")  # uint8 frames of FACE_IMAGE_SIZE
+SAMPLE_INDEX_PATH = os.path.join(DATASET_DIR, "faces.idx")  # int32 user_id per frame
+SAMPLE_META_PATH = os.path.join(DATASET_DIR, "faces.json")
+
+MODEL_PATH = os.path.join(MODELS_DIR, "face_lbph.xml")  # Legacy OpenCV XML (convert with lbph.py)
+MODEL_HIST_PATH = os.path.join(MODELS_DIR, "face_lbph_hist.npy")  # float32 LBPH histogram matrix
+MODEL_LABELS_NPY_PATH = os.path.join(MODELS_DIR, "face_lbph_labels.npy")  # int32 label per histogram
+MODEL_PROTOTYPES_PER_USER = int(os.environ.get("MODEL_PROTOTYPES_PER_USER", "0"))  # k-medoid gallery per user (0 = every sample)
+MODEL_PROTO_HIST_PATH = os.path.join(MODELS_DIR, "face_lbph_proto_hist.npy")
+MODEL_PROTO_LABELS_PATH = os.path.join(MODELS_DIR, "face_lbph_proto_labels.npy")
+MODEL_INDEX = os.environ.get("MODEL_INDEX", "flat")  # "flat" (exact scan) or "ivf" (ivf_index.py, for large galleries)
+IVF_NLIST = int(os.environ.get("IVF_NLIST", "0"))  # Coarse cells (0 = about 4 * sqrt(gallery size))
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", "8"))  # Cells searched per face
+MODEL_IVF_CENTROIDS_PATH = os.path.join(MODELS_DIR, "face_lbph_ivf_centroids.npy")
+MODEL_IVF_LISTS_PATH = os.path.join(MODELS_DIR, "face_lbph_ivf_lists.npy")  # Cell id per gallery row
+# Recognition shards built by model_train: "department", "class_teacher", "group" (kiosk_group_members)
+MODEL_SHARD_BY = [s.strip() for s in os.environ.get("MODEL_SHARD_BY", "department,class_teacher,group").split(",") if s.strip()]
 LABELS_PATH = os.path.join(MODELS_DIR, "labels.json")
+MODEL_VERSIONS_DIR = os.path.join(MODELS_DIR, "versions")  # Immutable published model versions
+MODEL_VERSIONS_KEEP = 3
+MODEL_RELOAD_CHECK_SECONDS = float(os.environ.get("MODEL_RELOAD_CHECK_SECONDS", "2"))  # How often each worker stats labels.json for a new version
+TRAIN_MANIFEST_PATH = os.path.join(MODELS_DIR, "train_manifest.json")  # Samples already in the model
+TRAIN_LOADER_WORKERS = int(os.environ.get("TRAIN_LOADER_WORKERS", str(min(8, os.cpu_count() or 1))))  # Image decode threads
+TRAIN_JOB_HISTORY = 20  # Finished training jobs kept for /api/train/<job_id>
 
 # MySQL connection (main database - all collected and stored data lives here)
 MYSQL_HOST = os.environ.get("MYSQL_HOST", "localhost")
@@ -21,11 +45,72 @@ MYSQL_USER = os.environ.get("MYSQL_USER", "root")
 MYSQL_PASSWORD = os.environ.get("MYSQL_PASSWORD", "Dharaan007")
 MYSQL_DATABASE = os.environ.get("MYSQL_DATABASE", "facesense")
 
+# MySQL connection pool (db.get_connection)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))  # Seconds to wait for a free connection
+DB_POOL_MAX_IDLE_SECONDS = int(os.environ.get("DB_POOL_MAX_IDLE_SECONDS", "300"))  # Close connections idle longer
+DB_POOL_PING_AFTER_SECONDS = int(os.environ.get("DB_POOL_PING_AFTER_SECONDS", "5"))  # Health-check on checkout after idling
+
 # Face recognition settings
 CONFIDENCE_THRESHOLD = 20.0  # LBPH: lower is better. ~20 = 80% accuracy
 SAMPLES_PER_PERSON = 30
 FACE_IMAGE_SIZE = (200, 200)
+MATCH_TOP_K = 3  # Candidate users returned per face
+MATCH_MARGIN = float(os.environ.get("MATCH_MARGIN", "0"))  # Reject if the runner-up user is this close to the best (0 = off)
+MATCH_USER_SAMPLES = int(os.environ.get("MATCH_USER_SAMPLES", "1"))  # User score = mean of their N nearest samples
+
+# Face detection (face_detect.detect_faces)
+# Backend: "haar" (bundled frontal-face cascade), "lbp" (LBP cascade XML) or "yunet" (OpenCV DNN, ONNX model)
+DETECT_BACKEND = os.environ.get("DETECT_BACKEND", "haar").strip().lower()
+DETECT_LBP_CASCADE_PATH = os.environ.get("DETECT_LBP_CASCADE_PATH", os.path.join(MODELS_DIR, "lbpcascade_frontalface_improved.xml"))
+DETECT_YUNET_MODEL_PATH = os.environ.get("DETECT_YUNET_MODEL_PATH", os.path.join(MODELS_DIR, "face_detection_yunet_2023mar.onnx"))
+DETECT_YUNET_SCORE_THRESHOLD = float(os.environ.get("DETECT_YUNET_SCORE_THRESHOLD", "0.8"))
+DETECT_YUNET_NMS_THRESHOLD = 0.3
+DETECT_MAX_WIDTH = int(os.environ.get("DETECT_MAX_WIDTH", "480"))  # Detect on frames downscaled to this width (0 = full size)
+DETECT_ROI_MARGIN = 0.5  # ROI search grows the previous box by this fraction of its size per side
+DETECT_FULL_SCAN_INTERVAL = 10  # Continuous loops search the whole frame every N frames even when tracking
+
+# Batch recognition (/api/recognize/batch)
+BATCH_MAX_FRAMES = int(os.environ.get("BATCH_MAX_FRAMES", "32"))
+BATCH_DECODE_WORKERS = int(os.environ.get("BATCH_DECODE_WORKERS", "4"))
+
+# Face tracking in face_recognize.recognize_loop (face_tracker.py)
+TRACK_IOU_THRESHOLD = 0.3  # Min box overlap to continue a track
+TRACK_MAX_MISSED = 5  # Frames a track survives without a matching detection
+TRACK_RECOGNIZE_INTERVAL = 15  # Re-run recognition on a track every N frames
+TRACK_HISTORY = 5  # Recognitions per track voted into its identity
+
+# Headless multi-camera daemon (attendance_daemon.py)
+DAEMON_QUEUE_SIZE = 8  # Frames buffered between stages
+DAEMON_DETECT_WORKERS = int(os.environ.get("DAEMON_DETECT_WORKERS", "2"))
+DAEMON_RECOGNIZE_BATCH = 16  # Max frames matched per recognition call
+DAEMON_DROP_POLICY = os.environ.get("DAEMON_DROP_POLICY", "oldest")  # Live cameras when a queue is full: oldest | newest | block
+DAEMON_FRAME_STRIDE = int(os.environ.get("DAEMON_FRAME_STRIDE", "1"))  # Process every Nth captured frame
+DAEMON_MIN_HITS = 2  # Sightings on one source before a user is marked
+DAEMON_MARK_COOLDOWN_SECONDS = 60
+DAEMON_METRICS_INTERVAL = 10  # Seconds between throughput reports
+
+# Kiosk WebSocket stream (/api/recognize/stream, needs flask-sock)
+STREAM_SMOOTHING_FRAMES = 5  # Identity is smoothed over this many recent frames
+STREAM_MIN_VOTES = 3  # Frames in the window that must agree before a user is announced
+STREAM_MAX_FRAME_BYTES = 2 * 1024 * 1024
+
+# Classroom snapshot (/api/recognize/classroom): wide-angle frames have smaller faces
+CLASSROOM_MIN_FACE_SIZE = (40, 40)
+
+# Attendance marking (attendance.py)
+ATTENDANCE_WRITE_BEHIND = os.environ.get("ATTENDANCE_WRITE_BEHIND", "1") == "1"  # Group concurrent marks into multi-row writes
+ATTENDANCE_BATCH_SIZE = 200  # Max marks per multi-row statement
+ATTENDANCE_WRITE_TIMEOUT = 10  # Seconds a caller waits for its buffered mark to be written
+ATTENDANCE_BULK_MAX = 500  # Entries per /api/attendance/mark/bulk request
+
+# Attendance export (/api/export)
+EXPORT_FETCH_SIZE = 2000  # Rows per fetch from the server-side cursor
+EXPORT_STREAM_CHUNK_BYTES = 64 * 1024  # Response chunk size for CSV / NDJSON / xlsx streaming
+EXPORT_CACHE_DIR = os.path.join(EXPORTS_DIR, "cache")  # Content-addressed export files (export_cache.py)
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get("EXPORT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 0 = no caching
 
 # Location / campus verification
 CAMPUS_RADIUS_METERS = 500  # Default radius for campus boundary
 LOCATION_ACCURACY_THRESHOLD = 100  # Max meters variance allowed
+LOCATION_CACHE_TTL_SECONDS = int(os.environ.get("LOCATION_CACHE_TTL_SECONDS", "300"))  # location_cache.py entry lifetime
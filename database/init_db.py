@@ -10,6 +10,7 @@ if str(BASE_DIR) not in sys.path:
     sys.path.insert(0, str(BASE_DIR))
 
 from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
+import attendance_summary
 
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
 
@@ -45,6 +46,8 @@ def init_database():
         # Split by semicolon and run each non-empty statement
         parts = schema.split(";")
         with conn.cursor() as cur:
+            cur.execute("SHOW TABLES LIKE 'attendance_daily_summary'")
+            had_summary = cur.fetchone() is not None
             for part in parts:
                 stmt = part.strip()
                 # Skip comments-only and empty
@@ -60,6 +63,10 @@ def init_database():
                         pass
                     else:
                         raise
+            if not had_summary:
+                # New summary table: count the attendance recorded before it existed
+                rows = attendance_summary.rebuild(cur)
+                print(f"[INFO] attendance_daily_summary filled from existing attendance: {rows} rows")
         conn.commit()
         print(f"[INFO] MySQL database '{MYSQL_DATABASE}' initialized at {MYSQL_HOST}:{MYSQL_PORT}")
     finally:
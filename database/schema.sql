@@ -137,6 +137,33 @@ CREATE TABLE IF NOT EXISTS attendance (
     UNIQUE KEY uk_user_date (user_id, date)
 );
 
+-- Kiosk groups (recognition shard "group:<name>" for kiosks outside one department/class)
+CREATE TABLE IF NOT EXISTS kiosk_group_members (
+    group_name VARCHAR(100) NOT NULL,
+    user_id INT NOT NULL,
+    PRIMARY KEY (group_name, user_id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Per-date change counter, bumped by attendance.py whenever a mark changes that date's rows
+-- (export_cache.py reuses cached exports until the version of their range changes)
+CREATE TABLE IF NOT EXISTS attendance_versions (
+    date DATE PRIMARY KEY,
+    version INT NOT NULL DEFAULT 0
+);
+
+-- Daily attendance counts maintained by attendance.py (python attendance_summary.py backfill rebuilds it)
+-- class_teacher_id / department_id are 0 when not set
+CREATE TABLE IF NOT EXISTS attendance_daily_summary (
+    date DATE NOT NULL,
+    role ENUM('admin', 'staff', 'student') NOT NULL,
+    class_teacher_id INT NOT NULL DEFAULT 0,
+    department_id INT NOT NULL DEFAULT 0,
+    status ENUM('present', 'partial', 'absent') NOT NULL,
+    cnt INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (date, role, class_teacher_id, department_id, status)
+);
+
 -- Indexes
 CREATE INDEX idx_attendance_user_date ON attendance(user_id, date);
 CREATE INDEX idx_attendance_date ON attendance(date);
@@ -144,6 +171,7 @@ CREATE INDEX idx_users_role ON users(role);
 CREATE INDEX idx_students_class_teacher ON students(class_teacher_id);
 CREATE INDEX idx_students_degree_dept ON students(degree_id, department_id, year_of_study, semester);
 CREATE INDEX idx_staff_department ON staff(department_id);
+CREATE INDEX idx_daily_summary_teacher_date ON attendance_daily_summary(class_teacher_id, date);
 
 -- Default admin user
 INSERT INTO users (id, email, password_hash, role)
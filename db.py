@@ -1,18 +1,25 @@
 """
 FaceSense - MySQL database connection.
 Single place for all DB access. Use get_connection() for queries; placeholder is %s.
+Connections come from a bounded, thread-safe pool instead of a fresh TCP handshake per call.
 """
+import os
+import threading
+import time
+from collections import deque
+
 import pymysql
 from pymysql.cursors import DictCursor
 from contextlib import contextmanager
 
-from config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE
+from config import (
+    MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE,
+    DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE_SECONDS, DB_POOL_PING_AFTER_SECONDS,
+)
 
 
-@contextmanager
-def get_connection():
-    """Yield a MySQL connection with DictCursor. Use %s for placeholders. Commit on exit, rollback on error."""
-    conn = pymysql.connect(
+def _connect():
+    return pymysql.connect(
         host=MYSQL_HOST,
         port=MYSQL_PORT,
         user=MYSQL_USER,
@@ -22,24 +29,201 @@ def get_connection():
         cursorclass=DictCursor,
         autocommit=False,
     )
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of PyMySQL connections.
+    Idle connections are pinged on checkout once they have been idle longer than ping_after,
+    and closed once idle longer than max_idle. Callers block up to timeout when all are in use.
+    """
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 max_idle=DB_POOL_MAX_IDLE_SECONDS, ping_after=DB_POOL_PING_AFTER_SECONDS):
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = deque()  # (conn, returned_at); newest on the right
+        self._total = 0
+        self._stats = {
+            "created": 0,
+            "closed": 0,
+            "evicted_idle": 0,
+            "health_check_failures": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "in_use": 0,
+            "checkout_ms_total": 0.0,
+            "checkout_ms_max": 0.0,
+        }
+
+    def _evict_idle_locked(self, now):
+        """Pop connections idle longer than max_idle (oldest are on the left)."""
+        expired = []
+        while self._idle and now - self._idle[0][1] > self.max_idle:
+            expired.append(self._idle.popleft()[0])
+        self._total -= len(expired)
+        self._stats["evicted_idle"] += len(expired)
+        self._stats["closed"] += len(expired)
+        return expired
+
+    def acquire(self):
+        t0 = time.perf_counter()
+        deadline = time.monotonic() + self.timeout
+        conn = None
+        idle_for = 0.0
+        waited = False
+        expired = []
+        with self._cond:
+            if self._pid != os.getpid():
+                # Forked worker: never share sockets with the parent process
+                self._reset()
+            while True:
+                now = time.monotonic()
+                expired.extend(self._evict_idle_locked(now))
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    idle_for = now - returned_at
+                    break
+                if self._total < self.size:
+                    self._total += 1
+                    break
+                if not waited:
+                    waited = True
+                    self._stats["waits"] += 1
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    for c in expired:
+                        _close_quietly(c)
+                    raise RuntimeError(f"Timed out waiting for a database connection (pool size {self.size})")
+                self._cond.wait(remaining)
+        for c in expired:
+            _close_quietly(c)
+
+        if conn is not None and idle_for > self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                _close_quietly(conn)
+                conn = None
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                    self._stats["closed"] += 1
+        if conn is None:
+            try:
+                conn = _connect()
+            except Exception:
+                with self._cond:
+                    self._total -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._stats["created"] += 1
+
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        with self._cond:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["checkout_ms_total"] += elapsed_ms
+            self._stats["checkout_ms_max"] = max(self._stats["checkout_ms_max"], elapsed_ms)
+        return conn
+
+    def release(self, conn, discard=False):
+        if discard:
+            _close_quietly(conn)
+        with self._cond:
+            self._stats["in_use"] -= 1
+            if discard:
+                self._total -= 1
+                self._stats["closed"] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["size"] = self.size
+            stats["open"] = self._total
+            stats["idle"] = len(self._idle)
+        stats["checkout_ms_avg"] = stats["checkout_ms_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        return stats
+
+
+_pool = ConnectionPool()
+
+
+def _is_disconnect(exc):
+    return isinstance(exc, (pymysql.err.OperationalError, pymysql.err.InterfaceError))
+
+
+@contextmanager
+def get_connection():
+    """Yield a MySQL connection with DictCursor. Use %s for placeholders. Commit on exit, rollback on error."""
+    conn = _pool.acquire()
+    discard = False
     try:
         yield conn
         conn.commit()
-    except Exception:
-        conn.rollback()
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            discard = True
+        discard = discard or _is_disconnect(e)
         raise
     finally:
-        conn.close()
+        _pool.release(conn, discard=discard)
+
+
+class PooledConnection:
+    """Pooled connection handed out by get_connection_raw(); close() returns it to the pool."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            conn.rollback()
+        except Exception:
+            _pool.release(conn, discard=True)
+            return
+        _pool.release(conn)
+
+    def discard(self):
+        """Close instead of returning to the pool (e.g. an unbuffered result was abandoned mid-read)."""
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        _pool.release(conn, discard=True)
 
 
 def get_connection_raw():
     """Return a connection without context manager (e.g. for pandas). Caller must close."""
-    return pymysql.connect(
-        host=MYSQL_HOST,
-        port=MYSQL_PORT,
-        user=MYSQL_USER,
-        password=MYSQL_PASSWORD,
-        database=MYSQL_DATABASE,
-        charset="utf8mb4",
-        cursorclass=DictCursor,
-    )
+    return PooledConnection(_pool.acquire())
+
+
+def get_pool_stats() -> dict:
+    """Pool statistics: waits, checkout latency, in-use count."""
+    return _pool.stats()
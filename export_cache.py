@@ -0,0 +1,142 @@
+"""
+FaceSense - Content-addressed cache for /api/export.
+An export is keyed by (role, user_id, export_type, start, end, format, data version). The data version
+combines attendance_versions for the range (bumped by attendance.py on every write) with the
+count and a checksum of the roster columns of the people in scope, so a past range is served from
+disk until its attendance or roster changes. Files live in EXPORT_CACHE_DIR; the least recently used are
+evicted once the directory exceeds EXPORT_CACHE_MAX_BYTES.
+"""
+import hashlib
+import os
+import threading
+import uuid
+from typing import Iterator, Optional, Tuple
+
+import pymysql
+
+from config import EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES
+from db import get_connection
+from export_utils import EXPORT_FORMATS, stream_export, stream_file
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "evicted": 0}
+
+
+# Checksum of the roster columns the export queries read; other edits (face samples,
+# updated_at stamps) leave cached exports valid
+_STUDENT_ROSTER = """SELECT COUNT(*) AS n, COALESCE(SUM(CRC32(CONCAT_WS('|', user_id, first_name, last_name, email, phone,
+    degree_id, department_id, year_of_study, semester))), 0) AS m FROM students"""
+_STAFF_ROSTER = """SELECT COUNT(*) AS n, COALESCE(SUM(CRC32(CONCAT_WS('|', user_id, first_name, last_name, email, phone,
+    department_id))), 0) AS m FROM staff"""
+
+
+def data_version(role: str, user_id: int, export_type: str, start_date: str, end_date: str) -> Optional[str]:
+    """Version string of everything the export reads, or None when attendance_versions is missing."""
+    if role == "class_teacher":
+        people_sql, people_params = _STUDENT_ROSTER + " WHERE class_teacher_id = %s", (user_id,)
+    elif role == "admin" and export_type == "staff":
+        people_sql, people_params = _STAFF_ROSTER, ()
+    else:
+        people_sql, people_params = _STUDENT_ROSTER, ()
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute(
+                    "SELECT COALESCE(SUM(version), 0) AS v, COUNT(*) AS n FROM attendance_versions WHERE date BETWEEN %s AND %s",
+                    (start_date, end_date),
+                )
+            except pymysql.err.ProgrammingError:
+                return None
+            dates = cur.fetchone()
+            cur.execute(people_sql, people_params)
+            people = cur.fetchone()
+    return f"{dates['v']}.{dates['n']}:{people['n']}.{people['m']}"
+
+
+def cache_key(role: str, user_id: int, export_type: str, start_date: str, end_date: str, fmt: str, version: str) -> str:
+    # Only a class teacher's export depends on who asks; admins share entries
+    owner = user_id if role == "class_teacher" else None
+    raw = "|".join(str(v) for v in (role, owner, export_type, start_date, end_date, fmt, version))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _evict():
+    """Remove least recently used entries until the cache fits EXPORT_CACHE_MAX_BYTES."""
+    entries = []
+    for entry in os.scandir(EXPORT_CACHE_DIR):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            st = entry.stat()
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= EXPORT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        with _lock:
+            _stats["evicted"] += 1
+
+
+def _tee(chunks: Iterator[bytes], path: str) -> Iterator[bytes]:
+    """Stream chunks to the client while writing them to the cache; only a complete file is published."""
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    complete = False
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        complete = True
+    finally:
+        if complete:
+            os.replace(tmp, path)
+            with _lock:
+                _stats["stored"] += 1
+            _evict()
+        else:
+            chunks.close()
+            os.remove(tmp)
+
+
+def cached_export(role: str, user_id: int, start_date: str, end_date: str, export_type: str = "students",
+                  fmt: str = "xlsx") -> Tuple[Iterator[bytes], str, str]:
+    """export_utils.stream_export() served from / stored into the cache. Same return value."""
+    version = data_version(role, user_id, export_type, start_date, end_date) if EXPORT_CACHE_MAX_BYTES else None
+    if version is None:
+        with _lock:
+            _stats["bypassed"] += 1
+        return stream_export(role, user_id, start_date, end_date, export_type, fmt)
+    os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+    key = cache_key(role, user_id, export_type, start_date, end_date, fmt, version)
+    path = os.path.join(EXPORT_CACHE_DIR, f"{key}.{fmt}")
+    filename = f"attendance_{start_date}_to_{end_date}.{fmt}"
+    if os.path.isfile(path):
+        try:
+            os.utime(path)  # mtime doubles as last-used time for eviction
+            chunks = stream_file(path)
+            first = next(chunks, b"")
+        except FileNotFoundError:
+            pass  # Evicted between the check and the open
+        else:
+            with _lock:
+                _stats["hits"] += 1
+
+            def replay():
+                yield first
+                yield from chunks
+
+            return replay(), EXPORT_FORMATS[fmt], filename
+    with _lock:
+        _stats["misses"] += 1
+    chunks, mimetype, filename = stream_export(role, user_id, start_date, end_date, export_type, fmt)
+    return _tee(chunks, path), mimetype, filename
+
+
+def get_export_cache_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    stats["max_bytes"] = EXPORT_CACHE_MAX_BYTES
+    return stats
@@ -1,15 +1,47 @@
 """
 FaceSense - Excel export with role-based access. Uses MySQL.
+/api/export streams rows from a server-side cursor into xlsx (openpyxl write-only), CSV or NDJSON,
+so memory stays constant regardless of the date range. The DataFrame getters remain for ad-hoc use.
 """
+import csv
+import io
+import json
 import os
-from datetime import date
-from typing import Optional
+import tempfile
+from datetime import date, timedelta
+from typing import Iterable, Iterator, Optional, Tuple
 
 import pandas as pd
+from pymysql.cursors import SSDictCursor
 
-from config import EXPORTS_DIR
+from config import EXPORTS_DIR, EXPORT_FETCH_SIZE, EXPORT_STREAM_CHUNK_BYTES
 from db import get_connection_raw
 
+CLASS_STUDENTS_QUERY = """
+    SELECT a.user_id, a.date, a.in_time, a.out_time, a.status, a.on_campus,
+           s.first_name, s.last_name, s.email, s.phone, s.degree_id, s.department_id, s.year_of_study, s.semester
+    FROM attendance a
+    JOIN students s ON s.user_id = a.user_id
+    WHERE s.class_teacher_id = %s AND a.date BETWEEN %s AND %s
+    ORDER BY a.date DESC, s.first_name, s.last_name
+"""
+ALL_STUDENTS_QUERY = """
+    SELECT a.user_id, a.date, a.in_time, a.out_time, a.status, a.on_campus,
+           s.first_name, s.last_name, s.email, s.phone
+    FROM attendance a
+    JOIN students s ON s.user_id = a.user_id
+    WHERE a.date BETWEEN %s AND %s
+    ORDER BY a.date DESC, s.first_name, s.last_name
+"""
+STAFF_QUERY = """
+    SELECT a.user_id, a.date, a.in_time, a.out_time, a.status, a.on_campus,
+           s.first_name, s.last_name, s.email, s.phone, s.department_id
+    FROM attendance a
+    JOIN staff s ON s.user_id = a.user_id
+    WHERE a.date BETWEEN %s AND %s
+    ORDER BY a.date DESC, s.first_name, s.last_name
+"""
+
 
 def get_students_attendance_for_export(
     class_teacher_user_id: int, start_date: str, end_date: str
@@ -17,15 +49,7 @@ def get_students_attendance_for_export(
     """Class teacher: students where class_teacher_id = class_teacher_user_id."""
     conn = get_connection_raw()
     try:
-        query = """
-            SELECT a.user_id, a.date, a.in_time, a.out_time, a.status, a.on_campus,
-                   s.first_name, s.last_name, s.email, s.phone, s.degree_id, s.department_id, s.year_of_study, s.semester
-            FROM attendance a
-            JOIN students s ON s.user_id = a.user_id
-            WHERE s.class_teacher_id = %s AND a.date BETWEEN %s AND %s
-            ORDER BY a.date DESC, s.first_name, s.last_name
-        """
-        df = pd.read_sql_query(query, conn, params=(class_teacher_user_id, start_date, end_date))
+        df = pd.read_sql_query(CLASS_STUDENTS_QUERY, conn, params=(class_teacher_user_id, start_date, end_date))
         if not df.empty:
             df["name"] = df["first_name"].fillna("") + " " + df["last_name"].fillna("")
         return df
@@ -37,15 +61,7 @@ def get_all_students_attendance_for_export(start_date: str, end_date: str) -> pd
     """Admin: all students' attendance."""
     conn = get_connection_raw()
     try:
-        query = """
-            SELECT a.user_id, a.date, a.in_time, a.out_time, a.status, a.on_campus,
-                   s.first_name, s.last_name, s.email, s.phone
-            FROM attendance a
-            JOIN students s ON s.user_id = a.user_id
-            WHERE a.date BETWEEN %s AND %s
-            ORDER BY a.date DESC, s.first_name, s.last_name
-        """
-        df = pd.read_sql_query(query, conn, params=(start_date, end_date))
+        df = pd.read_sql_query(ALL_STUDENTS_QUERY, conn, params=(start_date, end_date))
         if not df.empty:
             df["name"] = df["first_name"].fillna("") + " " + df["last_name"].fillna("")
         return df
@@ -57,15 +73,7 @@ def get_staff_attendance_for_export(start_date: str, end_date: str) -> pd.DataFr
     """Admin: all staff attendance."""
     conn = get_connection_raw()
     try:
-        query = """
-            SELECT a.user_id, a.date, a.in_time, a.out_time, a.status, a.on_campus,
-                   s.first_name, s.last_name, s.email, s.phone, s.department_id
-            FROM attendance a
-            JOIN staff s ON s.user_id = a.user_id
-            WHERE a.date BETWEEN %s AND %s
-            ORDER BY a.date DESC, s.first_name, s.last_name
-        """
-        df = pd.read_sql_query(query, conn, params=(start_date, end_date))
+        df = pd.read_sql_query(STAFF_QUERY, conn, params=(start_date, end_date))
         if not df.empty:
             df["name"] = df["first_name"].fillna("") + " " + df["last_name"].fillna("")
         return df
@@ -73,6 +81,201 @@ def get_staff_attendance_for_export(start_date: str, end_date: str) -> pd.DataFr
         conn.close()
 
 
+# ---------- Streaming export ----------
+
+def export_query(role: str, user_id: int, start_date: str, end_date: str, export_type: str = "students"):
+    """(sql, params) for the caller's scope: a class teacher only sees their students."""
+    if role == "class_teacher":
+        return CLASS_STUDENTS_QUERY, (user_id, start_date, end_date)
+    if role == "admin" and export_type == "staff":
+        return STAFF_QUERY, (start_date, end_date)
+    return ALL_STUDENTS_QUERY, (start_date, end_date)
+
+
+def _cell(value):
+    """TIME columns arrive as timedelta; show them as HH:MM:SS like the UI does."""
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return value
+
+
+class ExportSummary:
+    """Summary sheet figures accumulated while rows stream past."""
+
+    def __init__(self):
+        self.total = 0
+        self.present = 0
+        self.partial = 0
+        self.days = set()
+
+    def add(self, row: dict):
+        self.total += 1
+        self.present += row["status"] == "present"
+        self.partial += row["status"] == "partial"
+        self.days.add(row["date"])
+
+    def rows(self):
+        return [
+            ("Total Records", self.total),
+            ("Full Attendance (IN+OUT)", self.present),
+            ("Partial (IN only)", self.partial),
+            ("Unique Days", len(self.days)),
+        ]
+
+
+def iter_export_rows(role: str, user_id: int, start_date: str, end_date: str, export_type: str = "students",
+                     summary: Optional[ExportSummary] = None) -> Iterator[dict]:
+    """
+    Yield export rows (query columns + "name") from a server-side cursor, EXPORT_FETCH_SIZE at a time,
+    so memory stays flat however long the range is. Pass an ExportSummary to total them on the way.
+    """
+    sql, params = export_query(role, user_id, start_date, end_date, export_type)
+    conn = get_connection_raw()
+    finished = False
+    try:
+        cur = conn.cursor(SSDictCursor)
+        cur.execute(sql, params)
+        while True:
+            chunk = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not chunk:
+                break
+            for row in chunk:
+                row = {k: _cell(v) for k, v in row.items()}
+                row["name"] = f"{row['first_name'] or ''} {row['last_name'] or ''}"
+                if summary is not None:
+                    summary.add(row)
+                yield row
+        cur.close()
+        finished = True
+    finally:
+        if finished:
+            conn.close()
+        else:
+            # Closing the cursor would read the rest of the result set; drop the connection instead
+            conn.discard()
+
+
+def _summary_and_rows(role: str, user_id: int, start_date: str, end_date: str, export_type: str):
+    """Rows plus the summary totalled from those same rows (every format writes it after the last row)."""
+    summary = ExportSummary()
+    return summary, iter_export_rows(role, user_id, start_date, end_date, export_type, summary)
+
+
+def write_excel(rows: Iterable[dict], summary: ExportSummary, path: str) -> str:
+    """
+    Write rows with openpyxl's write-only workbook (rows go straight to disk) plus the Summary sheet.
+    Same layout as before: "Attendance" then "Summary", or only an info Summary when there are no rows.
+    """
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    sheet = None
+    for row in rows:
+        if sheet is None:
+            sheet = wb.create_sheet("Attendance")
+            sheet.append(list(row.keys()))
+        sheet.append(list(row.values()))
+    info = wb.create_sheet("Summary")
+    if sheet is None:
+        info.append(["Info"])
+        info.append(["No attendance records for the selected period."])
+    else:
+        info.append(["Metric", "Value"])
+        for metric in summary.rows():
+            info.append(list(metric))
+    tmp = path + ".tmp"
+    wb.save(tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def stream_csv(rows: Iterable[dict]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buf, fieldnames=list(row.keys()))
+            writer.writeheader()
+        writer.writerow(row)
+        if buf.tell() >= EXPORT_STREAM_CHUNK_BYTES:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+def stream_ndjson(rows: Iterable[dict], summary: ExportSummary) -> Iterator[bytes]:
+    """One JSON object per row, then a final {"summary": {...}} line."""
+    parts, size = [], 0
+    for row in rows:
+        line = json.dumps(row, default=str) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= EXPORT_STREAM_CHUNK_BYTES:
+            yield "".join(parts).encode("utf-8")
+            parts, size = [], 0
+    parts.append(json.dumps({"summary": dict(summary.rows())}) + "\n")
+    yield "".join(parts).encode("utf-8")
+
+
+def stream_file(path: str, remove: bool = False) -> Iterator[bytes]:
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(EXPORT_STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if remove:
+            os.remove(path)
+
+
+def _prepend(first: bytes, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    # A generator (not itertools.chain) so closing the response also closes the row cursor
+    yield first
+    yield from chunks
+
+
+EXPORT_FORMATS = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def stream_export(role: str, user_id: int, start_date: str, end_date: str, export_type: str = "students",
+                  fmt: str = "xlsx") -> Tuple[Iterator[bytes], str, str]:
+    """
+    Export as a byte stream -> (chunks, mimetype, download filename).
+    CSV / NDJSON are produced as rows are read; xlsx is written to a temp file in write-only mode
+    (a zip needs its directory at the end) and streamed from disk, then removed.
+    The first chunk is produced before returning so query errors surface before the response starts.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r} (expected one of: {', '.join(EXPORT_FORMATS)})")
+    summary, rows = _summary_and_rows(role, user_id, start_date, end_date, export_type)
+    filename = f"attendance_{start_date}_to_{end_date}.{fmt}"
+    if fmt == "xlsx":
+        os.makedirs(EXPORTS_DIR, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="export_", suffix=".xlsx", dir=EXPORTS_DIR)
+        os.close(fd)
+        try:
+            write_excel(rows, summary, path)
+        except Exception:
+            os.remove(path)
+            raise
+        chunks = stream_file(path, remove=True)
+    elif fmt == "csv":
+        chunks = stream_csv(rows)
+    else:
+        chunks = stream_ndjson(rows, summary)
+    first = next(chunks, b"")
+    return _prepend(first, chunks), EXPORT_FORMATS[fmt], filename
+
+
 def export_to_excel(
     role: str,
     user_id: int,
@@ -86,30 +289,6 @@ def export_to_excel(
         start_date = date.today().isoformat()
     if not end_date:
         end_date = start_date
-
-    if role == "class_teacher":
-        df = get_students_attendance_for_export(user_id, start_date, end_date)
-    elif role == "admin" and export_type == "staff":
-        df = get_staff_attendance_for_export(start_date, end_date)
-    else:
-        df = get_all_students_attendance_for_export(start_date, end_date)
-
     filename = f"attendance_{start_date}_to_{end_date}.xlsx"
-    filepath = os.path.join(EXPORTS_DIR, filename)
-
-    if df.empty:
-        summary = pd.DataFrame({"Info": ["No attendance records for the selected period."]})
-        with pd.ExcelWriter(filepath, engine="openpyxl") as w:
-            summary.to_excel(w, sheet_name="Summary", index=False)
-    else:
-        present = len(df[df["status"] == "present"])
-        partial = len(df[df["status"] == "partial"])
-        total_records = len(df)
-        summary = pd.DataFrame({
-            "Metric": ["Total Records", "Full Attendance (IN+OUT)", "Partial (IN only)", "Unique Days"],
-            "Value": [total_records, present, partial, df["date"].nunique()],
-        })
-        with pd.ExcelWriter(filepath, engine="openpyxl") as w:
-            df.to_excel(w, sheet_name="Attendance", index=False)
-            summary.to_excel(w, sheet_name="Summary", index=False)
-    return filepath
+    summary, rows = _summary_and_rows(role, user_id, start_date, end_date, export_type)
+    return write_excel(rows, summary, os.path.join(EXPORTS_DIR, filename))
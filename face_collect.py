@@ -9,9 +9,11 @@ from datetime import datetime
 from typing import Optional
 
 from config import (
-    DATASET_DIR, MODELS_DIR, SAMPLES_PER_PERSON, FACE_IMAGE_SIZE,
+    DATASET_DIR, MODELS_DIR, SAMPLES_PER_PERSON, FACE_IMAGE_SIZE, SAMPLE_STORE_ENABLED,
 )
 from db import get_connection
+import face_detect
+from sample_store import get_sample_store
 from utils.pattern_formation import draw_pattern_formation_ui
 
 
@@ -21,11 +23,8 @@ def ensure_directories():
 
 
 def get_face_detector():
-    cascade_path = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
-    face_cascade = cv2.CascadeClassifier(cascade_path)
-    if face_cascade.empty():
-        raise RuntimeError("Failed to load Haar cascade for face detection.")
-    return face_cascade
+    """Shared pooled detector (cascade is loaded once per process)."""
+    return face_detect.get_face_detector()
 
 
 def capture_faces_for_user(user_id: int, user_name: str, samples: int = SAMPLES_PER_PERSON,
@@ -35,7 +34,7 @@ def capture_faces_for_user(user_id: int, user_name: str, samples: int = SAMPLES_
     Returns number of samples captured.
     """
     user_dir = os.path.join(DATASET_DIR, str(user_id))
-    os.makedirs(user_dir, exist_ok=True)
+    os.makedirs(DATASET_DIR if SAMPLE_STORE_ENABLED else user_dir, exist_ok=True)
     
     face_cascade = get_face_detector()
     cap = cv2.VideoCapture(camera_index)
@@ -45,6 +44,7 @@ def capture_faces_for_user(user_id: int, user_name: str, samples: int = SAMPLES_
     
     captured = 0
     frame_count = 0
+    last_box = None  # Previous detection, searched first (ROI)
     
     try:
         while captured < samples:
@@ -56,7 +56,8 @@ def capture_faces_for_user(user_id: int, user_name: str, samples: int = SAMPLES_
             animate_phase = frame_count * 0.05
             
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(80, 80))
+            faces = face_detect.detect_faces(face_cascade, gray, roi=last_box)
+            last_box = faces[0] if len(faces) else None
             
             status = f"Captured {captured}/{samples} - Align face in frame"
             frame = draw_pattern_formation_ui(frame, faces, status, animate_phase)
@@ -64,8 +65,11 @@ def capture_faces_for_user(user_id: int, user_name: str, samples: int = SAMPLES_
             for (x, y, w, h) in faces:
                 face_roi = gray[y:y + h, x:x + w]
                 face_resized = cv2.resize(face_roi, FACE_IMAGE_SIZE)
-                img_path = os.path.join(user_dir, f"{user_name}_{captured + 1:03d}.jpg")
-                cv2.imwrite(img_path, face_resized)
+                if SAMPLE_STORE_ENABLED:
+                    get_sample_store().append(user_id, face_resized)
+                else:
+                    img_path = os.path.join(user_dir, f"{user_name}_{captured + 1:03d}.jpg")
+                    cv2.imwrite(img_path, face_resized)
                 captured += 1
                 
                 cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
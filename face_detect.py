@@ -0,0 +1,262 @@
+"""
+FaceSense - Shared face detector pool.
+The detector backend (DETECT_BACKEND) is loaded once per process: the bundled Haar cascade, an LBP
+cascade, or OpenCV's YuNet DNN face detector from a local ONNX file. Detector instances are pooled
+and reused across request threads instead of being rebuilt on every call.
+detect_faces() runs detection on a downscaled frame (DETECT_MAX_WIDTH) and can restrict the
+search to a region of interest around the previous detection.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+
+import cv2
+import numpy as np
+
+from config import (
+    DETECT_MAX_WIDTH, DETECT_ROI_MARGIN, DETECT_BACKEND, DETECT_LBP_CASCADE_PATH,
+    DETECT_YUNET_MODEL_PATH, DETECT_YUNET_SCORE_THRESHOLD, DETECT_YUNET_NMS_THRESHOLD,
+)
+
+CASCADE_FILE = "haarcascade_frontalface_default.xml"
+CASCADE_WINDOW = 24  # Training window of the frontal-face cascade; faces smaller than this are never found
+
+_lock = threading.Lock()
+_idle = LifoQueue()
+_cascade_path = None
+_stats = {
+    "backend": DETECT_BACKEND,
+    "instances": 0,
+    "in_use": 0,
+    "dedicated": 0,  # Held by capture / recognition loops (get_face_detector), never returned
+    "load_count": 0,
+    "load_ms_total": 0.0,
+    "detect_count": 0,
+    "detect_ms_total": 0.0,
+    "detect_ms_max": 0.0,
+}
+
+
+# ---------- Backends ----------
+
+class CascadeBackend:
+    """Haar or LBP cascade (cv2.CascadeClassifier)."""
+
+    def __init__(self, name: str, path: str):
+        if not os.path.isfile(path):
+            raise RuntimeError(f"{name} cascade not found at {path}")
+        self.name = name
+        self.min_window = CASCADE_WINDOW
+        self._cascade = cv2.CascadeClassifier(path)
+        if self._cascade.empty():
+            raise RuntimeError(f"Failed to load {name} cascade for face detection.")
+
+    def detect(self, gray, scale_factor, min_neighbors, min_size) -> np.ndarray:
+        faces = self._cascade.detectMultiScale(gray, scaleFactor=scale_factor, minNeighbors=min_neighbors, minSize=min_size)
+        return np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+
+
+class YuNetBackend:
+    """
+    OpenCV DNN face detector (cv2.FaceDetectorYN) on CPU. Handles off-angle faces better than the
+    cascades. scale_factor / min_neighbors do not apply; faces below min_size are dropped.
+    """
+
+    def __init__(self, path: str, score_threshold: float = DETECT_YUNET_SCORE_THRESHOLD,
+                 nms_threshold: float = DETECT_YUNET_NMS_THRESHOLD):
+        if not hasattr(cv2, "FaceDetectorYN"):
+            raise RuntimeError("This OpenCV build has no FaceDetectorYN (needs opencv >= 4.5.4).")
+        if not os.path.isfile(path):
+            raise RuntimeError(f"YuNet model not found at {path}. Download face_detection_yunet_2023mar.onnx "
+                               "from the OpenCV model zoo or set DETECT_YUNET_MODEL_PATH.")
+        self.name = "yunet"
+        self.min_window = 10
+        self._detector = cv2.FaceDetectorYN.create(path, "", (320, 320), score_threshold, nms_threshold)
+        self._input_size = (320, 320)
+
+    def detect(self, gray, scale_factor, min_neighbors, min_size) -> np.ndarray:
+        height, width = gray.shape[:2]
+        if (width, height) != self._input_size:
+            self._detector.setInputSize((width, height))
+            self._input_size = (width, height)
+        image = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR) if gray.ndim == 2 else gray
+        _, faces = self._detector.detect(image)
+        if faces is None:
+            return np.empty((0, 4), np.int32)
+        boxes = np.round(faces[:, :4]).astype(np.int32)
+        boxes[:, 2:4] += np.minimum(boxes[:, 0:2], 0)  # Boxes can start outside the frame
+        boxes[:, 0:2] = np.maximum(boxes[:, 0:2], 0)
+        boxes[:, 2] = np.minimum(boxes[:, 2], width - boxes[:, 0])
+        boxes[:, 3] = np.minimum(boxes[:, 3], height - boxes[:, 1])
+        keep = (boxes[:, 2] >= min_size[0]) & (boxes[:, 3] >= min_size[1])
+        return boxes[keep]
+
+
+BACKENDS = ("haar", "lbp", "yunet")
+
+
+def create_backend(name: str = DETECT_BACKEND):
+    """Load a detector backend by name."""
+    if name == "haar":
+        return CascadeBackend("Haar", get_cascade_path())
+    if name == "lbp":
+        return CascadeBackend("LBP", DETECT_LBP_CASCADE_PATH)
+    if name == "yunet":
+        return YuNetBackend(DETECT_YUNET_MODEL_PATH)
+    raise RuntimeError(f"Unknown DETECT_BACKEND {name!r} (expected one of: {', '.join(BACKENDS)})")
+
+
+# ---------- Pool ----------
+
+class PooledDetector:
+    """Backend wrapper that records detection timing."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self.name = backend.name
+        self.min_window = backend.min_window
+
+    def detect(self, gray, scale_factor, min_neighbors, min_size) -> np.ndarray:
+        t0 = time.perf_counter()
+        faces = self._backend.detect(gray, scale_factor, min_neighbors, min_size)
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        with _lock:
+            _stats["detect_count"] += 1
+            _stats["detect_ms_total"] += elapsed_ms
+            _stats["detect_ms_max"] = max(_stats["detect_ms_max"], elapsed_ms)
+        return faces
+
+
+def get_cascade_path() -> str:
+    """Resolve and validate the Haar cascade path once per process."""
+    global _cascade_path
+    if _cascade_path is None:
+        path = os.path.join(cv2.data.haarcascades, CASCADE_FILE)
+        if not os.path.isfile(path):
+            raise RuntimeError(f"Haar cascade not found at {path}")
+        _cascade_path = path
+    return _cascade_path
+
+
+def _create_detector() -> PooledDetector:
+    t0 = time.perf_counter()
+    backend = create_backend(DETECT_BACKEND)
+    elapsed_ms = (time.perf_counter() - t0) * 1000.0
+    with _lock:
+        _stats["instances"] += 1
+        _stats["load_count"] += 1
+        _stats["load_ms_total"] += elapsed_ms
+    return PooledDetector(backend)
+
+
+def acquire_detector() -> PooledDetector:
+    """Check out an idle detector, creating one only when every instance is busy."""
+    try:
+        detector = _idle.get_nowait()
+    except Empty:
+        detector = _create_detector()
+    with _lock:
+        _stats["in_use"] += 1
+    return detector
+
+
+def release_detector(detector: PooledDetector):
+    """Return a detector to the pool."""
+    with _lock:
+        _stats["in_use"] -= 1
+    _idle.put(detector)
+
+
+@contextmanager
+def face_detector():
+    """Yield a pooled detector for the duration of one request."""
+    detector = acquire_detector()
+    try:
+        yield detector
+    finally:
+        release_detector(detector)
+
+
+def get_face_detector() -> PooledDetector:
+    """
+    Detector held for the lifetime of a capture/recognition loop. It leaves the pool for good,
+    so it is counted under "dedicated" rather than "in_use".
+    """
+    try:
+        detector = _idle.get_nowait()
+    except Empty:
+        detector = _create_detector()
+    with _lock:
+        _stats["dedicated"] += 1
+    return detector
+
+
+def warm_up():
+    """Load the first detector eagerly so the first request does not pay the model load."""
+    release_detector(acquire_detector())
+
+
+def get_detector_stats() -> dict:
+    """Load-time and per-call detection timing for the pool."""
+    with _lock:
+        stats = dict(_stats)
+    stats["idle"] = _idle.qsize()
+    stats["load_ms_avg"] = stats["load_ms_total"] / stats["load_count"] if stats["load_count"] else 0.0
+    stats["detect_ms_avg"] = stats["detect_ms_total"] / stats["detect_count"] if stats["detect_count"] else 0.0
+    return stats
+
+
+def _detect_scaled(detector, gray, scale_factor, min_neighbors, min_size, max_width):
+    height, width = gray.shape[:2]
+    scale = 1.0
+    if max_width and width > max_width:
+        # Never shrink the smallest wanted face below the detector's window
+        scale = min(1.0, max(max_width / width, detector.min_window / min(min_size)))
+    if scale >= 1.0:
+        return detector.detect(gray, scale_factor, min_neighbors, min_size)
+    small = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    scaled_min = (max(1, int(min_size[0] * scale)), max(1, int(min_size[1] * scale)))
+    faces = detector.detect(small, scale_factor, min_neighbors, scaled_min)
+    boxes = np.round(faces.astype(np.float32) / scale).astype(np.int32)
+    boxes[:, 0:2] = np.clip(boxes[:, 0:2], 0, [width - 1, height - 1])
+    boxes[:, 2] = np.minimum(boxes[:, 2], width - boxes[:, 0])
+    boxes[:, 3] = np.minimum(boxes[:, 3], height - boxes[:, 1])
+    return boxes
+
+
+def expand_roi(roi, shape, margin: float = DETECT_ROI_MARGIN):
+    """Grow an (x, y, w, h) box by margin * its size on every side, clipped to the frame -> (x0, y0, x1, y1)."""
+    x, y, w, h = (int(v) for v in roi)
+    height, width = shape[:2]
+    dx, dy = int(w * margin), int(h * margin)
+    return max(0, x - dx), max(0, y - dy), min(width, x + w + dx), min(height, y + h + dy)
+
+
+def detect_faces(detector, gray, scale_factor: float = 1.2, min_neighbors: int = 5, min_size=(80, 80),
+                 roi=None, max_width: int = DETECT_MAX_WIDTH):
+    """
+    Detect faces on a copy downscaled to max_width and map the boxes back to full resolution,
+    so crops are still taken from the original frame. Returns an (N, 4) int32 array of (x, y, w, h).
+    roi=(x, y, w, h) searches only around that box (grown by DETECT_ROI_MARGIN) and falls back to
+    the whole frame when nothing is found there.
+    """
+    if roi is not None:
+        x0, y0, x1, y1 = expand_roi(roi, gray.shape)
+        if x1 - x0 >= min_size[0] and y1 - y0 >= min_size[1]:
+            faces = _detect_scaled(detector, gray[y0:y1, x0:x1], scale_factor, min_neighbors, min_size, max_width)
+            if len(faces):
+                faces[:, 0] += x0
+                faces[:, 1] += y0
+                return faces
+    return _detect_scaled(detector, gray, scale_factor, min_neighbors, min_size, max_width)
+
+
+def bounding_box(boxes):
+    """Smallest (x, y, w, h) covering all boxes, or None (ROI for several tracked faces)."""
+    if not len(boxes):
+        return None
+    b = np.asarray(boxes).reshape(-1, 4)
+    x0, y0 = b[:, 0].min(), b[:, 1].min()
+    return int(x0), int(y0), int((b[:, 0] + b[:, 2]).max() - x0), int((b[:, 1] + b[:, 3]).max() - y0)
@@ -3,18 +3,23 @@ FaceSense - Recognition with pattern overlay, 80% accuracy check, and location v
 Uses MySQL for location and attendance.
 """
 import os
-import json
-from datetime import datetime, date
-from typing import Tuple, Dict, Optional
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime
+from typing import Tuple, Dict, List, Optional
 
 import cv2
 import numpy as np
 
 from config import (
-    MODELS_DIR, MODEL_PATH, LABELS_PATH, EXPORTS_DIR,
-    CONFIDENCE_THRESHOLD, LOCATION_ACCURACY_THRESHOLD
+    MODELS_DIR, EXPORTS_DIR,
+    CONFIDENCE_THRESHOLD, LOCATION_ACCURACY_THRESHOLD, FACE_IMAGE_SIZE,
+    MATCH_TOP_K, MATCH_MARGIN, MATCH_USER_SAMPLES, DETECT_FULL_SCAN_INTERVAL
 )
-from db import get_connection
+import attendance
+import face_detect
+from face_tracker import FaceTracker
+from location_cache import get_registered_locations, get_campus, save_locations
+from model_registry import load_model
 from utils.pattern_formation import draw_pattern_formation_ui
 from utils.location_utils import is_near_registered_location, is_within_campus
 
@@ -25,103 +30,139 @@ def ensure_setup():
 
 
 def load_model_and_labels() -> Tuple:
-    if not os.path.isfile(MODEL_PATH) or not os.path.isfile(LABELS_PATH):
-        raise RuntimeError("Model not found. Train first by running model_train.py")
+    model = load_model()
+    return model.recognizer, model.id_to_name
 
-    recognizer = cv2.face.LBPHFaceRecognizer_create()
-    recognizer.read(MODEL_PATH)
-    with open(LABELS_PATH, "r", encoding="utf-8") as f:
-        meta = json.load(f)
-        id_to_name = {int(k): v for k, v in meta.get("id_to_name", {}).items()}
 
-    return recognizer, id_to_name
+def get_face_detector():
+    """Shared pooled detector (cascade is loaded once per process)."""
+    return face_detect.get_face_detector()
 
 
-def get_face_detector():
-    cascade_path = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
-    face_cascade = cv2.CascadeClassifier(cascade_path)
-    if face_cascade.empty():
-        raise RuntimeError("Failed to load Haar cascade.")
-    return face_cascade
+def crop_faces(gray: np.ndarray, faces) -> np.ndarray:
+    """Resize every detected face to FACE_IMAGE_SIZE -> (N, H, W) uint8."""
+    width, height = FACE_IMAGE_SIZE
+    crops = [cv2.resize(gray[y:y+h, x:x+w], FACE_IMAGE_SIZE) for (x, y, w, h) in faces]
+    return np.stack(crops) if crops else np.empty((0, height, width), np.uint8)
+
+
+def match_crops(crops: np.ndarray, recognizer, top_k: int = MATCH_TOP_K) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k (labels, distances) for a batch of face crops.
+    The NumPy recognizer scores the whole batch in one pass; a legacy OpenCV model falls back to predict().
+    """
+    if hasattr(recognizer, "match"):
+        return recognizer.match(crops, k=top_k, samples_per_user=MATCH_USER_SAMPLES)
+    labels = np.full((len(crops), top_k), -1, dtype=np.int32)
+    dists = np.full((len(crops), top_k), np.inf, dtype=np.float32)
+    for i, crop in enumerate(crops):
+        labels[i, 0], dists[i, 0] = recognizer.predict(crop)
+    return labels, dists
+
+
+def recognition_results(labels: np.ndarray, dists: np.ndarray, boxes, id_to_name: Dict[int, str],
+                        confidence_threshold: float = CONFIDENCE_THRESHOLD) -> List[Dict]:
+    """
+    Turn top-k matches into one result per face. A face is recognized when its best user is within
+    the threshold and (with MATCH_MARGIN set) clearly ahead of the runner-up.
+    """
+    results = []
+    for row_labels, row_dists, (x, y, w, h) in zip(labels, dists, boxes):
+        label_id, conf = int(row_labels[0]), float(row_dists[0])
+        ambiguous = MATCH_MARGIN > 0 and len(row_dists) > 1 and row_dists[1] - conf < MATCH_MARGIN
+        recognized = label_id in id_to_name and conf <= confidence_threshold and not ambiguous
+        results.append({
+            "recognized": recognized,
+            "user_id": label_id if recognized else None,
+            "name": id_to_name[label_id] if recognized else None,
+            "confidence": max(0, 100 - conf),
+            "ambiguous": bool(ambiguous),
+            "candidates": [
+                {"user_id": int(l), "name": id_to_name.get(int(l)), "confidence": max(0, 100 - float(d))}
+                for l, d in zip(row_labels, row_dists) if l >= 0
+            ],
+            "bbox": [int(x), int(y), int(w), int(h)],
+        })
+    return results
+
+
+def recognize_faces(gray: np.ndarray, faces, recognizer, id_to_name: Dict[int, str],
+                    confidence_threshold: float = CONFIDENCE_THRESHOLD) -> List[Dict]:
+    """Predict a label for every detected face (not just the first). Returns one result per face."""
+    labels, dists = match_crops(crop_faces(gray, faces), recognizer)
+    return recognition_results(labels, dists, faces, id_to_name, confidence_threshold)
+
+
+def recognize_faces_sharded(gray: np.ndarray, faces, model, shard: Optional[str] = None,
+                            confidence_threshold: float = CONFIDENCE_THRESHOLD) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Match against the small gallery of a shard first (model_registry.LoadedModel.shard); faces it
+    does not recognize fall back to the global model. Returns (results, shard used or None).
+    """
+    crops = crop_faces(gray, faces)
+    recognizer = model.shard(shard) if shard else None
+    if recognizer is None:
+        labels, dists = match_crops(crops, model.recognizer)
+        return recognition_results(labels, dists, faces, model.id_to_name, confidence_threshold), None
+    labels, dists = match_crops(crops, recognizer)
+    results = recognition_results(labels, dists, faces, model.id_to_name, confidence_threshold)
+    retry = [i for i, r in enumerate(results) if not r["recognized"]]
+    if retry:
+        labels, dists = match_crops(crops[retry], model.recognizer)
+        fallback = recognition_results(labels, dists, [faces[i] for i in retry], model.id_to_name, confidence_threshold)
+        for i, r in zip(retry, fallback):
+            results[i] = r
+    for i, r in enumerate(results):
+        r["matched_in"] = "global" if i in retry else "shard"
+    return results, shard
+
+
+def build_roster(results: List[Dict]) -> Tuple[List[Dict], int]:
+    """
+    Dedupe recognized faces by identity, keeping the best match per user.
+    Returns (roster sorted by user_id, number of duplicate faces dropped).
+    """
+    best = {}
+    duplicates = 0
+    for r in results:
+        if not r["recognized"]:
+            continue
+        uid = r["user_id"]
+        if uid in best:
+            duplicates += 1
+            if r["confidence"] <= best[uid]["confidence"]:
+                continue
+        best[uid] = r
+    roster = [
+        {"user_id": uid, "name": r["name"], "confidence": r["confidence"], "bbox": r["bbox"]}
+        for uid, r in sorted(best.items())
+    ]
+    return roster, duplicates
 
 
 def get_user_registered_location(user_id: int) -> Optional[Tuple[float, float]]:
-    """Get the location where user first registered (for anti-fraud check)."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT latitude, longitude FROM user_locations WHERE user_id = %s ORDER BY registered_at DESC LIMIT 1",
-                (user_id,),
-            )
-            row = cur.fetchone()
-    return (row["latitude"], row["longitude"]) if row else None
+    """Get the location where user first registered (for anti-fraud check). Cached, see location_cache."""
+    return get_registered_locations([user_id]).get(user_id)
 
 
 def get_campus_boundary() -> Optional[Tuple[float, float, float]]:
-    """Get active campus center and radius (lat, lon, radius_m)."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT center_lat, center_lon, radius_meters FROM campus_boundaries WHERE is_active = 1 LIMIT 1"
-            )
-            row = cur.fetchone()
-    return (row["center_lat"], row["center_lon"], row["radius_meters"]) if row else None
+    """Get active campus center and radius (lat, lon, radius_m). Cached, see location_cache."""
+    return get_campus()
 
 
 def save_user_location(user_id: int, lat: float, lon: float, accuracy: Optional[float] = None):
     """Store location on first registration."""
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO user_locations (user_id, latitude, longitude, accuracy, registered_at) VALUES (%s, %s, %s, %s, %s)",
-                (user_id, lat, lon, accuracy, datetime.utcnow().isoformat()),
-            )
+    save_locations({user_id: (lat, lon)}, accuracy)
 
 
 def log_attendance(user_id: int, user_name: str, attendance_type: str, lat: Optional[float] = None,
                    lon: Optional[float] = None, on_campus: int = 1) -> str:
     """Log attendance with location data."""
-    now = datetime.utcnow()
-    today = now.date().isoformat()
-    ts = now.time().strftime("%H:%M:%S")
-
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, in_time, out_time FROM attendance WHERE user_id = %s AND date = %s",
-                (user_id, today),
-            )
-            row = cur.fetchone()
-
-            if row:
-                rec_id, in_time, out_time = row["id"], row["in_time"], row["out_time"]
-                if attendance_type == "in":
-                    if in_time:
-                        return f"{user_name} already marked IN at {in_time}"
-                    cur.execute(
-                        "UPDATE attendance SET in_time = %s, status = 'partial', latitude = %s, longitude = %s, on_campus = %s WHERE id = %s",
-                        (ts, lat, lon, on_campus, rec_id),
-                    )
-                else:
-                    if out_time:
-                        return f"{user_name} already marked OUT at {out_time}"
-                    if not in_time:
-                        return f"{user_name} must mark IN first"
-                    cur.execute(
-                        "UPDATE attendance SET out_time = %s, status = 'present' WHERE id = %s",
-                        (ts, rec_id),
-                    )
-            else:
-                if attendance_type == "in":
-                    cur.execute(
-                        """INSERT INTO attendance (user_id, date, in_time, status, latitude, longitude, on_campus, created_at)
-                           VALUES (%s, %s, %s, 'partial', %s, %s, %s, %s)""",
-                        (user_id, today, ts, lat, lon, on_campus, now.isoformat()),
-                    )
-                else:
-                    return f"{user_name} must mark IN first"
-
-    return f"{user_name} marked {attendance_type.upper()} at {ts}"
+    try:
+        result = attendance.mark(user_id, attendance_type, lat, lon, on_campus)
+    except FutureTimeoutError:
+        return f"{user_name} {attendance_type.upper()} accepted, recording pending"
+    return attendance.describe(result, user_name)
 
 
 def recognize_loop(confidence_threshold: float = CONFIDENCE_THRESHOLD,
@@ -140,6 +181,7 @@ def recognize_loop(confidence_threshold: float = CONFIDENCE_THRESHOLD,
     last_attendance = {}
     cooldown_sec = 5
     frame_count = 0
+    tracker = FaceTracker()
 
     print("[INFO] FaceSense Recognition - Press 'i' IN, 'o' OUT, 'e' export, 'q' quit")
 
@@ -150,39 +192,44 @@ def recognize_loop(confidence_threshold: float = CONFIDENCE_THRESHOLD,
 
         frame_count += 1
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=5, minSize=(80, 80))
-
-        recognized_user_id = None
-        recognized_name = None
-        match_confidence = 0
-        location_ok = True
-
-        for (x, y, w, h) in faces:
-            face_roi = cv2.resize(gray[y:y+h, x:x+w], (200, 200))
-            label_id, conf = recognizer.predict(face_roi)
-            acc_pct = max(0, 100 - conf)
-
-            if label_id in id_to_name and conf < confidence_threshold:
-                recognized_user_id = label_id
-                recognized_name = id_to_name[label_id]
-                match_confidence = acc_pct
-
-                reg_loc = get_user_registered_location(label_id)
-                if reg_loc and lat is not None and lon is not None:
+        # While faces are tracked, search only around them; do a full scan periodically for newcomers
+        roi = None
+        if tracker.tracks and frame_count % DETECT_FULL_SCAN_INTERVAL:
+            roi = face_detect.bounding_box([t.bbox for t in tracker.tracks])
+        faces = face_detect.detect_faces(face_cascade, gray, roi=roi)
+
+        # Only new tracks and tracks past their interval are recognized; the rest reuse their voted identity
+        tracks = tracker.update(faces, frame_count)
+        due = tracker.due(tracks, frame_count)
+        if due:
+            tracker.observe(due, recognize_faces(gray, [t.bbox for t in due], recognizer, id_to_name,
+                                                 confidence_threshold), frame_count)
+        results = [t.result() for t in tracks]
+        roster, _ = build_roster(results)
+
+        campus = get_campus_boundary() if roster and lat is not None and lon is not None else None
+        for entry in roster:
+            location_ok = True
+            if lat is not None and lon is not None:
+                reg_loc = get_user_registered_location(entry["user_id"])
+                if reg_loc:
                     location_ok = is_near_registered_location(lat, lon, reg_loc[0], reg_loc[1], LOCATION_ACCURACY_THRESHOLD)
-                elif not reg_loc and lat is not None and lon is not None:
-                    save_user_location(label_id, lat, lon)
-
-                campus = get_campus_boundary()
-                if campus and lat is not None and lon is not None:
+                else:
+                    save_user_location(entry["user_id"], lat, lon)
+                if campus:
                     location_ok = location_ok and is_within_campus(lat, lon, campus[0], campus[1], campus[2])
+            entry["location_ok"] = location_ok
+        location_by_user = {entry["user_id"]: entry["location_ok"] for entry in roster}
 
-            status = f"{recognized_name} ({acc_pct:.0f}%)" if recognized_name else "Unknown"
+        for r in results:
+            x, y, w, h = r["bbox"]
+            location_ok = location_by_user.get(r["user_id"], True)
+            status = f"{r['name']} ({r['confidence']:.0f}%)" if r["recognized"] else "Unknown"
             if not location_ok:
                 status += " | Location mismatch!"
             frame = draw_pattern_formation_ui(frame, [(x, y, w, h)], status, frame_count * 0.05)
 
-            color = (0, 255, 0) if (recognized_name and location_ok) else (0, 0, 255)
+            color = (0, 255, 0) if (r["recognized"] and location_ok) else (0, 0, 255)
             cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
 
         cv2.imshow("FaceSense Recognition", frame)
@@ -191,19 +238,23 @@ def recognize_loop(confidence_threshold: float = CONFIDENCE_THRESHOLD,
         if key == ord('q'):
             break
         elif key == ord('i') or key == ord('o'):
-            if recognized_user_id and recognized_name and location_ok and len(faces) > 0:
-                now = datetime.utcnow()
-                if recognized_user_id in last_attendance:
-                    if (now - last_attendance[recognized_user_id]).seconds < cooldown_sec:
-                        continue
-                att_type = "in" if key == ord('i') else "out"
-                msg = log_attendance(recognized_user_id, recognized_name, att_type, lat, lon, 1 if location_ok else 0)
+            att_type = "in" if key == ord('i') else "out"
+            now = datetime.utcnow()
+            for entry in roster:
+                uid = entry["user_id"]
+                if not entry["location_ok"]:
+                    print(f"[WARN] {entry['name']}: location verification failed - attendance not recorded.")
+                    continue
+                if uid in last_attendance and (now - last_attendance[uid]).seconds < cooldown_sec:
+                    continue
+                msg = log_attendance(uid, entry["name"], att_type, lat, lon, 1)
                 print(f"[INFO] {msg}")
-                last_attendance[recognized_user_id] = now
+                last_attendance[uid] = now
                 if on_mark_callback:
                     on_mark_callback(msg)
-            elif recognized_user_id and not location_ok:
-                print("[WARN] Location verification failed - attendance not recorded.")
 
     cap.release()
     cv2.destroyAllWindows()
+    skipped = tracker.skipped_ratio()
+    if skipped is not None:
+        print(f"[INFO] Tracking skipped recognition for {skipped * 100:.0f}% of detected faces")
@@ -0,0 +1,118 @@
+"""
+FaceSense - IoU face tracker for continuous recognition.
+Detected boxes are linked across frames by overlap, so a face that stays in view keeps one track.
+Recognition runs when a track appears and then every TRACK_RECOGNIZE_INTERVAL frames; the identity
+shown for a track is voted over its last TRACK_HISTORY recognitions.
+"""
+from collections import Counter, deque
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import TRACK_IOU_THRESHOLD, TRACK_MAX_MISSED, TRACK_RECOGNIZE_INTERVAL, TRACK_HISTORY
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Intersection-over-union of (x, y, w, h) boxes: (A, 4) x (B, 4) -> (A, B)."""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    iw = np.clip(np.minimum(ax2[:, None], bx2[None]) - np.maximum(a[:, 0, None], b[None, :, 0]), 0, None)
+    ih = np.clip(np.minimum(ay2[:, None], by2[None]) - np.maximum(a[:, 1, None], b[None, :, 1]), 0, None)
+    inter = iw * ih
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+class Track:
+    """One face followed across frames, with its recent recognition results."""
+
+    def __init__(self, track_id: int, bbox, frame_index: int):
+        self.id = track_id
+        self.bbox = [int(v) for v in bbox]
+        self.missed = 0
+        self.last_recognized = None  # frame index of the last recognition
+        self.history = deque(maxlen=TRACK_HISTORY)  # (user_id or None, name, confidence)
+        self.created = frame_index
+
+    def observe(self, result: Dict, frame_index: int):
+        self.last_recognized = frame_index
+        self.history.append((result["user_id"] if result["recognized"] else None, result["name"], result["confidence"]))
+
+    def result(self) -> Dict:
+        """Voted identity in the same shape as face_recognize.recognize_faces results."""
+        votes = Counter(uid for uid, _, _ in self.history if uid is not None)
+        uid, count = votes.most_common(1)[0] if votes else (None, 0)
+        recognized = uid is not None and count * 2 >= len(self.history)
+        if recognized:
+            matches = [(name, conf) for u, name, conf in self.history if u == uid]
+            name, confidence = matches[-1][0], sum(c for _, c in matches) / len(matches)
+        else:
+            name, confidence = None, self.history[-1][2] if self.history else 0.0
+        return {
+            "recognized": recognized,
+            "user_id": uid if recognized else None,
+            "name": name,
+            "confidence": confidence,
+            "bbox": list(self.bbox),
+            "track_id": self.id,
+        }
+
+
+class FaceTracker:
+    """Greedy IoU matching of detections to tracks; tracks unseen for TRACK_MAX_MISSED frames are dropped."""
+
+    def __init__(self, iou_threshold: float = TRACK_IOU_THRESHOLD, max_missed: int = TRACK_MAX_MISSED,
+                 recognize_interval: int = TRACK_RECOGNIZE_INTERVAL):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.recognize_interval = recognize_interval
+        self.tracks = []  # type: List[Track]
+        self._next_id = 1
+        self.stats = {"frames": 0, "faces": 0, "recognitions": 0}
+
+    def update(self, boxes, frame_index: int) -> List[Track]:
+        """Link this frame's detections to tracks. Returns the tracks visible in this frame."""
+        boxes = [tuple(int(v) for v in b) for b in boxes]
+        self.stats["frames"] += 1
+        self.stats["faces"] += len(boxes)
+        matched_tracks, matched_boxes = set(), set()
+        if self.tracks and boxes:
+            iou = iou_matrix([t.bbox for t in self.tracks], boxes)
+            for ti, bi in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                if iou[ti, bi] < self.iou_threshold:
+                    break
+                if ti in matched_tracks or bi in matched_boxes:
+                    continue
+                matched_tracks.add(ti)
+                matched_boxes.add(bi)
+                self.tracks[ti].bbox = list(boxes[bi])
+                self.tracks[ti].missed = 0
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.missed += 1
+        visible = [t for ti, t in enumerate(self.tracks) if ti in matched_tracks]
+        self.tracks = [t for t in self.tracks if t.missed <= self.max_missed]
+        for bi, box in enumerate(boxes):
+            if bi not in matched_boxes:
+                track = Track(self._next_id, box, frame_index)
+                self._next_id += 1
+                self.tracks.append(track)
+                visible.append(track)
+        return visible
+
+    def due(self, tracks: List[Track], frame_index: int) -> List[Track]:
+        """Tracks that need recognition now: new ones, and those past the re-recognition interval."""
+        return [t for t in tracks if t.last_recognized is None or frame_index - t.last_recognized >= self.recognize_interval]
+
+    def observe(self, tracks: List[Track], results: List[Dict], frame_index: int):
+        self.stats["recognitions"] += len(tracks)
+        for track, result in zip(tracks, results):
+            track.observe(result, frame_index)
+
+    def skipped_ratio(self) -> Optional[float]:
+        """Share of detected faces whose recognition was skipped."""
+        if not self.stats["faces"]:
+            return None
+        return 1.0 - self.stats["recognitions"] / self.stats["faces"]
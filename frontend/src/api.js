@@ -126,33 +126,54 @@ export async function setStudentClassTeacher(userId, classTeacherId) {
   return data;
 }
 
-export async function registerFace(userId, imageBase64, lat, lon) {
+// reset: true on the first sample of a re-registration replaces the user's previous samples
+export async function registerFace(userId, imageBase64, lat, lon, reset = false) {
   const res = await fetch(`${API_BASE}/register-face`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ user_id: userId, image: imageBase64, latitude: lat, longitude: lon }),
+    body: JSON.stringify({ user_id: userId, image: imageBase64, latitude: lat, longitude: lon, reset }),
   });
   const data = await res.json();
   if (!res.ok) throw new Error(data.error || 'Failed');
   return data;
 }
 
-export async function trainModel() {
-  const res = await fetch(`${API_BASE}/train`, { method: 'POST' });
+export async function trainModel(full = false, onProgress) {
+  const res = await fetch(`${API_BASE}/train`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ full }),
+  });
   const data = await res.json();
   if (!res.ok) throw new Error(data.error || 'Failed');
-  return data;
-}
-
-export async function recognizeFace(imageBase64, lat, lon) {
+  let job = data.job;
+  while (job.status === 'queued' || job.status === 'running') {
+    await new Promise((r) => setTimeout(r, 1000));
+    const poll = await fetch(`${API_BASE}/train/${data.job_id}`);
+    const body = await poll.json();
+    if (!poll.ok) throw new Error(body.error || 'Failed');
+    job = body.job;
+    if (onProgress) onProgress(job);
+  }
+  if (job.status === 'failed') throw new Error(job.error || 'Training failed');
+  return job;
+}
+
+export async function recognizeFace(imageBase64, lat, lon, shard = null) {
   const res = await fetch(`${API_BASE}/recognize`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ image: imageBase64, latitude: lat, longitude: lon }),
+    body: JSON.stringify({ image: imageBase64, latitude: lat, longitude: lon, shard }),
   });
   return res.json();
 }
 
+// Persistent kiosk stream: send JPEG Blobs, receive JSON events (see kiosk_stream.py)
+export function openRecognizeStream() {
+  const proto = window.location.protocol === 'https:' ? 'wss' : 'ws';
+  return new WebSocket(`${proto}://${window.location.host}${API_BASE}/recognize/stream`);
+}
+
 export async function markAttendance(userId, userName, type, lat, lon, locationOk) {
   const res = await fetch(`${API_BASE}/attendance/mark`, {
     method: 'POST',
@@ -186,14 +207,14 @@ export async function getAttendanceStats(role, userId, start, end) {
   return data.stats || {};
 }
 
-export async function exportAttendance(role, userId, start, end, exportType = 'students') {
-  let url = `${API_BASE}/export?role=${role}&user_id=${userId || 1}&start=${start}&end=${end}&export_type=${exportType}`;
+export async function exportAttendance(role, userId, start, end, exportType = 'students', format = 'xlsx') {
+  let url = `${API_BASE}/export?role=${role}&user_id=${userId || 1}&start=${start}&end=${end}&export_type=${exportType}&format=${format}`;
   const res = await fetch(url);
   if (!res.ok) throw new Error('Export failed');
   const blob = await res.blob();
   const a = document.createElement('a');
   a.href = URL.createObjectURL(blob);
-  a.download = `attendance_${start}_to_${end}.xlsx`;
+  a.download = `attendance_${start}_to_${end}.${format}`;
   a.click();
   URL.revokeObjectURL(a.href);
 }
@@ -1,5 +1,9 @@
 import { useState, useRef, useEffect, useCallback } from 'react'
-import { recognizeFace, markAttendance } from '../api'
+import { recognizeFace, markAttendance, openRecognizeStream } from '../api'
+
+// Kiosks in one building add ?shard=department:3 to the URL to search that gallery first
+const KIOSK_SHARD = new URLSearchParams(window.location.search).get('shard')
+const STREAM_FRAME_INTERVAL_MS = 150
 
 export default function AttendanceKiosk({ user }) {
   const videoRef = useRef(null)
@@ -9,6 +13,8 @@ export default function AttendanceKiosk({ user }) {
   const [status, setStatus] = useState('')
   const [location, setLocation] = useState({ lat: null, lon: null })
   const [capturing, setCapturing] = useState(false)
+  const [live, setLive] = useState(false)
+  const wsRef = useRef(null)
 
   const getLocation = useCallback(() => {
     if (!navigator.geolocation) return
@@ -45,6 +51,63 @@ export default function AttendanceKiosk({ user }) {
     return c.toDataURL('image/jpeg', 0.8)
   }
 
+  const captureBlob = () => new Promise((resolve) => {
+    const v = videoRef.current
+    const c = canvasRef.current
+    if (!v || !c || !v.videoWidth) return resolve(null)
+    c.width = v.videoWidth
+    c.height = v.videoHeight
+    c.getContext('2d').drawImage(v, 0, 0)
+    c.toBlob(resolve, 'image/jpeg', 0.8)
+  })
+
+  // Live mode: one WebSocket, binary frames, next frame sent only after the server acks the last one
+  useEffect(() => {
+    if (!live) return undefined
+    const ws = openRecognizeStream()
+    wsRef.current = ws
+    let stopped = false
+    const sendFrame = async () => {
+      if (stopped || ws.readyState !== WebSocket.OPEN) return
+      const blob = await captureBlob()
+      if (blob) ws.send(blob)
+      else setTimeout(sendFrame, 500)
+    }
+    ws.onopen = () => {
+      ws.send(JSON.stringify({ type: 'config', latitude: location.lat, longitude: location.lon, shard: KIOSK_SHARD }))
+      setStatus('Live recognition...')
+      sendFrame()
+    }
+    ws.onmessage = (e) => {
+      const msg = JSON.parse(e.data)
+      if (msg.type === 'frame') {
+        setTimeout(sendFrame, STREAM_FRAME_INTERVAL_MS)
+      } else if (msg.type === 'recognized') {
+        setResult({ ...msg, recognized: true })
+        setStatus(msg.location_ok ? 'Recognized - Press IN or OUT' : 'Location mismatch - attendance denied')
+      } else if (msg.type === 'cleared') {
+        setResult(null)
+        setStatus('Live recognition...')
+      } else if (msg.type === 'error') {
+        setStatus(msg.error)
+      }
+    }
+    ws.onerror = () => setStatus('Live stream unavailable - use Recognize Face')
+    ws.onclose = () => { if (!stopped) setLive(false) }
+    return () => {
+      stopped = true
+      wsRef.current = null
+      ws.close()
+    }
+  }, [live])
+
+  useEffect(() => {
+    const ws = wsRef.current
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({ type: 'config', latitude: location.lat, longitude: location.lon }))
+    }
+  }, [location])
+
   const handleRecognize = async () => {
     const img = captureFrame()
     if (!img) return
@@ -52,7 +115,7 @@ export default function AttendanceKiosk({ user }) {
     setStatus('Recognizing...')
     setResult(null)
     try {
-      const data = await recognizeFace(img, location.lat, location.lon)
+      const data = await recognizeFace(img, location.lat, location.lon, KIOSK_SHARD)
       setResult(data)
       if (data.recognized) {
         setStatus(data.location_ok ? 'Recognized - Press IN or OUT' : 'Location mismatch - attendance denied')
@@ -95,9 +158,12 @@ export default function AttendanceKiosk({ user }) {
       </div>
 
       <div style={{ marginTop: '1rem', display: 'flex', gap: '0.5rem', flexWrap: 'wrap' }}>
-        <button className="btn btn-primary" onClick={handleRecognize} disabled={capturing}>
+        <button className="btn btn-primary" onClick={handleRecognize} disabled={capturing || live}>
           Recognize Face
         </button>
+        <button className={`btn ${live ? 'btn-danger' : 'btn-success'}`} onClick={() => setLive((on) => !on)} disabled={!stream}>
+          {live ? 'Stop Live' : 'Live Recognition'}
+        </button>
         {result?.recognized && result.location_ok && (
           <>
             <button className="btn btn-primary" onClick={() => handleMark('in')} disabled={capturing}>
@@ -40,7 +40,7 @@ export default function FaceRegistration({ user, onDone }) {
     ctx.drawImage(v, 0, 0)
     const img = c.toDataURL('image/jpeg', 0.8)
     try {
-      await registerFace(user.id, img, location.lat, location.lon)
+      await registerFace(user.id, img, location.lat, location.lon, count === 0)
       setCount((prev) => prev + 1)
       setStatus(`Captured ${count + 1}/${TARGET_SAMPLES}`)
     } catch (e) {
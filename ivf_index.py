@@ -0,0 +1,119 @@
+"""
+FaceSense - Inverted-file (IVF) index for large LBPH galleries.
+Gallery histograms are partitioned into coarse k-means cells (in square-root space, where L2 distance
+approximates chi-square). A query is compared exactly only against the rows of its nprobe nearest
+cells, so matching cost grows with the probed cells instead of the whole enrolled population.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+from lbph import NumpyLBPHRecognizer, chi_square_matrix, spatial_histograms
+
+_CHUNK_ROWS = 4096
+
+
+def _sqrt_space(histograms: np.ndarray) -> np.ndarray:
+    return np.sqrt(np.asarray(histograms, dtype=np.float32))
+
+
+def _nearest_cells(points: np.ndarray, centroids: np.ndarray, n: int = 1) -> np.ndarray:
+    """Indices of the n nearest centroids (L2) for each sqrt-space point -> (P, n)."""
+    c_norm = (centroids * centroids).sum(axis=1)
+    out = np.empty((len(points), n), dtype=np.int32)
+    for start in range(0, len(points), _CHUNK_ROWS):
+        p = points[start:start + _CHUNK_ROWS]
+        d = c_norm[np.newaxis, :] - 2.0 * (p @ centroids.T)  # ||p||^2 is constant per row
+        if n < d.shape[1]:
+            part = np.argpartition(d, n - 1, axis=1)[:, :n]
+            out[start:start + len(p)] = np.take_along_axis(part, np.argsort(np.take_along_axis(d, part, axis=1), axis=1), axis=1)
+        else:
+            out[start:start + len(p)] = np.argsort(d, axis=1)[:, :n]
+    return out
+
+
+def default_nlist(count: int) -> int:
+    """About 4 * sqrt(N) cells, the usual IVF rule of thumb."""
+    return max(1, min(count, int(4 * np.sqrt(count))))
+
+
+def train_centroids(histograms: np.ndarray, nlist: int = 0, iterations: int = 10, sample: int = 256,
+                    seed: int = 0) -> np.ndarray:
+    """k-means coarse quantizer over (at most sample * nlist) gallery rows. Returns (nlist, F) float32."""
+    nlist = nlist or default_nlist(len(histograms))
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(histograms), size=min(len(histograms), sample * nlist), replace=False))
+    points = _sqrt_space(histograms[rows])
+    nlist = min(nlist, len(points))
+    centroids = points[rng.choice(len(points), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest_cells(points, centroids)[:, 0]
+        counts = np.bincount(assign, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, points)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+    return centroids
+
+
+def assign_lists(centroids: np.ndarray, histograms: np.ndarray) -> np.ndarray:
+    """Inverted-list id (nearest cell) for each histogram -> (N,) int32. Used for builds and inserts."""
+    if not len(histograms):
+        return np.empty(0, dtype=np.int32)
+    return _nearest_cells(_sqrt_space(histograms), centroids)[:, 0]
+
+
+def build_index(histograms: np.ndarray, nlist: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Train the coarse quantizer and assign every gallery row. Returns (centroids, lists)."""
+    centroids = train_centroids(histograms, nlist)
+    return centroids, assign_lists(centroids, histograms)
+
+
+class IVFLBPHRecognizer(NumpyLBPHRecognizer):
+    """NumpyLBPHRecognizer that scores only the rows of each query's nprobe nearest cells."""
+
+    def __init__(self, histograms: np.ndarray, labels: np.ndarray, params: Optional[dict] = None,
+                 centroids: np.ndarray = None, lists: np.ndarray = None, nprobe: int = 8):
+        super().__init__(histograms, labels, params)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.nprobe = max(1, min(nprobe, len(self.centroids)))
+        lists = np.asarray(lists)
+        self._order = np.argsort(lists, kind="stable")
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=len(self.centroids)))])
+
+    def candidates(self, cells) -> np.ndarray:
+        return np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in cells])
+
+    def _match_one(self, query: np.ndarray, cells, k: int, m: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k users among the rows of the probed cells only (scores as in user_distances)."""
+        rows = self.candidates(cells)
+        if not len(rows):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        rows = np.sort(rows)
+        dist = chi_square_matrix(query[np.newaxis], self.histograms[rows])[0]
+        labels = np.asarray(self.labels[rows])
+        order = np.lexsort((dist, labels))  # By user, nearest sample first
+        users, first, counts = np.unique(labels[order], return_index=True, return_counts=True)
+        group = np.repeat(np.arange(len(users)), counts)
+        keep = np.arange(len(order)) - first[group] < m
+        scores = (np.bincount(group[keep], dist[order][keep], minlength=len(users))
+                  / np.bincount(group[keep], minlength=len(users)))
+        top = np.argsort(scores, kind="stable")[:k]
+        return users[top].astype(np.int32), scores[top].astype(np.float32)
+
+    def match(self, faces: np.ndarray, k: int = 1, samples_per_user: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """NumpyLBPHRecognizer.match() over each face's probed cells; users outside them are not scored."""
+        faces = np.asarray(faces)
+        if faces.ndim == 2:
+            faces = faces[np.newaxis]
+        labels = np.full((len(faces), k), -1, dtype=np.int32)
+        dists = np.full((len(faces), k), np.inf, dtype=np.float32)
+        if not len(self.labels) or not len(faces):
+            return labels, dists
+        queries = spatial_histograms(faces, self.params)
+        probes = _nearest_cells(_sqrt_space(queries), self.centroids, self.nprobe)
+        for i, cells in enumerate(probes):
+            users, scores = self._match_one(queries[i], cells, k, max(1, samples_per_user))
+            labels[i, :len(users)] = users
+            dists[i, :len(users)] = scores
+        return labels, dists
@@ -0,0 +1,112 @@
+"""
+FaceSense - Kiosk recognition stream sessions.
+A kiosk keeps one WebSocket open (/api/recognize/stream) and sends raw JPEG frames instead of posting
+base64 JSON per frame. Each connection owns a KioskSession that smooths identities over the last few
+frames and only pushes an event when the stable identity changes.
+"""
+import json
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from config import (
+    STREAM_SMOOTHING_FRAMES, STREAM_MIN_VOTES, STREAM_MAX_FRAME_BYTES, CONFIDENCE_THRESHOLD, DETECT_FULL_SCAN_INTERVAL,
+)
+from face_detect import face_detector, detect_faces
+from face_recognize import recognize_faces_sharded
+
+
+class KioskSession:
+    """
+    Per-connection state: location / shard settings, a sliding window of per-frame identities and the
+    identity last announced. get_model returns the active model snapshot (or None);
+    check_locations(user_ids, lat, lon) -> {user_id: ok} verifies the location once per identity.
+    """
+
+    def __init__(self, get_model: Callable, check_locations: Callable):
+        self.get_model = get_model
+        self.check_locations = check_locations
+        self.latitude = None
+        self.longitude = None
+        self.shard = None
+        self.frames = 0
+        self._window = deque(maxlen=STREAM_SMOOTHING_FRAMES)  # (user_id or None, confidence) per frame
+        self._announced = None  # user_id of the last "recognized" event
+        self._last_box = None  # Largest face of the previous frame (detection ROI)
+
+    def configure(self, message: Dict):
+        """Apply a {"type": "config", "latitude", "longitude", "shard"} text message."""
+        self.latitude = message.get("latitude", self.latitude)
+        self.longitude = message.get("longitude", self.longitude)
+        self.shard = message.get("shard", self.shard)
+
+    def handle(self, message) -> List[Dict]:
+        """Process one WebSocket message (bytes = JPEG frame, str = JSON control). Returns events to push."""
+        if isinstance(message, str):
+            try:
+                self.configure(json.loads(message))
+            except (ValueError, AttributeError):
+                return [{"type": "error", "error": "Invalid control message"}]
+            return []
+        return self.process_frame(message)
+
+    def process_frame(self, jpeg: bytes) -> List[Dict]:
+        """
+        Recognize the largest face in one frame. Always returns a "frame" ack first (the kiosk sends its
+        next frame only after the ack), then "recognized" / "cleared" when the smoothed identity changes.
+        """
+        self.frames += 1
+        ack = {"type": "frame", "seq": self.frames, "faces": 0}
+        if len(jpeg) > STREAM_MAX_FRAME_BYTES:
+            return [ack, {"type": "error", "error": "Frame too large"}]
+        model = self.get_model()
+        if model is None:
+            return [ack, {"type": "error", "error": "Model not trained yet"}]
+        img = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return [ack, {"type": "error", "error": "Invalid image"}]
+        # Search around the last face; a periodic full scan still picks up someone new stepping in
+        roi = self._last_box if self.frames % DETECT_FULL_SCAN_INTERVAL else None
+        with face_detector() as cascade:
+            faces = detect_faces(cascade, img, roi=roi)
+        ack["faces"] = len(faces)
+        self._last_box = max(faces, key=lambda f: f[2] * f[3]) if len(faces) else None
+        if len(faces):
+            largest = self._last_box
+            result = recognize_faces_sharded(img, [largest], model, self.shard, CONFIDENCE_THRESHOLD)[0][0]
+            self._window.append((result["user_id"], result["confidence"]) if result["recognized"] else (None, 0.0))
+        else:
+            self._window.append((None, 0.0))
+        return [ack] + self._identity_events(model)
+
+    def stable_identity(self) -> Optional[int]:
+        """User seen in at least STREAM_MIN_VOTES of the last STREAM_SMOOTHING_FRAMES frames, else None."""
+        votes = Counter(uid for uid, _ in self._window if uid is not None)
+        if not votes:
+            return None
+        uid, count = votes.most_common(1)[0]
+        return uid if count >= STREAM_MIN_VOTES else None
+
+    def _identity_events(self, model) -> List[Dict]:
+        uid = self.stable_identity()
+        if uid == self._announced:
+            return []
+        if uid is None:
+            # Only clear once the window holds no trace of the announced user
+            if any(u == self._announced for u, _ in self._window):
+                return []
+            self._announced = None
+            return [{"type": "cleared"}]
+        self._announced = uid
+        confidences = [c for u, c in self._window if u == uid]
+        return [{
+            "type": "recognized",
+            "user_id": uid,
+            "name": model.id_to_name.get(uid),
+            "confidence": round(sum(confidences) / len(confidences), 1),
+            "location_ok": self.check_locations({uid}, self.latitude, self.longitude)[uid],
+            "shard": self.shard,
+            "model_version": model.version,
+        }]
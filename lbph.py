@@ -0,0 +1,251 @@
+"""
+FaceSense - Binary LBPH model format.
+The LBPH gallery is stored as a float32 histogram matrix (.npy) plus an int32 label vector (.npy)
+instead of OpenCV's XML. Both are memory-mapped read-only, so loading takes milliseconds and worker
+processes share the same pages. LBP codes, spatial histograms and the chi-square distance reproduce
+cv2.face.LBPHFaceRecognizer, so converted models predict the same labels.
+Run `python lbph.py convert` to convert an existing face_lbph.xml.
+"""
+import os
+import sys
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Ensure project root (where config.py lives) is on sys.path when run as a script
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from config import MODEL_PATH, MODEL_HIST_PATH, MODEL_LABELS_NPY_PATH
+
+DEFAULT_PARAMS = {"radius": 1, "neighbors": 8, "grid_x": 8, "grid_y": 8}
+_EPS = np.finfo(np.float32).eps
+_TINY = np.float32(1e-30)
+_CHUNK_ELEMENTS = 1 << 24  # Bound temporaries of the chi-square scan (~64 MB of float32)
+
+
+def lbp_codes(images: np.ndarray, radius: int = 1, neighbors: int = 8) -> np.ndarray:
+    """Extended (circular) LBP codes for a batch of grayscale images (B, H, W) -> (B, H-2r, W-2r) int32."""
+    src = np.asarray(images, dtype=np.float32)
+    if src.ndim == 2:
+        src = src[np.newaxis]
+    _, rows, cols = src.shape
+    h, w = rows - 2 * radius, cols - 2 * radius
+    center = src[:, radius:radius + h, radius:radius + w]
+    codes = np.zeros(center.shape, dtype=np.int32)
+    for n in range(neighbors):
+        x = radius * np.cos(2.0 * np.pi * n / neighbors)
+        y = -radius * np.sin(2.0 * np.pi * n / neighbors)
+        fx, fy = int(np.floor(x)), int(np.floor(y))
+        cx, cy = int(np.ceil(x)), int(np.ceil(y))
+        ty, tx = np.float32(y - fy), np.float32(x - fx)
+        w1, w2 = (1 - tx) * (1 - ty), tx * (1 - ty)
+        w3, w4 = (1 - tx) * ty, tx * ty
+
+        def shifted(dy, dx):
+            return src[:, radius + dy:radius + dy + h, radius + dx:radius + dx + w]
+
+        t = w1 * shifted(fy, fx) + w2 * shifted(fy, cx) + w3 * shifted(cy, fx) + w4 * shifted(cy, cx)
+        codes |= (((t > center) | (np.abs(t - center) < _EPS)).astype(np.int32) << n)
+    return codes
+
+
+def spatial_histograms(images: np.ndarray, params: Optional[dict] = None) -> np.ndarray:
+    """LBPH feature vectors for a batch of faces (B, H, W) -> (B, grid_x * grid_y * 2^neighbors) float32."""
+    p = params or DEFAULT_PARAMS
+    codes = lbp_codes(images, p["radius"], p["neighbors"])
+    batch, rows, cols = codes.shape
+    patterns = 1 << p["neighbors"]
+    gx, gy = p["grid_x"], p["grid_y"]
+    cw, ch = cols // gx, rows // gy
+    cells = codes[:, :gy * ch, :gx * cw].reshape(batch, gy, ch, gx, cw)
+    cell_index = (np.arange(gy)[:, None] * gx + np.arange(gx)[None, :])[None, :, None, :, None]
+    flat = (np.arange(batch)[:, None, None, None, None] * (gx * gy) + cell_index) * patterns + cells
+    counts = np.bincount(flat.ravel(), minlength=batch * gx * gy * patterns)
+    return (counts.reshape(batch, gx * gy * patterns) / np.float32(ch * cw)).astype(np.float32)
+
+
+def chi_square_matrix(queries: np.ndarray, gallery: np.ndarray) -> np.ndarray:
+    """OpenCV HISTCMP_CHISQR_ALT between every query (Q, F) and every gallery row (N, F) -> (Q, N)."""
+    queries = np.asarray(queries, dtype=np.float32)
+    out = np.empty((len(queries), len(gallery)), dtype=np.float32)
+    step = max(1, _CHUNK_ELEMENTS // max(1, len(queries) * gallery.shape[1]))
+    q = queries[:, np.newaxis, :]
+    for start in range(0, len(gallery), step):
+        g = np.asarray(gallery[start:start + step])[np.newaxis]
+        diff = g - q
+        diff *= diff
+        # Bins are non-negative, so an empty bin pair has diff == 0 and the tiny offset just avoids 0/0
+        diff /= (g + q) + _TINY
+        out[:, start:start + step] = 2.0 * diff.sum(axis=2)
+    return out
+
+
+def chi_square_alt(query: np.ndarray, gallery: np.ndarray) -> np.ndarray:
+    """OpenCV HISTCMP_CHISQR_ALT between one histogram (F,) and every gallery row (N, F) -> (N,)."""
+    return chi_square_matrix(query[np.newaxis], gallery)[0]
+
+
+class NumpyLBPHRecognizer:
+    """
+    Drop-in for cv2.face.LBPHFaceRecognizer.predict() backed by a (memory-mapped) histogram matrix.
+    match() scores a whole batch of faces against the gallery at once and ranks users, not samples.
+    """
+
+    def __init__(self, histograms: np.ndarray, labels: np.ndarray, params: Optional[dict] = None):
+        self.histograms = histograms
+        self.labels = labels
+        self.params = dict(params or DEFAULT_PARAMS)
+        # Gallery rows grouped per user, padded with len(labels) (an all-inf column) for ragged users
+        self.users, inverse, counts = np.unique(np.asarray(labels), return_inverse=True, return_counts=True)
+        order = np.argsort(inverse, kind="stable")
+        slots = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+        self._user_rows = np.full((len(self.users), counts.max() if len(counts) else 0), len(labels), dtype=np.int64)
+        self._user_rows[inverse[order], slots] = order
+
+    def __len__(self):
+        return len(self.labels)
+
+    def distances(self, faces: np.ndarray) -> np.ndarray:
+        """Chi-square distance of each face (B, H, W) to every gallery histogram -> (B, N)."""
+        return chi_square_matrix(spatial_histograms(faces, self.params), self.histograms)
+
+    def user_distances(self, dist: np.ndarray, samples_per_user: int = 1) -> np.ndarray:
+        """
+        Aggregate sample distances (B, N) into one score per user (B, U): the mean of each user's
+        samples_per_user nearest samples (1 = plain nearest neighbour, as in OpenCV).
+        """
+        padded = np.concatenate([dist, np.full((len(dist), 1), np.inf, dist.dtype)], axis=1)[:, self._user_rows]
+        m = max(1, min(samples_per_user, padded.shape[2]))
+        if m == 1:
+            return padded.min(axis=2)
+        nearest = np.partition(padded, m - 1, axis=2)[:, :, :m]
+        finite = np.isfinite(nearest)
+        return np.where(finite, nearest, 0.0).sum(axis=2) / np.maximum(finite.sum(axis=2), 1)
+
+    def match(self, faces: np.ndarray, k: int = 1, samples_per_user: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k users for a batch of faces (B, H, W) in one vectorised pass.
+        Returns (labels (B, k) int32, distances (B, k) float32), best first; short rows pad with (-1, inf).
+        """
+        faces = np.asarray(faces)
+        if faces.ndim == 2:
+            faces = faces[np.newaxis]
+        labels = np.full((len(faces), k), -1, dtype=np.int32)
+        dists = np.full((len(faces), k), np.inf, dtype=np.float32)
+        if not len(self.labels) or not len(faces):
+            return labels, dists
+        scores = self.user_distances(self.distances(faces), samples_per_user)
+        n = min(k, scores.shape[1])
+        top = np.argpartition(scores, n - 1, axis=1)[:, :n] if n < scores.shape[1] else \
+            np.broadcast_to(np.arange(n), (len(scores), n))
+        top = np.take_along_axis(top, np.argsort(np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+        labels[:, :n] = self.users[top]
+        dists[:, :n] = np.take_along_axis(scores, top, axis=1)
+        return labels, dists
+
+    def predict(self, face: np.ndarray) -> Tuple[int, float]:
+        """Nearest gallery histogram: (label, chi-square distance). (-1, inf) on an empty gallery."""
+        labels, dists = self.match(face)
+        return int(labels[0, 0]), float(dists[0, 0])
+
+    def subset(self, users) -> "NumpyLBPHRecognizer":
+        """Recognizer over the gallery rows of the given users only (loaded into memory)."""
+        rows = np.flatnonzero(np.isin(self.labels, users))
+        return NumpyLBPHRecognizer(np.asarray(self.histograms[rows]), np.asarray(self.labels[rows]), self.params)
+
+    @classmethod
+    def load(cls, hist_path: str = None, labels_path: str = None, params: Optional[dict] = None,
+             mmap: bool = True) -> "NumpyLBPHRecognizer":
+        mode = "r" if mmap else None
+        histograms = np.load(hist_path or MODEL_HIST_PATH, mmap_mode=mode)
+        labels = np.load(labels_path or MODEL_LABELS_NPY_PATH, mmap_mode=mode)
+        return cls(histograms, labels, params)
+
+
+def k_medoids(dist: np.ndarray, k: int, iterations: int = 20) -> np.ndarray:
+    """
+    Indices of k medoids for a square distance matrix (n, n): farthest-point seeding, then alternate
+    nearest-medoid assignment and per-cluster medoid update until stable.
+    """
+    n = len(dist)
+    if n <= k:
+        return np.arange(n)
+    medoids = [int(np.argmin(dist.sum(axis=1)))]
+    while len(medoids) < k:
+        medoids.append(int(np.argmax(dist[:, medoids].min(axis=1))))
+    medoids = np.array(medoids)
+    for _ in range(iterations):
+        assign = np.argmin(dist[:, medoids], axis=1)
+        updated = medoids.copy()
+        for c in range(k):
+            members = np.flatnonzero(assign == c)
+            if len(members):
+                updated[c] = members[np.argmin(dist[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+    return np.sort(medoids)
+
+
+def prototype_gallery(histograms: np.ndarray, labels: np.ndarray, per_user: int,
+                      users=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce each user's histograms to per_user representative samples (k-medoids under chi-square).
+    Prototypes are real samples, so distances keep their meaning for CONFIDENCE_THRESHOLD.
+    users restricts the work to a subset (incremental training). Returns (histograms, labels).
+    """
+    labels = np.asarray(labels)
+    rows = []
+    for user in (np.unique(labels) if users is None else users):
+        idx = np.flatnonzero(labels == user)
+        hists = np.asarray(histograms[idx])
+        rows.extend(idx[k_medoids(chi_square_matrix(hists, hists), per_user)])
+    rows = np.array(sorted(rows), dtype=np.int64)
+    return np.asarray(histograms[rows], dtype=np.float32), labels[rows].astype(np.int32)
+
+
+def histograms_from_cv2(recognizer) -> Tuple[np.ndarray, np.ndarray, Dict[str, int]]:
+    """Extract (histograms (N, F) float32, labels (N,) int32, params) from a trained cv2 LBPH recognizer."""
+    hists = recognizer.getHistograms()
+    histograms = np.vstack([np.asarray(h, dtype=np.float32).reshape(1, -1) for h in hists]) if hists else \
+        np.empty((0, 0), np.float32)
+    labels = np.asarray(recognizer.getLabels(), dtype=np.int32).ravel()
+    params = {
+        "radius": int(recognizer.getRadius()),
+        "neighbors": int(recognizer.getNeighbors()),
+        "grid_x": int(recognizer.getGridX()),
+        "grid_y": int(recognizer.getGridY()),
+    }
+    return histograms, labels, params
+
+
+def save_arrays(histograms: np.ndarray, labels: np.ndarray, hist_path: str, labels_path: str):
+    """Write both arrays via temp files + os.replace so readers never map a partial file."""
+    for path, arr in ((hist_path, np.ascontiguousarray(histograms, dtype=np.float32)),
+                      (labels_path, np.ascontiguousarray(labels, dtype=np.int32))):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, path)
+
+
+def convert_xml(xml_path: str = MODEL_PATH, hist_path: str = MODEL_HIST_PATH,
+                labels_path: str = MODEL_LABELS_NPY_PATH) -> dict:
+    """Convert an OpenCV LBPH XML model to the binary format. Returns the LBPH params."""
+    import cv2
+
+    recognizer = cv2.face.LBPHFaceRecognizer_create()
+    recognizer.read(xml_path)
+    histograms, labels, params = histograms_from_cv2(recognizer)
+    save_arrays(histograms, labels, hist_path, labels_path)
+    print(f"[INFO] Converted {xml_path}: {histograms.shape[0]} histograms x {histograms.shape[1]} bins -> {hist_path}")
+    return params
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "convert":
+        print("Usage: python lbph.py convert [model.xml]")
+        sys.exit(1)
+    convert_xml(sys.argv[2] if len(sys.argv) > 2 else MODEL_PATH)
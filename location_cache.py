@@ -0,0 +1,116 @@
+"""
+FaceSense - Cached location lookups for the recognize path.
+Registered user locations and the active campus boundary are cached in-process with a TTL
+(LOCATION_CACHE_TTL_SECONDS). Writes made through this module update the cache and /api/campus POST
+invalidates it, so recognition needs no DB round trip in the steady state. Other processes
+pick up changes when their entries expire.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from config import LOCATION_CACHE_TTL_SECONDS
+from db import get_connection
+
+_lock = threading.Lock()
+_locations = {}  # user_id -> (expires_at, (lat, lon))
+_campus = None  # (expires_at, (lat, lon, radius_m) or None)
+_stats = {"location_hits": 0, "location_misses": 0, "campus_hits": 0, "campus_misses": 0}
+
+
+def get_registered_locations(user_ids: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+    """Latest registered location per user: {user_id: (lat, lon)}. Cache misses are fetched in one query."""
+    now = time.monotonic()
+    found, missing = {}, []
+    with _lock:
+        for uid in user_ids:
+            entry = _locations.get(uid)
+            if entry and entry[0] > now:
+                found[uid] = entry[1]
+            else:
+                missing.append(uid)
+        _stats["location_hits"] += len(found)
+        _stats["location_misses"] += len(missing)
+    if not missing:
+        return found
+    placeholders = ", ".join(["%s"] * len(missing))
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""SELECT ul.user_id, ul.latitude, ul.longitude FROM user_locations ul
+                    JOIN (SELECT user_id, MAX(registered_at) AS registered_at FROM user_locations
+                          WHERE user_id IN ({placeholders}) GROUP BY user_id) latest
+                    ON latest.user_id = ul.user_id AND latest.registered_at = ul.registered_at""",
+                missing,
+            )
+            rows = cur.fetchall()
+    fetched = {int(row["user_id"]): (row["latitude"], row["longitude"]) for row in rows}
+    expires = time.monotonic() + LOCATION_CACHE_TTL_SECONDS
+    with _lock:
+        for uid, loc in fetched.items():
+            _locations[uid] = (expires, loc)
+    found.update(fetched)
+    return found
+
+
+def save_locations(locations: Dict[int, Tuple[float, float]], accuracy: Optional[float] = None):
+    """Insert registered locations ({user_id: (lat, lon)}) and write them through to the cache once committed."""
+    if not locations:
+        return
+    now = datetime.utcnow().isoformat()
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.executemany(
+                "INSERT INTO user_locations (user_id, latitude, longitude, accuracy, registered_at) VALUES (%s, %s, %s, %s, %s)",
+                [(uid, lat, lon, accuracy, now) for uid, (lat, lon) in locations.items()],
+            )
+    expires = time.monotonic() + LOCATION_CACHE_TTL_SECONDS
+    with _lock:
+        for uid, loc in locations.items():
+            _locations[uid] = (expires, loc)
+
+
+def get_campus() -> Optional[Tuple[float, float, float]]:
+    """Active campus (lat, lon, radius_m), or None if no campus is set (also cached)."""
+    global _campus
+    with _lock:
+        entry = _campus
+        if entry and entry[0] > time.monotonic():
+            _stats["campus_hits"] += 1
+            return entry[1]
+        _stats["campus_misses"] += 1
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT center_lat, center_lon, radius_meters FROM campus_boundaries WHERE is_active = 1 LIMIT 1"
+            )
+            row = cur.fetchone()
+    campus = (row["center_lat"], row["center_lon"], row["radius_meters"]) if row else None
+    with _lock:
+        _campus = (time.monotonic() + LOCATION_CACHE_TTL_SECONDS, campus)
+    return campus
+
+
+def invalidate_locations(user_ids: Optional[Iterable[int]] = None):
+    """Drop cached locations for the given users (all users if None)."""
+    with _lock:
+        if user_ids is None:
+            _locations.clear()
+        else:
+            for uid in user_ids:
+                _locations.pop(uid, None)
+
+
+def invalidate_campus():
+    global _campus
+    with _lock:
+        _campus = None
+
+
+def get_cache_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats["locations_cached"] = len(_locations)
+        stats["campus_cached"] = _campus is not None
+    return stats
@@ -0,0 +1,207 @@
+"""
+FaceSense - Versioned recognizer registry.
+model_train publishes each trained model as an immutable models/versions/<version>/ directory and then
+atomically replaces the current model files and labels.json. The registry builds the new recognizer on a background
+thread and swaps it in with a single reference assignment, so requests in flight keep the version they
+started with and the request path never pays the model parse. Workers that did not run the training (other
+gunicorn workers, the daemon) notice a new labels.json mtime within MODEL_RELOAD_CHECK_SECONDS and reload too.
+"""
+import os
+import json
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from config import (
+    MODEL_PATH, MODEL_HIST_PATH, MODEL_LABELS_NPY_PATH, LABELS_PATH, MODEL_VERSIONS_DIR,
+    MODEL_PROTOTYPES_PER_USER, MODEL_PROTO_HIST_PATH, MODEL_PROTO_LABELS_PATH,
+    MODEL_INDEX, IVF_NPROBE, MODEL_IVF_CENTROIDS_PATH, MODEL_IVF_LISTS_PATH, MODEL_RELOAD_CHECK_SECONDS,
+)
+from ivf_index import IVFLBPHRecognizer
+from lbph import NumpyLBPHRecognizer
+
+HIST_FILE = os.path.basename(MODEL_HIST_PATH)
+LABELS_NPY_FILE = os.path.basename(MODEL_LABELS_NPY_PATH)
+LABELS_FILE = os.path.basename(LABELS_PATH)
+PROTO_HIST_FILE = os.path.basename(MODEL_PROTO_HIST_PATH)
+PROTO_LABELS_FILE = os.path.basename(MODEL_PROTO_LABELS_PATH)
+IVF_CENTROIDS_FILE = os.path.basename(MODEL_IVF_CENTROIDS_PATH)
+IVF_LISTS_FILE = os.path.basename(MODEL_IVF_LISTS_PATH)
+
+
+class LoadedModel:
+    """Immutable snapshot of one model version."""
+
+    __slots__ = ("version", "recognizer", "id_to_name", "loaded_at", "load_ms", "shards", "_shard_recognizers")
+
+    def __init__(self, version: str, recognizer, id_to_name: Dict[int, str], load_ms: float,
+                 shards: Optional[Dict[str, list]] = None):
+        self.version = version
+        self.recognizer = recognizer
+        self.id_to_name = id_to_name
+        self.loaded_at = datetime.utcnow().isoformat()
+        self.load_ms = load_ms
+        self.shards = shards or {}
+        self._shard_recognizers = {}
+
+    def shard(self, key: str):
+        """
+        Recognizer over one shard's users ("department:<id>", "class_teacher:<id>", "group:<name>"),
+        built on first use. None for unknown shards or legacy OpenCV models.
+        """
+        recognizer = self._shard_recognizers.get(key)
+        if recognizer is None and key in self.shards and hasattr(self.recognizer, "subset"):
+            recognizer = self.recognizer.subset(self.shards[key])
+            self._shard_recognizers[key] = recognizer
+        return recognizer
+
+
+def read_labels(labels_path: Optional[str] = None) -> dict:
+    with open(labels_path or LABELS_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_version() -> Optional[str]:
+    """Version published in labels.json (older models without one fall back to trained_at)."""
+    if not os.path.isfile(LABELS_PATH):
+        return None
+    meta = read_labels()
+    return meta.get("version") or meta.get("trained_at") or "unversioned"
+
+
+def version_dir(version: str) -> str:
+    return os.path.join(MODEL_VERSIONS_DIR, version)
+
+
+def model_available() -> bool:
+    return os.path.isfile(LABELS_PATH) and (os.path.isfile(MODEL_HIST_PATH) or os.path.isfile(MODEL_PATH))
+
+
+def load_model() -> LoadedModel:
+    """
+    Load the currently published model from disk.
+    Reads the immutable version directory when present so model and labels always match.
+    Binary (.npy) models are memory-mapped; a legacy XML model is parsed with OpenCV.
+    With MODEL_PROTOTYPES_PER_USER set, the per-user prototype gallery is served when it was published;
+    with MODEL_INDEX = "ivf" the gallery is searched through its IVF index.
+    """
+    if not model_available():
+        raise RuntimeError("Model not found. Train first by running model_train.py")
+    t0 = time.perf_counter()
+    meta = read_labels()
+    version = meta.get("version") or meta.get("trained_at") or "unversioned"
+    hist_path, labels_npy_path = MODEL_HIST_PATH, MODEL_LABELS_NPY_PATH
+    vdir = version_dir(version)
+    if meta.get("version") and os.path.isfile(os.path.join(vdir, HIST_FILE)):
+        hist_path = os.path.join(vdir, HIST_FILE)
+        labels_npy_path = os.path.join(vdir, LABELS_NPY_FILE)
+        meta = read_labels(os.path.join(vdir, LABELS_FILE))
+        if MODEL_PROTOTYPES_PER_USER and os.path.isfile(os.path.join(vdir, PROTO_HIST_FILE)):
+            hist_path = os.path.join(vdir, PROTO_HIST_FILE)
+            labels_npy_path = os.path.join(vdir, PROTO_LABELS_FILE)
+    ivf_centroids = os.path.join(vdir, IVF_CENTROIDS_FILE)
+    if MODEL_INDEX == "ivf" and meta.get("version") and os.path.isfile(ivf_centroids):
+        recognizer = IVFLBPHRecognizer(
+            np.load(hist_path, mmap_mode="r"), np.load(labels_npy_path, mmap_mode="r"), meta.get("lbph"),
+            np.load(ivf_centroids), np.load(os.path.join(vdir, IVF_LISTS_FILE)), IVF_NPROBE,
+        )
+    elif os.path.isfile(hist_path):
+        recognizer = NumpyLBPHRecognizer.load(hist_path, labels_npy_path, meta.get("lbph"))
+    else:
+        recognizer = cv2.face.LBPHFaceRecognizer_create()
+        recognizer.read(MODEL_PATH)
+    id_to_name = {int(k): v for k, v in meta.get("id_to_name", {}).items()}
+    return LoadedModel(version, recognizer, id_to_name, (time.perf_counter() - t0) * 1000.0, meta.get("shards"))
+
+
+_lock = threading.Lock()
+_active = None  # type: Optional[LoadedModel]
+_loader = None
+_reload_pending = False
+_stats = {"loads": 0, "load_failures": 0, "last_error": None}
+_labels_mtime = None  # labels.json mtime when last checked
+_next_check = 0.0
+
+
+def _labels_changed() -> bool:
+    """True (at most once per MODEL_RELOAD_CHECK_SECONDS) if labels.json was replaced since the last check."""
+    global _labels_mtime, _next_check
+    now = time.monotonic()
+    if now < _next_check:
+        return False
+    _next_check = now + MODEL_RELOAD_CHECK_SECONDS
+    try:
+        mtime = os.stat(LABELS_PATH).st_mtime_ns
+    except OSError:
+        return False
+    changed = _labels_mtime is not None and mtime != _labels_mtime
+    _labels_mtime = mtime
+    return changed
+
+
+def get_active_model() -> Optional[LoadedModel]:
+    """
+    Current model snapshot, or None if nothing is trained yet.
+    Only the very first call (no model to serve yet) loads on the caller's thread; a model published by
+    another process is picked up by reload_async().
+    """
+    global _active
+    model = _active
+    if model is not None:
+        if _labels_changed():
+            reload_async()
+        return model
+    with _lock:
+        if _active is None and model_available():
+            _labels_changed()  # Record the mtime of the version being loaded
+            _active = load_model()
+            _stats["loads"] += 1
+        return _active
+
+
+def _reload_loop():
+    global _active, _loader, _reload_pending
+    while True:
+        with _lock:
+            _reload_pending = False
+        try:
+            active = _active
+            if active is None or current_version() != active.version:
+                model = load_model()
+                _active = model  # Atomic swap: readers see either the old or the new snapshot
+                with _lock:
+                    _stats["loads"] += 1
+                print(f"[INFO] Recognizer swapped to version {model.version} ({model.load_ms:.0f} ms load)")
+        except Exception as e:
+            with _lock:
+                _stats["load_failures"] += 1
+                _stats["last_error"] = str(e)
+        with _lock:
+            if not _reload_pending:
+                _loader = None
+                return
+
+
+def reload_async():
+    """Build the published model off the request path and swap it in; the old version serves meanwhile."""
+    global _loader, _reload_pending
+    with _lock:
+        _reload_pending = True
+        if _loader is None:
+            _loader = threading.Thread(target=_reload_loop, name="facesense-model-loader", daemon=True)
+            _loader.start()
+
+
+def get_model_stats() -> dict:
+    model = _active
+    with _lock:
+        stats = dict(_stats)
+        stats["reloading"] = _loader is not None
+    stats["active_version"] = model.version if model else None
+    stats["loaded_at"] = model.loaded_at if model else None
+    stats["load_ms"] = model.load_ms if model else None
+    return stats
@@ -1,14 +1,34 @@
 """
 FaceSense - Model training from stored face data. Uses MySQL.
+Training is incremental by default: a manifest of already-trained samples lets only new samples be
+turned into histograms and appended to the model instead of retraining from scratch.
+Models are saved in the binary histogram format from lbph.py.
 """
 import os
 import json
+import shutil
+import time
+import uuid
 import cv2
 import numpy as np
+import pymysql
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from config import DATASET_DIR, MODELS_DIR, MODEL_PATH, LABELS_PATH, FACE_IMAGE_SIZE
+from config import (
+    DATASET_DIR, MODELS_DIR, MODEL_HIST_PATH, MODEL_LABELS_NPY_PATH, LABELS_PATH, TRAIN_MANIFEST_PATH,
+    FACE_IMAGE_SIZE, MODEL_PROTOTYPES_PER_USER, MODEL_PROTO_HIST_PATH, MODEL_PROTO_LABELS_PATH,
+    MODEL_INDEX, IVF_NLIST, MODEL_IVF_CENTROIDS_PATH, MODEL_IVF_LISTS_PATH, MODEL_SHARD_BY,
+    TRAIN_LOADER_WORKERS, SAMPLE_STORE_ENABLED, MODEL_VERSIONS_DIR, MODEL_VERSIONS_KEEP,
+)
 from db import get_connection
+from lbph import histograms_from_cv2, save_arrays, prototype_gallery
+from ivf_index import build_index, assign_lists
+from model_registry import current_version
+from sample_store import get_sample_store
+
+LBPH_PARAMS = {"radius": 1, "neighbors": 8, "grid_x": 8, "grid_y": 8}
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
 
 
 def ensure_directories():
@@ -16,85 +36,431 @@ def ensure_directories():
     os.makedirs(MODELS_DIR, exist_ok=True)
 
 
-def build_training_data_from_db():
-    """Build training data from dataset folder, mapped by user_id from MySQL."""
-    images = []
-    labels = []
-    id_to_name = {}
+def training_settings() -> dict:
+    """Settings that invalidate the trained model when they change."""
+    return {
+        "lbph": LBPH_PARAMS,
+        "face_image_size": list(FACE_IMAGE_SIZE),
+        "prototypes": MODEL_PROTOTYPES_PER_USER,
+        "index": [MODEL_INDEX, IVF_NLIST],
+    }
 
+
+def scan_dataset() -> dict:
+    """List sample files per user without decoding them: {user_id: {filename: [size, mtime_ns]}}."""
     if not os.path.isdir(DATASET_DIR):
         raise RuntimeError(f"Dataset directory not found at {DATASET_DIR}. Capture data first.")
-
+    samples = {}
     for user_dir_name in sorted(os.listdir(DATASET_DIR)):
         user_dir = os.path.join(DATASET_DIR, user_dir_name)
         if not os.path.isdir(user_dir):
             continue
-
         try:
             user_id = int(user_dir_name)
         except ValueError:
             continue
-
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT first_name, last_name FROM students WHERE user_id = %s",
-                    (user_id,),
-                )
-                row = cur.fetchone()
-                if not row:
-                    cur.execute(
-                        "SELECT first_name, last_name FROM staff WHERE user_id = %s",
-                        (user_id,),
-                    )
-                    row = cur.fetchone()
-                if not row:
-                    continue
-                user_name = f"{row.get('first_name') or ''} {row.get('last_name') or ''}".strip() or str(user_id)
-
-        id_to_name[user_id] = user_name
-
+        files = {}
         for file in sorted(os.listdir(user_dir)):
-            if not file.lower().endswith((".png", ".jpg", ".jpeg")):
-                continue
-            img_path = os.path.join(user_dir, file)
-            img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-            if img is None:
+            if not file.lower().endswith(IMAGE_EXTENSIONS):
                 continue
-            img = cv2.resize(img, FACE_IMAGE_SIZE)
-            images.append(img)
-            labels.append(user_id)
+            st = os.stat(os.path.join(user_dir, file))
+            files[file] = [st.st_size, st.st_mtime_ns]
+        samples[user_id] = files
+    return samples
+
+
+def _no_progress(**fields):
+    pass
+
+
+def fetch_user_names() -> dict:
+    """All student/staff display names in one query: {user_id: name}. Students win over staff."""
+    names = {}
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT user_id, first_name, last_name, 1 AS src FROM staff
+                   UNION ALL
+                   SELECT user_id, first_name, last_name, 0 AS src FROM students
+                   ORDER BY src DESC"""
+            )
+            for row in cur.fetchall():
+                user_id = int(row["user_id"])
+                names[user_id] = f"{row.get('first_name') or ''} {row.get('last_name') or ''}".strip() or str(user_id)
+    return names
+
+
+def fetch_shard_members(id_to_name) -> dict:
+    """
+    Shard membership for the users in the model: {"department:<id>" | "class_teacher:<id>" | "group:<name>": [user_id, ...]}.
+    Which shard kinds are built is set by MODEL_SHARD_BY.
+    """
+    shards = {}
 
-    if not images:
+    def add(key, user_id):
+        if user_id in id_to_name:
+            shards.setdefault(key, set()).add(user_id)
+
+    if not MODEL_SHARD_BY:
+        return {}
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT user_id, department_id, class_teacher_id FROM students
+                   UNION ALL
+                   SELECT user_id, department_id, NULL FROM staff"""
+            )
+            for row in cur.fetchall():
+                user_id = int(row["user_id"])
+                if "department" in MODEL_SHARD_BY and row.get("department_id") is not None:
+                    add(f"department:{row['department_id']}", user_id)
+                if "class_teacher" in MODEL_SHARD_BY and row.get("class_teacher_id") is not None:
+                    add(f"class_teacher:{row['class_teacher_id']}", user_id)
+            if "group" in MODEL_SHARD_BY:
+                try:
+                    cur.execute("SELECT group_name, user_id FROM kiosk_group_members")
+                    for row in cur.fetchall():
+                        add(f"group:{row['group_name']}", int(row["user_id"]))
+                except pymysql.err.ProgrammingError:
+                    print("[WARN] kiosk_group_members table missing; run database/init_db.py for kiosk group shards")
+    return {key: sorted(users) for key, users in sorted(shards.items())}
+
+
+def _load_sample(img_path):
+    img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    return cv2.resize(img, FACE_IMAGE_SIZE)
+
+
+def build_training_data_from_db(only=None, progress=_no_progress, samples=None):
+    """
+    Build training data from dataset folder, mapped by user_id from MySQL.
+    If only is given ({user_id: [filename, ...]}), just those samples are decoded;
+    id_to_name still covers every user with samples. Images are decoded on
+    TRAIN_LOADER_WORKERS threads. progress(**fields) receives images_loaded /
+    users_processed / users_total / images_per_sec as loading advances.
+    """
+    if samples is None:
+        samples = scan_dataset()
+    all_names = fetch_user_names()
+    id_to_name = {uid: all_names[uid] for uid in samples if uid in all_names}
+
+    tasks = []
+    for user_id in sorted(id_to_name):
+        if only is not None and user_id not in only:
+            continue
+        wanted = set(only[user_id]) if only is not None else None
+        user_dir = os.path.join(DATASET_DIR, str(user_id))
+        for file in sorted(samples[user_id]):
+            if wanted is None or file in wanted:
+                tasks.append((user_id, os.path.join(user_dir, file)))
+
+    users_total = len({uid for uid, _ in tasks})
+    progress(phase="loading", users_total=users_total, users_processed=0, images_loaded=0)
+    images = []
+    labels = []
+    users_processed = 0
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=TRAIN_LOADER_WORKERS) as pool:
+        decoded = pool.map(_load_sample, [path for _, path in tasks], chunksize=32)
+        for i, ((user_id, _), img) in enumerate(zip(tasks, decoded)):
+            if img is not None:
+                images.append(img)
+                labels.append(user_id)
+            if i + 1 == len(tasks) or tasks[i + 1][0] != user_id:
+                users_processed += 1
+                elapsed = time.perf_counter() - t0
+                progress(users_processed=users_processed, images_loaded=len(images),
+                         images_per_sec=round(len(images) / elapsed, 1) if elapsed > 0 else 0.0)
+    elapsed = time.perf_counter() - t0
+    if tasks:
+        print(f"[INFO] Loaded {len(images)} images for {users_total} users in {elapsed:.2f}s "
+              f"({len(images) / elapsed if elapsed > 0 else 0:.0f} images/sec, {TRAIN_LOADER_WORKERS} workers)")
+
+    if not images and only is None:
         raise RuntimeError("No training images found. Please capture data first.")
 
     name_to_id = {v: k for k, v in id_to_name.items()}
     return images, np.array(labels, dtype=np.int32), name_to_id, id_to_name
 
 
-def train_and_save_model():
-    """Train LBPH recognizer and save model + labels."""
-    ensure_directories()
-    print("[INFO] Preparing training data from database...")
-    images, labels, name_to_id, id_to_name = build_training_data_from_db()
+def build_training_data_from_store(start=0, end=None, progress=_no_progress):
+    """
+    Memory-map packed samples [start:end] from the sample store (no JPEG decoding).
+    end is the count recorded in the manifest, so samples appended meanwhile wait for the next run.
+    Rows of users without a student/staff record are skipped.
+    """
+    store = get_sample_store()
+    all_labels = store.labels()
+    all_names = fetch_user_names()
+    id_to_name = {uid: all_names[uid] for uid in np.unique(all_labels).tolist() if uid in all_names}
+    t0 = time.perf_counter()
+    images, labels = store.load(start, end)
+    rows = np.flatnonzero(np.isin(labels, list(id_to_name)))
+    images = [images[i] for i in rows]  # Views into the memory map
+    labels = np.ascontiguousarray(labels[rows], dtype=np.int32)
+    elapsed = time.perf_counter() - t0
+    progress(phase="loading", users_total=len(id_to_name), users_processed=len(np.unique(labels)),
+             images_loaded=len(images), images_per_sec=round(len(images) / elapsed, 1) if elapsed > 0 else 0.0)
+    print(f"[INFO] Mapped {len(images)} packed samples in {elapsed:.3f}s")
 
+    if not images and start == 0:
+        raise RuntimeError("No training images found. Please capture data first.")
+
+    name_to_id = {v: k for k, v in id_to_name.items()}
+    return images, labels, name_to_id, id_to_name
+
+
+def load_manifest():
+    if not os.path.isfile(TRAIN_MANIFEST_PATH):
+        return None
+    with open(TRAIN_MANIFEST_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def plan_training(samples: dict, manifest) -> tuple:
+    """
+    Decide between a full rebuild and an incremental update.
+    Returns ("full", None) or ("incremental", {user_id: [new filenames]}).
+    A full rebuild is needed when there is no model/manifest, the settings changed,
+    or any already-trained sample was deleted or modified (LBPH cannot forget histograms).
+    """
+    if manifest is None or not os.path.isfile(MODEL_HIST_PATH) or not os.path.isfile(LABELS_PATH):
+        return "full", None
+    if manifest.get("settings") != training_settings():
+        return "full", None
+    trained = {int(k): v for k, v in manifest.get("users", {}).items()}
+    new = {}
+    for user_id, files in trained.items():
+        current = samples.get(user_id, {})
+        for file, sig in files.items():
+            if current.get(file) != sig:
+                return "full", None
+    for user_id, files in samples.items():
+        added = [f for f in files if f not in trained.get(user_id, {})]
+        if added:
+            new[user_id] = added
+    return "incremental", new
+
+
+def plan_store_training(store_state: dict, manifest) -> tuple:
+    """
+    Plan against the packed sample store. Returns ("full", None) or ("incremental", start_row).
+    The store is append-only, so rows past the recorded count are new; a generation bump
+    (samples removed) or a settings change forces a full rebuild.
+    """
+    if manifest is None or not os.path.isfile(MODEL_HIST_PATH) or not os.path.isfile(LABELS_PATH):
+        return "full", None
+    if manifest.get("settings") != training_settings():
+        return "full", None
+    trained = manifest.get("store")
+    if not trained or trained["generation"] != store_state["generation"] or trained["count"] > store_state["count"]:
+        return "full", None
+    return "incremental", trained["count"]
+
+
+def _create_recognizer():
     try:
-        recognizer = cv2.face.LBPHFaceRecognizer_create(radius=1, neighbors=8, grid_x=8, grid_y=8)
+        return cv2.face.LBPHFaceRecognizer_create(**LBPH_PARAMS)
     except AttributeError:
         raise RuntimeError("Install opencv-contrib-python: pip install opencv-contrib-python")
 
-    print("[INFO] Training LBPH face recognizer (80% accuracy target)...")
-    recognizer.train(images, labels)
 
-    recognizer.save(MODEL_PATH)
+def _replace_file(src, dst):
+    """Copy src over dst atomically (readers see the old or the new file, never a partial one)."""
+    tmp = dst + ".tmp"
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _prune_versions():
+    if not os.path.isdir(MODEL_VERSIONS_DIR):
+        return
+    versions = sorted(os.listdir(MODEL_VERSIONS_DIR))
+    for old in versions[:-MODEL_VERSIONS_KEEP]:
+        shutil.rmtree(os.path.join(MODEL_VERSIONS_DIR, old), ignore_errors=True)
+
+
+def build_prototypes(histograms, labels, changed_users=None):
+    """
+    Prototype gallery (MODEL_PROTOTYPES_PER_USER medoids per user) for the published model.
+    With changed_users only those users are re-clustered; the rest are reused from the current model.
+    Returns (histograms, labels, keep): keep masks the current prototypes reused as leading rows
+    (None when everything was rebuilt).
+    """
+    if changed_users is None or not os.path.isfile(MODEL_PROTO_HIST_PATH):
+        return prototype_gallery(histograms, labels, MODEL_PROTOTYPES_PER_USER) + (None,)
+    old_hists, old_labels = np.load(MODEL_PROTO_HIST_PATH), np.load(MODEL_PROTO_LABELS_PATH)
+    keep = ~np.isin(old_labels, changed_users)
+    new_hists, new_labels = prototype_gallery(histograms, labels, MODEL_PROTOTYPES_PER_USER, users=changed_users)
+    return np.concatenate([old_hists[keep], new_hists]), np.concatenate([old_labels[keep], new_labels]), keep
+
+
+def build_ivf(gallery, keep=None):
+    """
+    IVF index (see ivf_index.py) over the served gallery. Rows reused from the current model (keep)
+    retain their inverted lists and only the new rows are inserted; full rebuilds retrain the cells.
+    Returns (centroids, lists).
+    """
+    if keep is not None and os.path.isfile(MODEL_IVF_CENTROIDS_PATH):
+        centroids, old_lists = np.load(MODEL_IVF_CENTROIDS_PATH), np.load(MODEL_IVF_LISTS_PATH)
+        if len(old_lists) == len(keep):
+            kept = old_lists[keep]
+            return centroids, np.concatenate([kept, assign_lists(centroids, gallery[len(kept):])])
+    return build_index(gallery, IVF_NLIST)
+
+
+def publish_model(name_to_id, id_to_name, histograms=None, labels=None, prototypes=None, index=None,
+                  shards=None) -> str:
+    """
+    Write the binary model (histogram matrix + labels, see lbph.py), the optional prototype gallery
+    and IVF index, and label names plus shard membership to a new immutable models/versions/<version>/
+    directory, then atomically replace the current files; labels.json goes last. With histograms=None the
+    current arrays are republished (names or shards changed). Returns the version.
+    """
+    version = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:6]}"
+    vdir = os.path.join(MODEL_VERSIONS_DIR, version)
+    os.makedirs(vdir, exist_ok=True)
+    arrays = [((histograms, labels), (MODEL_HIST_PATH, MODEL_LABELS_NPY_PATH))]
+    if MODEL_PROTOTYPES_PER_USER:
+        arrays.append((prototypes or (None, None), (MODEL_PROTO_HIST_PATH, MODEL_PROTO_LABELS_PATH)))
+    if MODEL_INDEX == "ivf":
+        arrays.append((index or (None, None), (MODEL_IVF_CENTROIDS_PATH, MODEL_IVF_LISTS_PATH)))
+    published = []
+    for (hist, lab), paths in arrays:
+        files = [os.path.join(vdir, os.path.basename(p)) for p in paths]
+        if hist is not None:
+            save_arrays(hist, lab, *files)
+        elif all(os.path.isfile(p) for p in paths):
+            for src, dst in zip(paths, files):
+                shutil.copyfile(src, dst)
+        else:
+            continue
+        published.extend(zip(files, paths))
+    labels_file = os.path.join(vdir, os.path.basename(LABELS_PATH))
     meta = {
+        "version": version,
+        "format": "npy",
+        "lbph": LBPH_PARAMS,
+        "prototypes_per_user": MODEL_PROTOTYPES_PER_USER,
+        "index": MODEL_INDEX,
         "name_to_id": {k: int(v) for k, v in name_to_id.items()},
         "id_to_name": {int(k): v for k, v in id_to_name.items()},
+        "shards": shards or {},
         "trained_at": datetime.utcnow().isoformat(),
     }
-    with open(LABELS_PATH, "w", encoding="utf-8") as f:
+    with open(labels_file, "w", encoding="utf-8") as f:
         json.dump(meta, f, indent=2)
+    # Model first, labels last: labels.json carries the version readers key on
+    for src, dst in published:
+        _replace_file(src, dst)
+    _replace_file(labels_file, LABELS_PATH)
+    _prune_versions()
+    return version
+
+
+def _labels_changed(id_to_name, shards) -> bool:
+    """True when user names or shard membership differ from the published labels.json."""
+    if not os.path.isfile(LABELS_PATH):
+        return True
+    with open(LABELS_PATH, "r", encoding="utf-8") as f:
+        current = json.load(f)
+    return (current.get("id_to_name", {}) != {str(k): v for k, v in id_to_name.items()}
+            or current.get("shards", {}) != shards)
+
+
+def _save_manifest(id_to_name, samples=None, store_state=None):
+    manifest = {"settings": training_settings(), "updated_at": datetime.utcnow().isoformat()}
+    if store_state is not None:
+        manifest["store"] = store_state
+        manifest["users"] = sorted(id_to_name)
+    else:
+        manifest["users"] = {str(uid): files for uid, files in samples.items() if uid in id_to_name}
+    with open(TRAIN_MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def train_and_save_model(incremental: bool = True, progress=_no_progress) -> dict:
+    """
+    Train LBPH recognizer and save model + labels.
+    With incremental=True only samples missing from the manifest are added to the gallery;
+    otherwise (or when the plan requires it) the model is rebuilt from every sample.
+    Samples come from the packed store when SAMPLE_STORE_ENABLED (import legacy JPEG folders with
+    `python sample_store.py migrate`), else from dataset/<user_id>/ image files.
+    Returns a summary: {"mode": "full" | "incremental" | "unchanged", "images": n, "users": n, "version": v}.
+    progress(**fields) is called with the current phase and loading counters.
+    """
+    ensure_directories()
+    progress(phase="scanning")
+    manifest = load_manifest()
+    samples = store_state = None
+    if SAMPLE_STORE_ENABLED:
+        store_state = get_sample_store().state()
+        mode, new = plan_store_training(store_state, manifest)
+    else:
+        samples = scan_dataset()
+        mode, new = plan_training(samples, manifest)
+    if not incremental:
+        mode, new = "full", None
+
+    def load(only=None):
+        if store_state is not None:
+            return build_training_data_from_store(start=only or 0, end=store_state["count"], progress=progress)
+        return build_training_data_from_db(only=only, progress=progress, samples=samples)
+
+    if mode == "incremental":
+        new_count = store_state["count"] - new if store_state is not None else sum(len(v) for v in new.values())
+        print(f"[INFO] Incremental training: {new_count} new samples")
+        images, labels, name_to_id, id_to_name = load(new)
+        if any(int(uid) not in id_to_name for uid in manifest["users"]):
+            # A trained user disappeared from students/staff; their histograms must go
+            mode = "full"
+        elif not len(images):
+            shards = fetch_shard_members(id_to_name)
+            if _labels_changed(id_to_name, shards):
+                publish_model(name_to_id, id_to_name, shards=shards)
+            _save_manifest(id_to_name, samples, store_state)
+            print("[INFO] Model already up to date")
+            return {"mode": "unchanged", "images": 0, "users": len(id_to_name), "version": current_version()}
+        else:
+            progress(phase="training")
+            recognizer = _create_recognizer()
+            recognizer.train(images, labels)
+            new_hists, new_labels, _ = histograms_from_cv2(recognizer)
+            # Appending histograms is what LBPH update() does, without parsing the old model
+            histograms = np.concatenate([np.load(MODEL_HIST_PATH), new_hists])
+            hist_labels = np.concatenate([np.load(MODEL_LABELS_NPY_PATH), new_labels])
+            changed_users = np.unique(new_labels)
+            reused = np.ones(len(histograms) - len(new_labels), dtype=bool)
+
+    if mode == "full":
+        print("[INFO] Preparing training data from database...")
+        images, labels, name_to_id, id_to_name = load()
+        progress(phase="training")
+        recognizer = _create_recognizer()
+        print("[INFO] Training LBPH face recognizer (80% accuracy target)...")
+        recognizer.train(images, labels)
+        histograms, hist_labels, _ = histograms_from_cv2(recognizer)
+        changed_users = reused = None
+
+    prototypes = None
+    if MODEL_PROTOTYPES_PER_USER:
+        progress(phase="clustering")
+        *prototypes, reused = build_prototypes(histograms, hist_labels, changed_users)
+        print(f"[INFO] Prototype gallery: {len(prototypes[1])} of {len(hist_labels)} histograms")
+
+    index = None
+    if MODEL_INDEX == "ivf":
+        progress(phase="indexing")
+        index = build_ivf(prototypes[0] if prototypes else histograms, reused)
+        print(f"[INFO] IVF index: {len(index[0])} cells")
+
+    shards = fetch_shard_members(id_to_name)
+    progress(phase="saving")
+    version = publish_model(name_to_id, id_to_name, histograms, hist_labels, prototypes, index, shards)
+    _save_manifest(id_to_name, samples, store_state)
 
-    print(f"[INFO] Model saved: {MODEL_PATH}")
-    print(f"[INFO] Labels saved: {LABELS_PATH}")
-    return True
+    print(f"[INFO] Model saved: {MODEL_HIST_PATH} (version {version})")
+    print(f"[INFO] Labels saved: {LABELS_PATH} ({len(shards)} shards)")
+    return {"mode": mode, "images": len(images), "users": len(id_to_name), "version": version}
@@ -0,0 +1,226 @@
+"""
+FaceSense - Packed face-sample store.
+Face crops are appended to one flat uint8 file of fixed-size frames (faces.u8) with an int32
+user_id sidecar (faces.idx), so training can memory-map every sample instead of decoding
+thousands of JPEGs. Run `python sample_store.py migrate` to import an existing dataset/<user_id>/ tree.
+"""
+import os
+import sys
+import json
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+import cv2
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are serialised within one process only
+    fcntl = None
+
+# Ensure project root (where config.py lives) is on sys.path when run as a script
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from config import DATASET_DIR, SAMPLE_STORE_PATH, SAMPLE_INDEX_PATH, SAMPLE_META_PATH, FACE_IMAGE_SIZE
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+LABEL_DTYPE = np.dtype("<i4")
+
+
+class SampleStore:
+    """Append-only store of (user_id, face crop) samples with a generation counter bumped on deletes."""
+
+    def __init__(self, data_path=SAMPLE_STORE_PATH, index_path=SAMPLE_INDEX_PATH, meta_path=SAMPLE_META_PATH,
+                 face_size=FACE_IMAGE_SIZE):
+        self.data_path = data_path
+        self.index_path = index_path
+        self.meta_path = meta_path
+        self.width, self.height = face_size
+        self.frame_bytes = self.width * self.height
+        self._lock = threading.Lock()
+
+    # ---------- metadata ----------
+    def exists(self) -> bool:
+        return os.path.isfile(self.meta_path)
+
+    def _read_meta(self) -> dict:
+        if not self.exists():
+            return {"width": self.width, "height": self.height, "generation": 0}
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, meta: dict):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, self.meta_path)
+
+    def _ensure_meta(self):
+        if not self.exists():
+            os.makedirs(os.path.dirname(self.meta_path), exist_ok=True)
+            self._write_meta(self._read_meta())
+        meta = self._read_meta()
+        if (meta["width"], meta["height"]) != (self.width, self.height):
+            raise RuntimeError(
+                f"Sample store holds {meta['width']}x{meta['height']} crops but FACE_IMAGE_SIZE is "
+                f"{self.width}x{self.height}. Re-run the migration."
+            )
+        return meta
+
+    def __len__(self) -> int:
+        """Complete samples only: a torn append (crash between the two files) is ignored."""
+        if not self.exists():
+            return 0
+        frames = os.path.getsize(self.data_path) // self.frame_bytes if os.path.isfile(self.data_path) else 0
+        labels = os.path.getsize(self.index_path) // LABEL_DTYPE.itemsize if os.path.isfile(self.index_path) else 0
+        return min(frames, labels)
+
+    def state(self) -> dict:
+        """Generation and sample count, used by model_train to plan incremental training."""
+        return {"generation": self._read_meta()["generation"], "count": len(self)}
+
+    # ---------- writes ----------
+    @contextmanager
+    def _locked(self):
+        """Serialise writers across threads and (where fcntl exists) processes."""
+        with self._lock:
+            with open(self.meta_path + ".lock", "a") as fh:
+                if fcntl:
+                    fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def append(self, user_id: int, faces) -> int:
+        """Append one crop (H, W) or a batch (N, H, W) for user_id. Returns the user's sample count."""
+        faces = np.asarray(faces, dtype=np.uint8)
+        if faces.ndim == 2:
+            faces = faces[np.newaxis]
+        if faces.shape[1:] != (self.height, self.width):
+            faces = np.stack([cv2.resize(f, (self.width, self.height)) for f in faces])
+        self._ensure_meta()
+        with self._locked():
+            count = len(self)
+            # Truncate any torn tail so frames and labels stay aligned
+            with open(self.data_path, "ab") as f:
+                f.truncate(count * self.frame_bytes)
+                f.write(np.ascontiguousarray(faces).tobytes())
+            with open(self.index_path, "ab") as f:
+                f.truncate(count * LABEL_DTYPE.itemsize)
+                f.write(np.full(len(faces), user_id, dtype=LABEL_DTYPE).tobytes())
+        return self.count_for_user(user_id)
+
+    def remove_user(self, user_id: int) -> int:
+        """Drop every sample of user_id (compacts the files). Bumps the generation. Returns samples removed."""
+        with self._locked():
+            images, labels = self.load()
+            keep = labels != user_id
+            removed = int((~keep).sum())
+            if removed:
+                for path, data in ((self.data_path, images[keep]), (self.index_path, labels[keep])):
+                    tmp = path + ".tmp"
+                    np.ascontiguousarray(data).tofile(tmp)
+                    os.replace(tmp, path)
+                meta = self._read_meta()
+                meta["generation"] += 1
+                self._write_meta(meta)
+        return removed
+
+    # ---------- reads ----------
+    def load(self, start: int = 0, end: Optional[int] = None):
+        """
+        Memory-map samples [start:end] zero-copy. Returns (images (N, H, W) uint8, labels (N,) int32).
+        end pins the range to an earlier state() count, so concurrent appends are not included.
+        Views are read-only and stay valid while the arrays are referenced.
+        """
+        count = len(self) if end is None else min(end, len(self))
+        if count <= start:
+            return np.empty((0, self.height, self.width), np.uint8), np.empty(0, LABEL_DTYPE)
+        images = np.memmap(self.data_path, dtype=np.uint8, mode="r", shape=(count, self.height, self.width))
+        labels = np.memmap(self.index_path, dtype=LABEL_DTYPE, mode="r", shape=(count,))
+        return images[start:], labels[start:]
+
+    def labels(self) -> np.ndarray:
+        return self.load()[1]
+
+    def count_for_user(self, user_id: int) -> int:
+        return int(np.count_nonzero(self.labels() == user_id))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_sample_store() -> SampleStore:
+    """
+    Process-wide store. Legacy dataset/<user_id>/ images are never imported implicitly
+    (run `python sample_store.py migrate`); a store that was never written only gets a warning.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            store = SampleStore()
+            if not store.exists() and has_legacy_samples():
+                print("[WARN] dataset/ holds JPEG samples the packed store does not; run `python sample_store.py migrate`")
+            _store = store
+    return _store
+
+
+def migrate_from_dataset_dir(store: SampleStore = None, dataset_dir: str = DATASET_DIR) -> int:
+    """Import dataset/<user_id>/*.jpg into the packed store. Source files are left in place."""
+    if store is None:
+        store = SampleStore()
+    if len(store):
+        raise RuntimeError(f"Sample store at {store.data_path} is not empty; refusing to migrate twice.")
+    total = 0
+    for user_dir_name in sorted(os.listdir(dataset_dir)):
+        user_dir = os.path.join(dataset_dir, user_dir_name)
+        if not os.path.isdir(user_dir):
+            continue
+        try:
+            user_id = int(user_dir_name)
+        except ValueError:
+            continue
+        faces = []
+        for file in sorted(os.listdir(user_dir)):
+            if not file.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            img = cv2.imread(os.path.join(user_dir, file), cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                continue
+            faces.append(cv2.resize(img, (store.width, store.height)))
+        if faces:
+            store.append(user_id, np.stack(faces))
+            total += len(faces)
+            print(f"[INFO] User {user_id}: {len(faces)} samples")
+    print(f"[INFO] Migrated {total} samples into {store.data_path}")
+    return total
+
+
+def has_legacy_samples(dataset_dir: str = DATASET_DIR) -> bool:
+    """True if dataset/<user_id>/ holds per-image JPEG samples."""
+    if not os.path.isdir(dataset_dir):
+        return False
+    for name in os.listdir(dataset_dir):
+        path = os.path.join(dataset_dir, name)
+        if name.isdigit() and os.path.isdir(path):
+            if any(f.lower().endswith(IMAGE_EXTENSIONS) for f in os.listdir(path)):
+                return True
+    return False
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrate", "info"):
+        print("Usage: python sample_store.py migrate | info")
+        sys.exit(1)
+    if sys.argv[1] == "migrate":
+        migrate_from_dataset_dir()
+    else:
+        s = get_sample_store()
+        labels = s.labels()
+        print(f"[INFO] {len(s)} samples, {len(np.unique(labels))} users, generation {s.state()['generation']}")
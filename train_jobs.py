@@ -0,0 +1,121 @@
+"""
+FaceSense - Background training jobs.
+/api/train enqueues a job instead of training inside the request thread. A single worker
+runs jobs one at a time; requests arriving while a job is queued coalesce into it.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+
+from config import TRAIN_JOB_HISTORY
+
+_cond = threading.Condition()
+_jobs = OrderedDict()  # job_id -> job dict, oldest first
+_pending_id = None
+_running_id = None
+_worker = None
+
+
+def _new_job(full: bool) -> dict:
+    return {
+        "id": uuid.uuid4().hex[:12],
+        "status": "queued",  # queued | running | succeeded | failed
+        "full": full,
+        "phase": "queued",
+        "images_loaded": 0,
+        "users_processed": 0,
+        "users_total": 0,
+        "requests": 1,
+        "created_at": datetime.utcnow().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None,
+        "error": None,
+    }
+
+
+def _prune_locked():
+    while len(_jobs) > TRAIN_JOB_HISTORY:
+        oldest_id, oldest = next(iter(_jobs.items()))
+        if oldest["status"] in ("queued", "running"):
+            break
+        del _jobs[oldest_id]
+
+
+def _run(job_id: str, on_complete: Optional[Callable]):
+    from model_train import train_and_save_model
+
+    def progress(**fields):
+        with _cond:
+            _jobs[job_id].update(fields)
+
+    with _cond:
+        job = _jobs[job_id]
+        full = job["full"]
+        job.update(status="running", phase="scanning", started_at=datetime.utcnow().isoformat())
+    try:
+        result = train_and_save_model(incremental=not full, progress=progress)
+        if on_complete:
+            on_complete()
+        with _cond:
+            job.update(status="succeeded", phase="done", result=result)
+    except Exception as e:
+        with _cond:
+            job.update(status="failed", error=str(e))
+    finally:
+        with _cond:
+            job["finished_at"] = datetime.utcnow().isoformat()
+
+
+def _worker_loop(on_complete: Optional[Callable]):
+    global _pending_id, _running_id
+    while True:
+        with _cond:
+            while _pending_id is None:
+                _cond.wait()
+            _running_id, _pending_id = _pending_id, None
+        _run(_running_id, on_complete)
+        with _cond:
+            _running_id = None
+            _prune_locked()
+
+
+def submit_training(full: bool = False, on_complete: Optional[Callable] = None) -> Tuple[dict, bool]:
+    """
+    Queue a training run. Returns (job snapshot, coalesced).
+    If a job is already queued the request joins it (upgrading it to a full rebuild if asked);
+    if one is only running, a single follow-up job is queued so samples added meanwhile are included.
+    on_complete runs in the worker after a successful run (used to hot-swap the recognizer).
+    """
+    global _pending_id, _worker
+    with _cond:
+        if _worker is None:
+            _worker = threading.Thread(target=_worker_loop, args=(on_complete,), name="facesense-train", daemon=True)
+            _worker.start()
+        if _pending_id is not None:
+            job = _jobs[_pending_id]
+            job["requests"] += 1
+            job["full"] = job["full"] or full
+            return dict(job), True
+        job = _new_job(full)
+        _jobs[job["id"]] = job
+        _pending_id = job["id"]
+        _cond.notify()
+        return dict(job), False
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    with _cond:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def get_training_stats() -> dict:
+    with _cond:
+        return {
+            "queued": _pending_id,
+            "running": _running_id,
+            "jobs": len(_jobs),
+        }